@@ -6,7 +6,9 @@ from qiimp.src.util import HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY, \
     extract_config_dict, deepcopy_dict, load_df_with_best_fit_encoding
 from qiimp.src.metadata_extender import \
     write_extended_metadata, write_extended_metadata_from_df, \
-    get_reserved_cols, get_extended_metadata_from_df_and_yaml, \
+    write_extended_metadata_batch, validate_extended_metadata, \
+    extend_metadata_dfs, get_reserved_cols, \
+    get_extended_metadata_from_df_and_yaml, \
     write_metadata_results, id_missing_cols, find_standard_cols, \
     find_nonstandard_cols, get_qc_failures
 from qiimp.src.metadata_merger import merge_sample_and_subject_metadata, \
@@ -31,6 +33,8 @@ __all__ = ["HOSTTYPE_SHORTHAND_KEY", "SAMPLETYPE_SHORTHAND_KEY",
            "find_common_df_cols",
            "write_extended_metadata", "get_extended_metadata_from_df_and_yaml",
            "write_extended_metadata_from_df", "write_metadata_results",
+           "write_extended_metadata_batch", "validate_extended_metadata",
+           "extend_metadata_dfs",
            "get_reserved_cols", "id_missing_cols", "find_standard_cols",
            "find_nonstandard_cols", "get_qc_failures",
            "format_a_datetime", "standardize_input_sex",
@@ -1,5 +1,13 @@
 import click
-from qiimp import write_extended_metadata as _write_extended_metadata
+import json
+import tracemalloc
+from qiimp import write_extended_metadata as _write_extended_metadata, \
+    write_extended_metadata_batch as _write_extended_metadata_batch, \
+    validate_extended_metadata as _validate_extended_metadata
+from qiimp.src.util import STRING_STORAGE_OPTIONS
+from qiimp.src.metadata_extender import EXTENSION_BACKENDS, PANDAS_BACKEND, \
+    VALIDATION_CHUNK_SIZE
+from qiimp.src.metadata_validator import VALIDATION_ENGINES, CERBERUS_ENGINE
 
 
 @click.group()
@@ -23,11 +31,135 @@ def root():
 @click.option('--suppress_fails_files', is_flag=True,
               help='suppress output of QC and validation error files if no'
                    'errors found.  Default is to output empty files.')
+@click.option('--chunk_size', type=click.IntRange(min=1), default=None,
+              help='read and extend the metadata file this many rows at a '
+                   'time to limit memory use; not applicable to excel files. '
+                   'Default is to load the whole file at once.')
+@click.option('--string_storage', type=click.Choice(STRING_STORAGE_OPTIONS),
+              default=None,
+              help='carry string columns as pandas string dtype columns '
+                   'with this storage ("pyarrow" requires pyarrow). '
+                   'Default is to use object columns.')
+@click.option('--backend', type=click.Choice(EXTENSION_BACKENDS),
+              default=PANDAS_BACKEND,
+              help='library to run the extension in ("polars" requires '
+                   'polars); the output is the same either way.')
+@click.option('--validation_engine', type=click.Choice(VALIDATION_ENGINES),
+              default=CERBERUS_ENGINE,
+              help='validate the extended metadata a row at a time with '
+                   'cerberus or a column at a time with the vectorized '
+                   'engine; the validation errors are the same either way.')
+@click.option('--max_errors', type=click.IntRange(min=0), default=None,
+              help='stop validating each host type + sample type group '
+                   'after this many validation errors, noting where '
+                   'validation stopped.  Default is no limit.')
+@click.option('--max_errors_per_field', type=click.IntRange(min=0),
+              default=None,
+              help='stop validating a field in each host type + sample type '
+                   'group after this many validation errors in it, noting '
+                   'where validation stopped.  Default is no limit.')
+@click.option('--keep_internals', is_flag=True,
+              help='keep the internal columns (such as the host and sample '
+                   'type shorthands) and the QC failures in the extended '
+                   'metadata file; use this for files to be re-checked with '
+                   'the validate command, which otherwise needs every '
+                   'sample\'s host and sample type given.')
+@click.option('--timings_fp', type=click.Path(dir_okay=False), default=None,
+              help='write the duration and rows in and out of each stage of '
+                   'the extension to this JSON file.')
+@click.option('--trace_memory', is_flag=True,
+              help='also record the bytes allocated by each stage in the '
+                   'timings file; this slows the extension down.')
 def write_extended_metadata(metadata_file_path, config_fp,
-                            out_dir, name_base, sep, suppress_fails_files):
-    _write_extended_metadata(
-        metadata_file_path, config_fp, out_dir, name_base,
-        sep, suppress_fails_files)
+                            out_dir, name_base, sep, suppress_fails_files,
+                            chunk_size, string_storage, backend,
+                            validation_engine, max_errors,
+                            max_errors_per_field, keep_internals, timings_fp,
+                            trace_memory):
+    timing_events = []
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        _write_extended_metadata(
+            metadata_file_path, config_fp, out_dir, name_base,
+            sep, remove_internals=not keep_internals,
+            suppress_empty_fails=suppress_fails_files, chunk_size=chunk_size,
+            string_storage=string_storage, backend=backend,
+            validation_engine=validation_engine, max_errors=max_errors,
+            max_errors_per_field=max_errors_per_field,
+            timings_callback=timing_events.append if timings_fp else None)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    if timings_fp:
+        with open(timings_fp, "w") as timings_file:
+            # host and sample types may be numpy scalars
+            json.dump(timing_events, timings_file, indent=2, default=str)
+
+
+@root.command("write-extended-metadata-batch",
+              context_settings={'show_default': True})
+@click.argument('config_fp', type=click.Path(exists=True))
+#                help='path to the study-specific config yaml file')
+@click.argument('metadata_file_paths', nargs=-1, required=True,
+                type=click.Path(exists=True))
+#                help='paths to the metadata files to be extended')
+@click.option('--out_dir', default=".",
+              help='output directory for the extended metadata files')
+@click.option('--sep', default="\t",
+              help='separator of output files (default is tab)')
+@click.option('--suppress_fails_files', is_flag=True,
+              help='suppress output of QC and validation error files if no'
+                   'errors found.  Default is to output empty files.')
+@click.option('--summary_name_base', default="batch",
+              help='base name for the batch summary file')
+def write_extended_metadata_batch(config_fp, metadata_file_paths, out_dir,
+                                  sep, suppress_fails_files,
+                                  summary_name_base):
+    _write_extended_metadata_batch(
+        list(metadata_file_paths), config_fp, out_dir, sep=sep,
+        suppress_empty_fails=suppress_fails_files,
+        summary_name_base=summary_name_base)
+
+
+@root.command("validate", context_settings={'show_default': True})
+@click.argument('extended_metadata_fp', type=click.Path(exists=True))
+#                help='path to the extended metadata file to be validated')
+@click.argument('config_fp', type=click.Path(exists=True))
+#                help='path to the study-specific config yaml file')
+@click.argument('name_base', type=str)
+#                help='base name for the output validation errors file')
+@click.option('--out_dir', default=".",
+              help='output directory for the validation errors file')
+@click.option('--chunk_size', type=click.IntRange(min=1),
+              default=VALIDATION_CHUNK_SIZE,
+              help='read and validate the extended metadata file this many '
+                   'rows at a time to limit memory use.')
+@click.option('--suppress_fails_files', is_flag=True,
+              help='suppress output of the validation error file if no '
+                   'errors found.  Default is to output an empty file.')
+@click.option('--validation_engine', type=click.Choice(VALIDATION_ENGINES),
+              default=CERBERUS_ENGINE,
+              help='validate the extended metadata a row at a time with '
+                   'cerberus or a column at a time with the vectorized '
+                   'engine; the validation errors are the same either way.')
+@click.option('--host_type', default=None,
+              help='host type of every sample, used in place of the host '
+                   'type shorthand column; needed (with --sample_type) for '
+                   'files written without --keep_internals.')
+@click.option('--sample_type', default=None,
+              help='sample type of every sample, used in place of the '
+                   'sample type shorthand column; needed (with --host_type) '
+                   'for files written without --keep_internals.')
+def validate(extended_metadata_fp, config_fp, name_base, out_dir, chunk_size,
+             suppress_fails_files, validation_engine, host_type, sample_type):
+    num_validation_msgs = _validate_extended_metadata(
+        extended_metadata_fp, config_fp, out_dir, name_base,
+        chunk_size=chunk_size, suppress_empty_fails=suppress_fails_files,
+        validation_engine=validation_engine, host_type=host_type,
+        sample_type=sample_type)
+    click.echo(f"{num_validation_msgs} validation errors found")
 
 
 if __name__ == '__main__':
@@ -1,9 +1,330 @@
-from typing import Dict, Optional, Any
-from qiimp.src.util import extract_stds_config, deepcopy_dict, \
+from collections.abc import Mapping
+from typing import Dict, FrozenSet, Iterator, Optional, Tuple, Any
+from qiimp.src.util import extract_stds_config, \
     METADATA_FIELDS_KEY, STUDY_SPECIFIC_METADATA_KEY, \
     HOST_TYPE_SPECIFIC_METADATA_KEY, \
     SAMPLE_TYPE_SPECIFIC_METADATA_KEY, ALIAS_KEY, BASE_TYPE_KEY, \
-    DEFAULT_KEY, ALLOWED_KEY, ANYOF_KEY, TYPE_KEY
+    DEFAULT_KEY, ALLOWED_KEY, ANYOF_KEY, TYPE_KEY, REQUIRED_KEY, \
+    SAMPLE_TYPE_KEY, QIITA_SAMPLE_TYPE, LEAVE_REQUIREDS_BLANK_KEY, \
+    OVERWRITE_NON_NANS_KEY, fingerprint_obj
+
+
+class ResolvedSampleTypeSchema:
+    """Fully-resolved metadata definitions for one host+sample type.
+
+    Attributes
+    ----------
+    metadata_fields_dict : Dict[str, Any]
+        Complete metadata fields dictionary for the host+sample type, with
+        aliases, base types, and host inheritance already resolved.
+    default_vals_dict : Dict[str, Any]
+        Default value for each field that has one, in field order.
+    required_placeholder_fields : List[str]
+        Fields that are required but have no default, in field order;
+        these get a placeholder value if they are missing from the metadata.
+    reserved_fields : FrozenSet[str]
+        Every field that extension adds to the metadata for the host+sample
+        type: those with a default plus the required placeholder fields.
+    """
+
+    def __init__(self, metadata_fields_dict: Dict[str, Any]):
+        self.metadata_fields_dict = metadata_fields_dict
+        self.default_vals_dict = {}
+        self.required_placeholder_fields = []
+        for curr_field_name, curr_field_vals_dict in \
+                metadata_fields_dict.items():
+            if DEFAULT_KEY in curr_field_vals_dict:
+                self.default_vals_dict[curr_field_name] = \
+                    curr_field_vals_dict[DEFAULT_KEY]
+            elif curr_field_vals_dict.get(REQUIRED_KEY):
+                self.required_placeholder_fields.append(curr_field_name)
+        # next metadata field
+        self.reserved_fields = frozenset(self.default_vals_dict) | \
+            frozenset(self.required_placeholder_fields)
+
+
+class ResolvedSchemaIndex:
+    """Index of fully-resolved metadata definitions by host and sample type.
+
+    Built once from a full flat-host-type config dict. Settings for a host
+    type and schemas for a host+sample type are resolved the first time
+    they are requested and memoized, so every later request for the same
+    host (+sample) type is a dictionary lookup. The index is shared between
+    callers, so nothing it returns may be modified.
+
+    Parameters
+    ----------
+    full_flat_config_dict : Dict[str, Any]
+        Fully combined flat-host-type config dictionary.
+    """
+
+    def __init__(self, full_flat_config_dict: Dict[str, Any]):
+        self.full_flat_config_dict = full_flat_config_dict
+        self.settings_dict = {
+            DEFAULT_KEY: full_flat_config_dict.get(DEFAULT_KEY),
+            LEAVE_REQUIREDS_BLANK_KEY:
+                full_flat_config_dict.get(LEAVE_REQUIREDS_BLANK_KEY),
+            OVERWRITE_NON_NANS_KEY:
+                full_flat_config_dict.get(OVERWRITE_NON_NANS_KEY)}
+        self._host_types_dict = \
+            full_flat_config_dict[HOST_TYPE_SPECIFIC_METADATA_KEY]
+        self._host_settings_dicts = {}
+        self._sample_type_schemas = {}
+        self._schema_fingerprints = {}
+
+    def has_host_type(self, host_type: str) -> bool:
+        """Check whether a host type is defined in the config.
+
+        Parameters
+        ----------
+        host_type : str
+            Host type shorthand.
+
+        Returns
+        -------
+        bool
+            True if the host type is defined, False otherwise.
+        """
+        return host_type in self._host_types_dict
+
+    def has_sample_type(self, host_type: str, sample_type: str) -> bool:
+        """Check whether a sample type is defined for a (defined) host type.
+
+        Parameters
+        ----------
+        host_type : str
+            Host type shorthand; must be defined in the config.
+        sample_type : str
+            Sample type shorthand.
+
+        Returns
+        -------
+        bool
+            True if the sample type is defined for the host type.
+        """
+        return sample_type in self._host_types_dict[host_type].get(
+            SAMPLE_TYPE_SPECIFIC_METADATA_KEY, {})
+
+    def get_host_type_settings_dict(self, host_type: str) -> Dict[str, Any]:
+        """Get the global settings overlaid with any host-type-specific ones.
+
+        Parameters
+        ----------
+        host_type : str
+            Host type shorthand; must be defined in the config.
+
+        Returns
+        -------
+        Dict[str, Any]
+            Settings (default, leave requireds blank, overwrite non-nans)
+            for the host type.
+        """
+        host_settings_dict = self._host_settings_dicts.get(host_type)
+        if host_settings_dict is None:
+            host_settings_dict = dict(self.settings_dict)
+            # if this host type has a default value for empty fields, use it;
+            # otherwise, use the global default
+            host_settings_dict[DEFAULT_KEY] = \
+                self._host_types_dict[host_type].get(
+                    DEFAULT_KEY, host_settings_dict[DEFAULT_KEY])
+            self._host_settings_dicts[host_type] = host_settings_dict
+        return host_settings_dict
+
+    def get_sample_type_schema(
+            self, host_type: str, sample_type: str) -> ResolvedSampleTypeSchema:
+        """Get the fully-resolved metadata definitions for a host+sample type.
+
+        Parameters
+        ----------
+        host_type : str
+            Host type shorthand; must be defined in the config.
+        sample_type : str
+            Sample type shorthand; must be defined for the host type.
+
+        Returns
+        -------
+        ResolvedSampleTypeSchema
+            Resolved metadata definitions for the host+sample type.
+
+        Raises
+        ------
+        ValueError
+            If there are invalid alias chains or base type configurations.
+        """
+        schema_key = (host_type, sample_type)
+        schema = self._sample_type_schemas.get(schema_key)
+        if schema is None:
+            a_host_type_config_dict = self._host_types_dict[host_type]
+            # the host type's metadata fields are the default fields that
+            # will be overridden, if necessary, by sample type-specific fields
+            metadata_fields_dict = \
+                construct_sample_type_metadata_fields_dict(
+                    sample_type,
+                    a_host_type_config_dict[SAMPLE_TYPE_SPECIFIC_METADATA_KEY],
+                    a_host_type_config_dict.get(METADATA_FIELDS_KEY, {}))
+            schema = ResolvedSampleTypeSchema(metadata_fields_dict)
+            self._sample_type_schemas[schema_key] = schema
+        return schema
+
+    def get_schema_fingerprint(self, host_type: str, sample_type: str) -> str:
+        """Get a fingerprint of everything in the config that affects a host+sample type.
+
+        Parameters
+        ----------
+        host_type : str
+            Host type shorthand.
+        sample_type : str
+            Sample type shorthand.
+
+        Returns
+        -------
+        str
+            Hex digest that changes whenever the global settings, the host
+            type's settings, or the host+sample type's resolved metadata
+            definitions change (including the host or sample type becoming
+            valid or invalid).
+        """
+        fingerprint_key = (host_type, sample_type)
+        fingerprint = self._schema_fingerprints.get(fingerprint_key)
+        if fingerprint is None:
+            fingerprint_parts = [self.settings_dict]
+            if self.has_host_type(host_type):
+                fingerprint_parts.append(
+                    self.get_host_type_settings_dict(host_type))
+                if self.has_sample_type(host_type, sample_type):
+                    fingerprint_parts.append(self.get_sample_type_schema(
+                        host_type, sample_type).metadata_fields_dict)
+            # endif host type is valid
+            fingerprint = fingerprint_obj(fingerprint_parts)
+            self._schema_fingerprints[fingerprint_key] = fingerprint
+        return fingerprint
+
+    def get_reserved_fields(
+            self, host_type: str, sample_type: str) -> FrozenSet[str]:
+        """Get the fields that extension adds for a host+sample type.
+
+        Parameters
+        ----------
+        host_type : str
+            Host type shorthand.
+        sample_type : str
+            Sample type shorthand.
+
+        Returns
+        -------
+        FrozenSet[str]
+            The reserved fields of the host+sample type's schema, or an empty
+            set if the host type or sample type is not in the config (since
+            extension adds nothing for those beyond a QC note).
+        """
+        if not self.has_host_type(host_type) or \
+                not self.has_sample_type(host_type, sample_type):
+            return frozenset()
+        return self.get_sample_type_schema(
+            host_type, sample_type).reserved_fields
+
+
+class LazyFlatHostTypesDict(Mapping):
+    """Read-only flat host types dictionary that flattens host types on demand.
+
+    Behaves like the output of flatten_nested_stds_dict (same keys, in the
+    same order, with equal values) but flattens a host type--and, to do so,
+    its ancestors--only when it is first looked up, memoizing every host
+    type it flattens. Extension then costs time proportional to the host
+    types actually present in the metadata rather than to the size of the
+    standards.
+
+    Parameters
+    ----------
+    stds_nested_dict : Dict[str, Any]
+        Nested-host-type standards dictionary (containing a
+        HOST_TYPE_SPECIFIC_METADATA_KEY). It must not be modified after
+        being passed in.
+    """
+
+    def __init__(self, stds_nested_dict: Dict[str, Any]):
+        # maps each path of host type names (from the top level down to a
+        # host type) to the nested dict at the end of it
+        self._nested_dicts_by_path = {}
+        # maps each path to the flattened dict for the host type it ends in
+        self._flat_dicts_by_path = {}
+        # maps each host type to its path
+        self._host_type_paths = self._index_host_types(stds_nested_dict, ())
+
+    def __getitem__(self, host_type: str) -> Dict[str, Any]:
+        return self._flatten_path(self._host_type_paths[host_type])
+
+    def __contains__(self, host_type: object) -> bool:
+        # check membership without flattening (as Mapping's default would)
+        return host_type in self._host_type_paths
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._host_type_paths)
+
+    def __len__(self) -> int:
+        return len(self._host_type_paths)
+
+    def _index_host_types(
+            self, parent_stds_nested_dict: Dict[str, Any],
+            parent_path: Tuple[str, ...]) -> Dict[str, Tuple[str, ...]]:
+        """Record the path to every host type, without flattening any.
+
+        Note: this method is called recursively, and visits and records
+        host types in the same order as flatten_nested_stds_dict, so that
+        (if a host type name is repeated) the same definition wins.
+
+        Parameters
+        ----------
+        parent_stds_nested_dict : Dict[str, Any]
+            Parent (previous host)-level standards nested dictionary.
+        parent_path : Tuple[str, ...]
+            Path of host type names leading to the parent level.
+
+        Returns
+        -------
+        Dict[str, Tuple[str, ...]]
+            Paths to all host types at or below the parent level.
+        """
+        wip_host_type_paths = {}
+        parent_stds_host_types_dict = \
+            parent_stds_nested_dict.get(HOST_TYPE_SPECIFIC_METADATA_KEY, {})
+        for curr_host_type, curr_host_type_stds_nested_dict \
+                in parent_stds_host_types_dict.items():
+            curr_path = parent_path + (curr_host_type,)
+            self._nested_dicts_by_path[curr_path] = \
+                curr_host_type_stds_nested_dict
+
+            wip_host_type_paths.update(self._index_host_types(
+                curr_host_type_stds_nested_dict, curr_path))
+            wip_host_type_paths[curr_host_type] = curr_path
+        # next host type
+
+        return wip_host_type_paths
+
+    def _flatten_path(self, host_type_path: Tuple[str, ...]) -> Dict[str, Any]:
+        """Get the flattened dict for the host type at the end of a path.
+
+        Parameters
+        ----------
+        host_type_path : Tuple[str, ...]
+            Path of host type names from the top level to the host type.
+
+        Returns
+        -------
+        Dict[str, Any]
+            Flattened host type dictionary with complete metadata definitions.
+        """
+        flat_host_type_dict = self._flat_dicts_by_path.get(host_type_path)
+        if flat_host_type_dict is None:
+            parent_flat_host_dict = {}
+            if len(host_type_path) > 1:
+                parent_flat_host_dict = \
+                    self._flatten_path(host_type_path[:-1])
+            flat_host_type_dict = _combine_base_and_added_host_type(
+                parent_flat_host_dict,
+                self._nested_dicts_by_path[host_type_path])
+            self._flat_dicts_by_path[host_type_path] = flat_host_type_dict
+        return flat_host_type_dict
 
 
 def combine_stds_and_study_config(
@@ -148,6 +469,91 @@ def update_wip_metadata_dict(
     return wip_metadata_fields_dict
 
 
+def construct_sample_type_metadata_fields_dict(
+        sample_type: str,
+        host_sample_types_config_dict: Dict[str, Any],
+        a_host_type_metadata_fields_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Construct metadata fields dictionary for a specific host+sample type, resolving aliases and base types.
+
+    Parameters
+    ----------
+    sample_type : str
+        The sample type to process.
+    host_sample_types_config_dict : Dict[str, Any]
+        Dictionary containing config for *all* sample types in
+        the host type in question.
+    a_host_type_metadata_fields_dict : Dict[str, Any]
+        Dictionary containing metadata fields for the host type in question.
+        This is not modified.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The constructed metadata fields dictionary for this host-and-sample-type combination.
+
+    Raises
+    ------
+    ValueError
+        If there are invalid alias chains or base type configurations.
+    """
+    sample_type_for_metadata = sample_type
+
+    # get dict associated with the naive sample type
+    sample_type_specific_dict = \
+        host_sample_types_config_dict[sample_type]
+
+    # if naive sample type contains an alias
+    sample_type_alias = sample_type_specific_dict.get(ALIAS_KEY)
+    if sample_type_alias:
+        # change the sample type to the alias sample type
+        # and use the alias's sample type dict
+        sample_type_for_metadata = sample_type_alias
+        sample_type_specific_dict = \
+            host_sample_types_config_dict[sample_type_alias]
+        if METADATA_FIELDS_KEY not in sample_type_specific_dict:
+            raise ValueError(f"May not chain aliases "
+                             f"('{sample_type}' to '{sample_type_alias}')")
+    # endif sample type is an alias
+
+    # if the sample type has a base type
+    sample_type_base = sample_type_specific_dict.get(BASE_TYPE_KEY)
+    if sample_type_base:
+        # get the base's sample type dict and add this sample type's
+        # info on top of it
+        base_sample_dict = host_sample_types_config_dict[sample_type_base]
+        if list(base_sample_dict.keys()) != [METADATA_FIELDS_KEY]:
+            raise ValueError(f"Base sample type '{sample_type_base}' "
+                             f"must only have metadata fields")
+        # don't add to the sample type dict in place, since the config
+        # it came from may be shared (e.g., cached) and must not change
+        sample_type_specific_dict_metadata = _overlay_metadata_fields_dicts(
+            sample_type_specific_dict.get(METADATA_FIELDS_KEY, {}),
+            base_sample_dict[METADATA_FIELDS_KEY])
+        sample_type_specific_dict = sample_type_specific_dict | {
+            METADATA_FIELDS_KEY: sample_type_specific_dict_metadata}
+    # endif sample type has a base type
+
+    # add the sample-type-specific info generated above on top of the host info
+    sample_type_metadata_dict = _overlay_metadata_fields_dicts(
+        a_host_type_metadata_fields_dict,
+        sample_type_specific_dict.get(METADATA_FIELDS_KEY, {}))
+
+    # set sample_type, and qiita_sample_type if it is not already set
+    sample_type_definition = {
+        ALLOWED_KEY: [sample_type_for_metadata],
+        DEFAULT_KEY: sample_type_for_metadata,
+        TYPE_KEY: "string"
+    }
+    sample_type_metadata_dict = _overlay_metadata_fields_dicts(
+        sample_type_metadata_dict, {SAMPLE_TYPE_KEY: sample_type_definition})
+    if QIITA_SAMPLE_TYPE not in sample_type_metadata_dict:
+        sample_type_metadata_dict = _overlay_metadata_fields_dicts(
+            sample_type_metadata_dict, {QIITA_SAMPLE_TYPE: sample_type_definition})
+    # end if qiita_sample_type not already set
+
+    return sample_type_metadata_dict
+
+
 def _make_combined_stds_and_study_host_type_dicts(
         flat_study_dict: Dict[str, Any],
         parent_host_stds_nested_dict: Dict[str, Any]) \
@@ -182,10 +588,9 @@ def _make_combined_stds_and_study_host_type_dicts(
 
     parent_stds_host_types_dict = \
         parent_host_stds_nested_dict.get(HOST_TYPE_SPECIFIC_METADATA_KEY, {})
-    # define the output dictionary as a copy of the parent-level standard.
-    # This will be augmented if there are any hosts at this level.
-    wip_host_types_dict = \
-        deepcopy_dict(parent_stds_host_types_dict)
+    # define the output dictionary as a (shallow) copy of the parent-level
+    # standard; every host type in it is replaced in the loop below.
+    wip_host_types_dict = dict(parent_stds_host_types_dict)
 
     # loop over the host types at this level in parent_stds_nested_dict;
     # these are what we will be copying to add *TO*
@@ -195,9 +600,10 @@ def _make_combined_stds_and_study_host_type_dicts(
         # only need to do work at this level if curr host type is in study dict
         # since otherwise the wip dict is an unchanged copy of the stds dict
         if curr_host_type not in study_host_types_dict:
-            # make a copy of the stds for the current host type to add info to
+            # make a (shallow) copy of the stds for the current host type to
+            # add info to; its unchanged contents are shared with the stds
             curr_host_type_wip_nested_dict = \
-                deepcopy_dict(curr_host_type_stds_nested_dict)
+                dict(curr_host_type_stds_nested_dict)
         else:
             curr_host_type_wip_nested_dict = \
                 _combine_base_and_added_host_type(
@@ -242,9 +648,10 @@ def _combine_base_and_added_host_type(
     Dict[str, Any]
         Combined host type configuration dictionary.
     """
-    # make a copy of the base for the current host type to add info to
-    host_type_wip_nested_dict = \
-        deepcopy_dict(host_type_base_dict)
+    # make a (shallow) copy of the base for the current host type to add
+    # info to; anything that is added to is replaced with a new dict below,
+    # so the base itself never changes
+    host_type_wip_nested_dict = dict(host_type_base_dict)
 
     # look for a default key in the add dict for this host; if
     # it exists, add it to the wip dict (ok to overwrite existing)
@@ -297,17 +704,10 @@ def _combine_base_and_added_metadata_fields(
     Dict[str, Any]
         Combined metadata fields dictionary.
     """
-    # copy the metadata fields from the base to make the wip metadata fields
-    host_type_wip_metadata_fields_dict = deepcopy_dict(
-        host_type_base_dict.get(METADATA_FIELDS_KEY, {}))
-
-    # update the wip with the add metadata fields
-    host_type_add_metadata_fields_dict = \
-        host_type_add_dict.get(METADATA_FIELDS_KEY, {})
-    host_type_wip_metadata_fields_dict = \
-        update_wip_metadata_dict(
-            host_type_wip_metadata_fields_dict,
-            host_type_add_metadata_fields_dict)
+    # overlay the add metadata fields on the base metadata fields
+    host_type_wip_metadata_fields_dict = _overlay_metadata_fields_dicts(
+        host_type_base_dict.get(METADATA_FIELDS_KEY, {}),
+        host_type_add_dict.get(METADATA_FIELDS_KEY, {}))
 
     return host_type_wip_metadata_fields_dict
 
@@ -334,8 +734,9 @@ def _combine_base_and_added_sample_type_specific_metadata(
     ValueError
         If sample type has both alias and metadata fields, or both alias and base type.
     """
-    # copy the dictionary of sample types from the base to make the wip dict
-    curr_host_wip_sample_types_dict = deepcopy_dict(
+    # (shallowly) copy the dictionary of sample types from the base to make
+    # the wip dict; any sample type that is changed is replaced below
+    curr_host_wip_sample_types_dict = dict(
         host_type_base_dict.get(
             SAMPLE_TYPE_SPECIFIC_METADATA_KEY, {}))
 
@@ -346,7 +747,7 @@ def _combine_base_and_added_sample_type_specific_metadata(
     for curr_sample_type, curr_sample_type_add_dict \
             in curr_host_add_sample_types_dict.items():
 
-        curr_sample_type_wip_dict = deepcopy_dict(
+        curr_sample_type_wip_dict = dict(
             curr_host_wip_sample_types_dict.get(curr_sample_type, {}))
 
         curr_sample_type_add_def_type = \
@@ -367,9 +768,9 @@ def _combine_base_and_added_sample_type_specific_metadata(
 
             # first, add all non-metadata fields from the add dict to the wip;
             # this captures, e.g., base_type
-            curr_sample_type_add_dict_wo_metadata = deepcopy_dict(
-                curr_sample_type_add_dict)
-            del curr_sample_type_add_dict_wo_metadata[METADATA_FIELDS_KEY]
+            curr_sample_type_add_dict_wo_metadata = {
+                k: v for k, v in curr_sample_type_add_dict.items()
+                if k != METADATA_FIELDS_KEY}
             curr_sample_type_wip_dict.update(
                 curr_sample_type_add_dict_wo_metadata)
 
@@ -378,7 +779,7 @@ def _combine_base_and_added_sample_type_specific_metadata(
             curr_sample_type_wip_metadata_fields_dict = \
                 curr_sample_type_wip_dict[METADATA_FIELDS_KEY]
             curr_sample_type_wip_metadata_fields_dict = (
-                update_wip_metadata_dict(
+                _overlay_metadata_fields_dicts(
                     curr_sample_type_wip_metadata_fields_dict,
                     curr_sample_type_add_metadata_fields_dict))
             # if the above combination is not of two empties
@@ -404,6 +805,42 @@ def _combine_base_and_added_sample_type_specific_metadata(
     return curr_host_wip_sample_types_dict
 
 
+def _overlay_metadata_fields_dicts(
+        base_metadata_fields_dict: Dict[str, Any],
+        add_metadata_fields_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Make a new metadata fields dict with the add fields overlaid on the base fields.
+
+    Gives the same result as deep-copying the base and updating the copy
+    with update_wip_metadata_dict, but copies only the definitions of the
+    fields being overridden. All other field definitions (and any values,
+    like allowed lists, within the overridden ones) are shared with the
+    inputs, so inheritance costs memory proportional to the overrides only.
+    Neither input is modified, and (since they may be shared) the output's
+    field definitions must not be modified in place either.
+
+    Parameters
+    ----------
+    base_metadata_fields_dict : Dict[str, Any]
+        Metadata fields dictionary to overlay onto.
+    add_metadata_fields_dict : Dict[str, Any]
+        Metadata fields dictionary whose definitions override the base's.
+
+    Returns
+    -------
+    Dict[str, Any]
+        New combined metadata fields dictionary.
+    """
+    wip_metadata_fields_dict = dict(base_metadata_fields_dict)
+    # copy (only) the field definitions that are about to be changed
+    for curr_metadata_field in add_metadata_fields_dict:
+        if curr_metadata_field in wip_metadata_fields_dict:
+            wip_metadata_fields_dict[curr_metadata_field] = \
+                dict(wip_metadata_fields_dict[curr_metadata_field])
+
+    return update_wip_metadata_dict(
+        wip_metadata_fields_dict, add_metadata_fields_dict)
+
+
 def _id_sample_type_definition(sample_type_name: str, sample_type_dict: Dict[str, Any]) -> str:
     """Identify the type of sample type definition in the dictionary.
 
@@ -1,25 +1,30 @@
 import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import os
 import pandas
 from pathlib import Path
+import tempfile
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Iterable, Optional, Set, Tuple, Any, Callable
 from qiimp.src.util import extract_config_dict, extract_stds_config, \
     deepcopy_dict, validate_required_columns_exist, get_extension, \
     load_df_with_best_fit_encoding, update_metadata_df_field, \
+    update_metadata_df_fields, load_df_chunks_with_best_fit_encoding, \
+    convert_str_cols_to_string_dtype, StageTimer, STAGE_ROWS_OUT_KEY, \
     HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY, \
     QC_NOTE_KEY, METADATA_FIELDS_KEY, HOST_TYPE_SPECIFIC_METADATA_KEY, \
-    SAMPLE_TYPE_SPECIFIC_METADATA_KEY, SAMPLE_TYPE_KEY, QIITA_SAMPLE_TYPE, \
-    DEFAULT_KEY, REQUIRED_KEY, ALIAS_KEY, BASE_TYPE_KEY, \
-    LEAVE_BLANK_VAL, SAMPLE_NAME_KEY, \
-    ALLOWED_KEY, TYPE_KEY, LEAVE_REQUIREDS_BLANK_KEY, OVERWRITE_NON_NANS_KEY, \
+    DEFAULT_KEY, REQUIRED_KEY, LEAVE_BLANK_VAL, SAMPLE_NAME_KEY, \
+    LEAVE_REQUIREDS_BLANK_KEY, OVERWRITE_NON_NANS_KEY, \
     METADATA_TRANSFORMERS_KEY, PRE_TRANSFORMERS_KEY, POST_TRANSFORMERS_KEY, \
-    SOURCES_KEY, FUNCTION_KEY, REQUIRED_RAW_METADATA_FIELDS
+    SOURCES_KEY, FUNCTION_KEY, REQUIRED_RAW_METADATA_FIELDS, \
+    fingerprint_obj, fingerprint_file, get_stds_fp, fill_nas_with_constant
 from qiimp.src.metadata_configurator import combine_stds_and_study_config, \
-    flatten_nested_stds_dict, update_wip_metadata_dict
+    LazyFlatHostTypesDict, ResolvedSchemaIndex
 from qiimp.src.metadata_validator import validate_metadata_df, \
-    output_validation_msgs
+    output_validation_msgs, convert_numeric_text, CERBERUS_ENGINE, \
+    VALIDATION_ENGINES
 import qiimp.src.metadata_transformers as transformers
 
 
@@ -29,6 +34,51 @@ INTERNAL_COL_KEYS = [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY,
 
 REQ_PLACEHOLDER = "_QIIMP2_REQUIRED"
 
+INVALID_HOST_TYPE_QC_NOTE = "invalid host_type"
+INVALID_SAMPLE_TYPE_QC_NOTE = "invalid sample_type"
+# every value the QC_NOTE_KEY column can hold during extension
+QC_NOTE_CATEGORIES = [LEAVE_BLANK_VAL, "", INVALID_HOST_TYPE_QC_NOTE,
+                      INVALID_SAMPLE_TYPE_QC_NOTE]
+
+# columns of the summary of a batch extension
+BATCH_INPUT_KEY = "input"
+BATCH_NUM_SAMPLES_KEY = "num_samples"
+BATCH_NUM_QC_FAILS_KEY = "num_qc_fails"
+BATCH_NUM_VALIDATION_MSGS_KEY = "num_validation_msgs"
+BATCH_SUMMARY_COLS = [BATCH_INPUT_KEY, BATCH_NUM_SAMPLES_KEY,
+                      BATCH_NUM_QC_FAILS_KEY, BATCH_NUM_VALIDATION_MSGS_KEY]
+
+# inputs with at least this many rows carry the internal columns as
+# categoricals during extension unless told otherwise
+CATEGORICAL_MIN_ROWS = 100000
+
+# ways of running an extension; the polars backend requires polars
+PANDAS_BACKEND = "pandas"
+POLARS_BACKEND = "polars"
+EXTENSION_BACKENDS = [PANDAS_BACKEND, POLARS_BACKEND]
+
+# names of the timed stages of an extension (see StageTimer)
+INITIALIZE_STAGE = "initialize"
+PRE_TRANSFORM_STAGE = "pre_transform"
+ENCODE_CATEGORICALS_STAGE = "encode_categoricals"
+GENERATE_GROUP_STAGE = "generate_group"
+VALIDATE_GROUP_STAGE = "validate_group"
+COMBINE_GROUPS_STAGE = "combine_groups"
+POST_TRANSFORM_STAGE = "post_transform"
+CONVERT_STRINGS_STAGE = "convert_strings"
+REORDER_STAGE = "reorder"
+WRITE_STAGE = "write"
+
+# number of rows of an extended metadata file to validate at a time
+VALIDATION_CHUNK_SIZE = 10000
+
+# maximum number of resolved configs (schema indexes) to keep in memory
+MAX_CACHED_CONFIGS = 16
+_SCHEMA_INDEX_CACHE = OrderedDict()
+
+# resolved schema index held by each worker process of a parallel extension
+_WORKER_SCHEMA_INDEX = None
+
 # Define a logger for this module
 logger = logging.getLogger(__name__)
 
@@ -49,6 +99,10 @@ def get_reserved_cols(
         irb_institute for human host types) are not *required*, but are *reserved*, so they can
         only be used to name columns that hold standardized info, not for arbitrary metadata.
 
+    The columns are derived directly from the resolved config (memoized per
+        host+sample type) rather than by extending the metadata, so neither
+        the metadata values nor the transformer functions are used.
+
     Parameters
     ----------
     raw_metadata_df : pandas.DataFrame
@@ -56,7 +110,8 @@ def get_reserved_cols(
     study_specific_config_dict : Dict[str, Any]
         Study-specific flat-host-type config dictionary.
     study_specific_transformers_dict : Optional[Dict[str, Any]], default=None
-        Dictionary of custom transformers for this study (only).
+        Dictionary of custom transformers for this study (only). Not needed
+        to find the reserved columns; accepted for compatibility.
 
     Returns
     -------
@@ -73,24 +128,52 @@ def get_reserved_cols(
         raw_metadata_df, [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY],
         "metadata missing required columns")
 
-    # get unique HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY combinations
-    temp_df = raw_metadata_df[
-        [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]].copy()
-    temp_df.drop_duplicates(inplace=True)
+    schema_index = _resolve_schema_index(study_specific_config_dict)
+
+    # the sample name and internal columns are always in extended metadata,
+    # as are the targets of any transformers
+    reserved_cols = {SAMPLE_NAME_KEY, *INTERNAL_COL_KEYS}
+    reserved_cols.update(
+        _get_transformer_target_fields(schema_index.full_flat_config_dict))
 
-    # add a bogus SAMPLE_NAME_KEY column to the df that just holds sequential integers
-    temp_df[SAMPLE_NAME_KEY] = range(1, len(temp_df) + 1)
+    # get unique HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY combinations;
+    # as in extension, NaN shorthands are treated as "empty"
+    pairs_df = raw_metadata_df[
+        [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]].drop_duplicates()
+    pairs_df = pairs_df.astype(object).fillna("empty")
 
-    temp_df = _catch_nan_required_fields(temp_df)
+    # add the fields that extension would add for each combination
+    for curr_host_type, curr_sample_type in pairs_df.itertuples(
+            index=False, name=None):
+        reserved_cols.update(schema_index.get_reserved_fields(
+            curr_host_type, curr_sample_type))
+    # next host type + sample type combination
 
-    # extend the metadata_df to get all the required columns for all host+sample type combinations;
-    # we don't really care about the contents of these columns, just their names.
-    # (I doubt it is necessary to pass the actual study_specific_transformers_dict; could probably just use None)
-    metadata_df, _ = extend_metadata_df(
-        temp_df, study_specific_config_dict,
-        study_specific_transformers_dict)
+    return sorted(reserved_cols)
+
+
+def _get_transformer_target_fields(
+        full_flat_config_dict: Dict[str, Any]) -> List[str]:
+    """Get the fields set by the pre- and post-transformers in a config.
+
+    Parameters
+    ----------
+    full_flat_config_dict : Dict[str, Any]
+        Fully combined flat-host-type config dictionary.
 
-    return sorted(metadata_df.columns.to_list())
+    Returns
+    -------
+    List[str]
+        Names of the target fields of all the transformers, pre-transformers
+        first. Empty if there are no transformers.
+    """
+    target_fields = []
+    metadata_transformers = \
+        full_flat_config_dict.get(METADATA_TRANSFORMERS_KEY) or {}
+    for curr_stage_key in [PRE_TRANSFORMERS_KEY, POST_TRANSFORMERS_KEY]:
+        stage_transformers = metadata_transformers.get(curr_stage_key) or {}
+        target_fields.extend(stage_transformers.keys())
+    return target_fields
 
 
 def id_missing_cols(a_df: pandas.DataFrame) -> List[str]:
@@ -296,7 +379,13 @@ def write_extended_metadata_from_df(
         sep: str = "\t",
         remove_internals: bool = True,
         suppress_empty_fails: bool = False,
-        internal_col_names: Optional[List[str]] = None) -> pandas.DataFrame:
+        internal_col_names: Optional[List[str]] = None,
+        string_storage: Optional[str] = None,
+        backend: str = PANDAS_BACKEND,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timings_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> pandas.DataFrame:
     """Write extended metadata to files starting from a metadata DataFrame and config dictionary.
 
     Parameters
@@ -319,6 +408,24 @@ def write_extended_metadata_from_df(
         Whether to suppress empty failure files.
     internal_col_names : Optional[List[str]], default=None
         List of internal column names.
+    string_storage : Optional[str], default=None
+        If given, the storage ("pyarrow" or "python") of the pandas string
+        dtype to carry string columns in; see extend_metadata_df.
+    backend : str, default=PANDAS_BACKEND
+        One of EXTENSION_BACKENDS; see extend_metadata_df.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES; see extend_metadata_df.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each host type + sample type group stops; see extend_metadata_df.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each host type + sample type
+        group; see extend_metadata_df.
+    timings_callback : Optional[Callable[[Dict[str, Any]], None]], default=None
+        If given, called with a StageTimer event at the end of each stage of
+        the extension (see extend_metadata_df) and of WRITE_STAGE, whose
+        rows out are the rows written to the metadata file.
 
     Returns
     -------
@@ -328,19 +435,195 @@ def write_extended_metadata_from_df(
     # extend the metadata DataFrame using the study-specific flat-host-type config dictionary
     metadata_df, validation_msgs_df = extend_metadata_df(
         raw_metadata_df, study_specific_config_dict,
-        study_specific_transformers_dict)
+        study_specific_transformers_dict, string_storage=string_storage,
+        backend=backend, validation_engine=validation_engine,
+        max_errors=max_errors, max_errors_per_field=max_errors_per_field,
+        timings_callback=timings_callback)
 
     # write the metadata and validation results to files
-    write_metadata_results(
-        metadata_df, validation_msgs_df, out_dir, out_name_base,
-        sep=sep, remove_internals=remove_internals,
-        suppress_empty_fails=suppress_empty_fails,
-        internal_col_names=internal_col_names)
+    with StageTimer(timings_callback).time_stage(
+            WRITE_STAGE, len(metadata_df)) as stage_event:
+        write_metadata_results(
+            metadata_df, validation_msgs_df, out_dir, out_name_base,
+            sep=sep, remove_internals=remove_internals,
+            suppress_empty_fails=suppress_empty_fails,
+            internal_col_names=internal_col_names)
+        if remove_internals:
+            stage_event[STAGE_ROWS_OUT_KEY] = \
+                int((metadata_df[QC_NOTE_KEY] == "").sum())
 
     # for good measure, return the extended metadata DataFrame
     return metadata_df
 
 
+def write_extended_metadata_from_chunks(
+        raw_metadata_chunks: Iterable[pandas.DataFrame],
+        study_specific_config_dict: Dict[str, Any],
+        out_dir: str,
+        out_name_base: str,
+        study_specific_transformers_dict: Optional[Dict[str, Any]] = None,
+        sep: str = "\t",
+        remove_internals: bool = True,
+        suppress_empty_fails: bool = False,
+        internal_col_names: Optional[List[str]] = None,
+        string_storage: Optional[str] = None,
+        backend: str = PANDAS_BACKEND,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timings_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+    """Write extended metadata to files, extending the raw metadata one chunk at a time.
+
+    Each chunk is extended against the same (cached) resolved config and
+    spilled to a temporary file, with its validation messages appended to
+    the validation errors file; once every chunk has been seen, and so the
+    full set of output columns is known, the spilled chunks are appended to
+    the metadata (and fails) files in turn. Only one chunk is ever held in
+    memory. Samples are grouped by host type and sample type within each
+    chunk rather than across the whole input, and columns that some chunks
+    lack are given the global default value.
+
+    Parameters
+    ----------
+    raw_metadata_chunks : Iterable[pandas.DataFrame]
+        The raw metadata to extend, as consecutive DataFrames of rows that
+        all have the same columns.
+    study_specific_config_dict : Dict[str, Any]
+        Study-specific configuration dictionary.
+    out_dir : str
+        Directory where output files will be written.
+    out_name_base : str
+        Base name for output files.
+    study_specific_transformers_dict : Optional[Dict[str, Any]], default=None
+        Dictionary of custom transformers.
+    sep : str, default="\t"
+        Separator to use in output files.
+    remove_internals : bool, default=True
+        Whether to remove internal columns (and QC failures) from the
+        metadata file and write the QC failures to their own file.
+    suppress_empty_fails : bool, default=False
+        Whether to suppress empty failure files.
+    internal_col_names : Optional[List[str]], default=None
+        List of internal column names.
+    string_storage : Optional[str], default=None
+        If given, the storage ("pyarrow" or "python") of the pandas string
+        dtype to carry string columns in; see extend_metadata_df.
+    backend : str, default=PANDAS_BACKEND
+        One of EXTENSION_BACKENDS; see extend_metadata_df.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES; see extend_metadata_df.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each host type + sample type group stops; see extend_metadata_df.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each host type + sample type
+        group; see extend_metadata_df.
+    timings_callback : Optional[Callable[[Dict[str, Any]], None]], default=None
+        If given, called with a StageTimer event at the end of each stage of
+        each chunk's extension (see extend_metadata_df) and of writing each
+        spilled chunk out (WRITE_STAGE, whose rows out are the rows written
+        to the metadata file).
+    """
+    if internal_col_names is None:
+        internal_col_names = INTERNAL_COL_KEYS
+    timer = StageTimer(timings_callback)
+
+    timestamp_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    extension = get_extension(sep)
+    out_fp = os.path.join(out_dir, f"{timestamp_str}_{out_name_base}.{extension}")
+    qc_fails_fp = os.path.join(
+        out_dir, f"{timestamp_str}_{out_name_base}_fails.csv")
+    validation_fp = os.path.join(
+        out_dir, f"{timestamp_str}_{out_name_base}_validation_errors.csv")
+
+    default_val = _resolve_schema_index(
+        study_specific_config_dict).settings_dict[DEFAULT_KEY]
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        # extend each chunk, spill it to disk and write its validation msgs
+        spill_fps = []
+        found_cols = {}
+        wrote_validation = False
+        for curr_raw_df in raw_metadata_chunks:
+            curr_metadata_df, curr_validation_msgs_df = extend_metadata_df(
+                curr_raw_df, study_specific_config_dict,
+                study_specific_transformers_dict,
+                string_storage=string_storage, backend=backend,
+                validation_engine=validation_engine,
+                max_errors=max_errors,
+                max_errors_per_field=max_errors_per_field,
+                timings_callback=timings_callback)
+
+            found_cols.update(dict.fromkeys(curr_metadata_df.columns))
+            curr_spill_fp = os.path.join(spill_dir, f"{len(spill_fps)}.pkl")
+            curr_metadata_df.to_pickle(curr_spill_fp)
+            spill_fps.append(curr_spill_fp)
+
+            if not curr_validation_msgs_df.empty:
+                curr_validation_msgs_df.to_csv(
+                    validation_fp, sep=",", index=False,
+                    mode="a" if wrote_validation else "w",
+                    header=not wrote_validation)
+                wrote_validation = True
+        # next chunk
+
+        if not spill_fps:
+            raise ValueError("Metadata contains no samples")
+
+        # put the columns found across all chunks in the standard order
+        out_cols = _reorder_df(
+            pandas.DataFrame(columns=list(found_cols)),
+            INTERNAL_COL_KEYS).columns.tolist()
+
+        # write the spilled chunks out with the full set of columns
+        wrote_metadata = False
+        wrote_qc_fails = False
+        for curr_spill_fp in spill_fps:
+            curr_metadata_df = pandas.read_pickle(curr_spill_fp)
+            with timer.time_stage(
+                    WRITE_STAGE, len(curr_metadata_df)) as stage_event:
+                missing_cols = \
+                    [x for x in out_cols if x not in curr_metadata_df.columns]
+                if missing_cols and default_val:
+                    curr_metadata_df = update_metadata_df_fields(
+                        curr_metadata_df, dict.fromkeys(missing_cols, default_val))
+                curr_metadata_df = curr_metadata_df.reindex(columns=out_cols)
+
+                if remove_internals:
+                    qc_fails_df = get_qc_failures(curr_metadata_df)
+                    if not qc_fails_df.empty:
+                        qc_fails_df.to_csv(
+                            qc_fails_fp, sep=",", index=False,
+                            mode="a" if wrote_qc_fails else "w",
+                            header=not wrote_qc_fails)
+                        wrote_qc_fails = True
+
+                    fails_qc_mask = curr_metadata_df[QC_NOTE_KEY] != ""
+                    curr_metadata_df = curr_metadata_df.loc[~fails_qc_mask, :]
+                    curr_metadata_df = curr_metadata_df.drop(
+                        columns=internal_col_names)
+                # endif removing internals and fails
+
+                curr_metadata_df.to_csv(
+                    out_fp, sep=sep, index=False,
+                    mode="a" if wrote_metadata else "w",
+                    header=not wrote_metadata)
+                wrote_metadata = True
+                stage_event[STAGE_ROWS_OUT_KEY] = len(curr_metadata_df)
+        # next spilled chunk
+    # end using spill dir
+
+    # as for the non-chunked output, create empty (zero-byte) fails files
+    # if there were no failures, unless told not to
+    if not suppress_empty_fails:
+        if remove_internals and not wrote_qc_fails:
+            Path(qc_fails_fp).touch()
+        if not wrote_validation:
+            Path(validation_fp).touch()
+    # endif not suppressing empty fails files
+
+
 def write_extended_metadata(
         raw_metadata_fp: str,
         study_specific_config_fp: str,
@@ -348,7 +631,14 @@ def write_extended_metadata(
         out_name_base: str,
         sep: str = "\t",
         remove_internals: bool = True,
-        suppress_empty_fails: bool = False) -> pandas.DataFrame:
+        suppress_empty_fails: bool = False,
+        chunk_size: Optional[int] = None,
+        string_storage: Optional[str] = None,
+        backend: str = PANDAS_BACKEND,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timings_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[pandas.DataFrame]:
     """Write extended metadata to files starting from input file paths to metadata and config.
 
     Parameters
@@ -367,30 +657,69 @@ def write_extended_metadata(
         Whether to remove internal columns.
     suppress_empty_fails : bool, default=False
         Whether to suppress empty failure files.
+    chunk_size : Optional[int], default=None
+        If given, stream the raw metadata (.csv or .txt only) in chunks of
+        this many rows rather than loading it all at once; see
+        write_extended_metadata_from_chunks.
+    string_storage : Optional[str], default=None
+        If given, the storage ("pyarrow" or "python") of the pandas string
+        dtype to load and extend string columns in; see extend_metadata_df.
+    backend : str, default=PANDAS_BACKEND
+        One of EXTENSION_BACKENDS; see extend_metadata_df.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES; see extend_metadata_df.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each host type + sample type group stops; see extend_metadata_df.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each host type + sample type
+        group; see extend_metadata_df.
+    timings_callback : Optional[Callable[[Dict[str, Any]], None]], default=None
+        If given, called with a StageTimer event at the end of each stage of
+        the extension and writing; see write_extended_metadata_from_df and
+        write_extended_metadata_from_chunks.
 
     Returns
     -------
-    pandas.DataFrame
-        The extended metadata DataFrame.
+    Optional[pandas.DataFrame]
+        The extended metadata DataFrame, or None if chunk_size is given.
 
     Raises
     ------
     ValueError
-        If the input file extension is not recognized.
+        If the input file extension is not recognized, or if chunk_size is
+        less than 1 or given for an input file that is not .csv or .txt.
     """
     # extract the extension from the raw_metadata_fp file path
     extension = os.path.splitext(raw_metadata_fp)[1]
-    if extension == ".csv":
-        raw_metadata_df = load_df_with_best_fit_encoding(raw_metadata_fp, ",")
-    elif extension == ".txt":
-        raw_metadata_df = load_df_with_best_fit_encoding(raw_metadata_fp, "\t")
-    elif extension == ".xlsx":
-        # NB: this loads (only) the first sheet of the input excel file.
-        # If needed, can expand with pandas.read_excel sheet_name parameter.
-        raw_metadata_df = pandas.read_excel(raw_metadata_fp)
-    else:
-        raise ValueError("Unrecognized input file extension; "
-                         "must be .csv, .txt, or .xlsx")
+    if chunk_size is not None:
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1")
+        if extension not in [".csv", ".txt"]:
+            raise ValueError("Chunked input is only supported for "
+                             ".csv and .txt files")
+
+        input_sep = "," if extension == ".csv" else "\t"
+        study_specific_config_dict = \
+            _get_study_specific_config(study_specific_config_fp)
+        with load_df_chunks_with_best_fit_encoding(
+                raw_metadata_fp, input_sep, chunk_size) as raw_metadata_chunks:
+            write_extended_metadata_from_chunks(
+                raw_metadata_chunks, study_specific_config_dict,
+                out_dir, out_name_base, sep=sep,
+                remove_internals=remove_internals,
+                suppress_empty_fails=suppress_empty_fails,
+                string_storage=string_storage, backend=backend,
+                validation_engine=validation_engine,
+                max_errors=max_errors,
+                max_errors_per_field=max_errors_per_field,
+                timings_callback=timings_callback)
+        return None
+    # endif streaming the input
+
+    raw_metadata_df = _load_raw_metadata_df(
+        raw_metadata_fp, string_storage=string_storage)
 
     # get the study-specific flat-host-type config dictionary from the input yaml file
     study_specific_config_dict = \
@@ -401,12 +730,343 @@ def write_extended_metadata(
         raw_metadata_df, study_specific_config_dict,
         out_dir, out_name_base, sep=sep,
         remove_internals=remove_internals,
-        suppress_empty_fails=suppress_empty_fails)
+        suppress_empty_fails=suppress_empty_fails,
+        string_storage=string_storage, backend=backend,
+        validation_engine=validation_engine,
+        max_errors=max_errors,
+        max_errors_per_field=max_errors_per_field,
+        timings_callback=timings_callback)
 
     # for good measure, return the extended metadata DataFrame
     return extended_df
 
 
+def validate_extended_metadata(
+        extended_metadata_fp: str,
+        study_specific_config_fp: Optional[str],
+        out_dir: str,
+        out_name_base: str,
+        chunk_size: int = VALIDATION_CHUNK_SIZE,
+        suppress_empty_fails: bool = False,
+        validation_engine: str = CERBERUS_ENGINE,
+        host_type: Optional[str] = None,
+        sample_type: Optional[str] = None) -> int:
+    """Validate an already-extended metadata file without extending it again.
+
+    The file is read chunk_size rows at a time; the samples of each chunk
+    are grouped by host type and sample type and validated against the
+    resolved schema for that host+sample type, and the validation messages
+    of each chunk are appended to the validation errors file. Only one chunk
+    is ever held in memory.
+
+    Parameters
+    ----------
+    extended_metadata_fp : str
+        Path to the extended metadata file (.csv or .txt). Unless host_type
+        and sample_type are given, it must still hold the columns in
+        REQUIRED_RAW_METADATA_FIELDS that they replace, i.e., it must have
+        been written without removing internal columns (write-extended-
+        metadata's --keep_internals); files written with the default of
+        removing them can only be validated by giving both.
+    study_specific_config_fp : Optional[str]
+        Path to the study-specific configuration YAML file the metadata was
+        extended with.
+    out_dir : str
+        Directory where the validation errors file will be written.
+    out_name_base : str
+        Base name for the validation errors file.
+    chunk_size : int, default=VALIDATION_CHUNK_SIZE
+        Number of rows of the extended metadata to validate at a time.
+    suppress_empty_fails : bool, default=False
+        Whether to suppress an empty validation errors file.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES; see validate_metadata_df.
+    host_type : Optional[str], default=None
+        If given, the host type (as in the config) of every sample, used in
+        place of the file's host type shorthand column.
+    sample_type : Optional[str], default=None
+        If given, the sample type (as in the config) of every sample, used
+        in place of the file's sample type shorthand column.
+
+    Returns
+    -------
+    int
+        The number of validation messages written.
+
+    Raises
+    ------
+    ValueError
+        If the file is not .csv or .txt, if validation_engine is not
+        recognized, if host_type or sample_type is given but not in the
+        config, or if the metadata lacks the columns needed to find each
+        sample's schema.
+
+    Notes
+    -----
+    Samples whose host type or sample type is not in the config (or is
+    missing) are not validated, as during extension. Values are validated
+    as the text in the file, except that numeric text in fields not first
+    allowed to be strings is read as numbers (see convert_numeric_text);
+    values that cannot be cast to any of their field's allowed types fail
+    validation with a type error. Validation messages are in host type +
+    sample type group order within each chunk.
+    """
+    extension = os.path.splitext(extended_metadata_fp)[1]
+    if extension not in [".csv", ".txt"]:
+        raise ValueError("Validation is only supported for .csv and .txt "
+                         "files")
+    if validation_engine not in VALIDATION_ENGINES:
+        raise ValueError(f"Unrecognized validation engine "
+                         f"'{validation_engine}'; must be one of "
+                         f"{VALIDATION_ENGINES}")
+
+    input_sep = "," if extension == ".csv" else "\t"
+    schema_index = _resolve_schema_index(
+        _get_study_specific_config(study_specific_config_fp))
+    # check the overrides up front, since samples of unknown host or sample
+    # types would otherwise just go unvalidated
+    if host_type is not None and not schema_index.has_host_type(host_type):
+        raise ValueError(f"Host type '{host_type}' is not in the config")
+    if sample_type is not None and host_type is not None and \
+            not schema_index.has_sample_type(host_type, sample_type):
+        raise ValueError(f"Sample type '{sample_type}' is not in the config "
+                         f"for host type '{host_type}'")
+
+    timestamp_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    validation_fp = os.path.join(
+        out_dir, f"{timestamp_str}_{out_name_base}_validation_errors.csv")
+
+    num_validation_msgs = 0
+    # read every value as the text in the file (so empty cells stay empty
+    # strings) and leave it to each schema to say which are numbers, which
+    # makes the messages independent of the chunk size
+    with load_df_chunks_with_best_fit_encoding(
+            extended_metadata_fp, input_sep, chunk_size, dtype=str,
+            keep_default_na=False) as metadata_chunks:
+        for curr_metadata_df in metadata_chunks:
+            curr_validation_msgs = _validate_extended_metadata_df(
+                curr_metadata_df, schema_index, validation_engine,
+                host_type=host_type, sample_type=sample_type)
+            if curr_validation_msgs:
+                pandas.DataFrame(curr_validation_msgs).to_csv(
+                    validation_fp, sep=",", index=False,
+                    mode="a" if num_validation_msgs else "w",
+                    header=not num_validation_msgs)
+                num_validation_msgs += len(curr_validation_msgs)
+        # next chunk
+    # end reading chunks
+
+    if not num_validation_msgs and not suppress_empty_fails:
+        Path(validation_fp).touch()
+    return num_validation_msgs
+
+
+def _validate_extended_metadata_df(
+        metadata_df: pandas.DataFrame,
+        schema_index: ResolvedSchemaIndex,
+        validation_engine: str,
+        host_type: Optional[str] = None,
+        sample_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Validate each host type + sample type group of extended metadata.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The extended metadata to validate.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    validation_engine : str
+        One of VALIDATION_ENGINES.
+    host_type : Optional[str], default=None
+        If given, the host type of every sample, in place of the host type
+        shorthand column.
+    sample_type : Optional[str], default=None
+        If given, the sample type of every sample, in place of the sample
+        type shorthand column.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The validation messages of all groups with a valid host type and
+        sample type, in group order.
+
+    Raises
+    ------
+    ValueError
+        If the metadata lacks the columns needed to find each sample's
+        schema.
+    """
+    type_overrides = {HOSTTYPE_SHORTHAND_KEY: host_type,
+                      SAMPLETYPE_SHORTHAND_KEY: sample_type}
+    type_overrides = {k: v for k, v in type_overrides.items()
+                      if v is not None}
+    if type_overrides:
+        metadata_df = metadata_df.assign(**type_overrides)
+    validate_required_columns_exist(
+        metadata_df, REQUIRED_RAW_METADATA_FIELDS,
+        "extended metadata missing columns needed for validation (was it "
+        "written with internal columns removed? If so, give its host type "
+        "and sample type)")
+
+    validation_msgs = []
+    for curr_host_type, curr_sample_type, curr_positions in \
+            _get_host_and_sample_type_groups(metadata_df, schema_index):
+        if curr_sample_type is None or not schema_index.has_sample_type(
+                curr_host_type, curr_sample_type):
+            continue
+
+        curr_fields_dict = schema_index.get_sample_type_schema(
+            curr_host_type, curr_sample_type).metadata_fields_dict
+        validation_msgs.extend(validate_metadata_df(
+            convert_numeric_text(
+                metadata_df.take(curr_positions), curr_fields_dict),
+            curr_fields_dict, engine=validation_engine,
+            keep_uncastable=True))
+    # next host type + sample type group
+    return validation_msgs
+
+
+def write_extended_metadata_batch(
+        raw_metadata_fps: List[str],
+        study_specific_config_fp: Optional[str],
+        out_dir: str,
+        study_specific_transformers_dict: Optional[Dict[str, Any]] = None,
+        sep: str = "\t",
+        remove_internals: bool = True,
+        suppress_empty_fails: bool = False,
+        summary_name_base: str = "batch") -> pandas.DataFrame:
+    """Write extended metadata to files for many metadata files sharing one config.
+
+    The config is resolved once for the whole batch. The header of every
+    metadata file is checked for required columns before any outputs are
+    written, so a bad file doesn't leave partial outputs behind; the files
+    are then loaded, extended, and written one at a time, so only one is
+    held in memory at once. Each file's outputs are
+    named as for write_extended_metadata, using the file's name (without
+    extension) as the base name; a summary of the batch is also written.
+
+    Parameters
+    ----------
+    raw_metadata_fps : List[str]
+        Paths to the raw metadata files (.csv, .txt, or .xlsx). Their file
+        names (without extension) must be unique.
+    study_specific_config_fp : Optional[str]
+        Path to the study-specific configuration YAML file.
+    out_dir : str
+        Directory where output files will be written.
+    study_specific_transformers_dict : Optional[Dict[str, Any]], default=None
+        Dictionary of custom transformers for this study (only).
+    sep : str, default="\t"
+        Separator to use in output metadata files.
+    remove_internals : bool, default=True
+        Whether to remove internal columns.
+    suppress_empty_fails : bool, default=False
+        Whether to suppress empty failure files.
+    summary_name_base : str, default="batch"
+        Base name for the batch summary file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The batch summary, with one row per input file; see
+        extend_metadata_dfs.
+
+    Raises
+    ------
+    ValueError
+        If the input file names are not unique, an input file extension is
+        not recognized, or required columns are missing from any metadata;
+        these are checked for all inputs before any outputs are written.
+    """
+    out_name_bases = \
+        [os.path.splitext(os.path.basename(x))[0] for x in raw_metadata_fps]
+    if len(set(out_name_bases)) != len(out_name_bases):
+        raise ValueError("Metadata file names must be unique within a batch")
+
+    study_specific_config_dict = \
+        _get_study_specific_config(study_specific_config_fp)
+    schema_index = _resolve_schema_index(study_specific_config_dict)
+
+    # check only the header of each file up front, so just one file's
+    # metadata is ever held in memory
+    for curr_fp in raw_metadata_fps:
+        validate_required_columns_exist(
+            _load_raw_metadata_df(curr_fp, nrows=0),
+            REQUIRED_RAW_METADATA_FIELDS,
+            f"metadata in {curr_fp} missing required columns")
+    # next metadata file
+
+    summary_records = []
+    for curr_fp, curr_name_base in zip(raw_metadata_fps, out_name_bases):
+        curr_raw_df = _load_raw_metadata_df(curr_fp)
+        curr_metadata_df, curr_validation_msgs_df = _populate_metadata_df(
+            curr_raw_df, schema_index, study_specific_transformers_dict)
+        write_metadata_results(
+            curr_metadata_df, curr_validation_msgs_df, out_dir,
+            curr_name_base, sep=sep, remove_internals=remove_internals,
+            suppress_empty_fails=suppress_empty_fails)
+
+        summary_records.append(_summarize_extended_metadata(
+            curr_fp, curr_metadata_df, curr_validation_msgs_df))
+    # next metadata file
+
+    summary_df = pandas.DataFrame(summary_records, columns=BATCH_SUMMARY_COLS)
+    timestamp_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    summary_fp = os.path.join(
+        out_dir, f"{timestamp_str}_{summary_name_base}_summary.csv")
+    summary_df.to_csv(summary_fp, sep=",", index=False)
+
+    return summary_df
+
+
+def _load_raw_metadata_df(
+        raw_metadata_fp: str,
+        string_storage: Optional[str] = None,
+        nrows: Optional[int] = None) -> pandas.DataFrame:
+    """Load a raw metadata file based on its extension.
+
+    Parameters
+    ----------
+    raw_metadata_fp : str
+        Path to the raw metadata file (.csv, .txt, or .xlsx).
+    string_storage : Optional[str], default=None
+        If given, the storage ("pyarrow" or "python") of the pandas string
+        dtype to load string columns as.
+    nrows : Optional[int], default=None
+        If given, the number of rows to load; 0 loads only the header.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The raw metadata DataFrame.
+
+    Raises
+    ------
+    ValueError
+        If the input file extension is not recognized.
+    """
+    extension = os.path.splitext(raw_metadata_fp)[1]
+    if extension == ".csv":
+        raw_metadata_df = load_df_with_best_fit_encoding(
+            raw_metadata_fp, ",", string_storage=string_storage, nrows=nrows)
+    elif extension == ".txt":
+        raw_metadata_df = load_df_with_best_fit_encoding(
+            raw_metadata_fp, "\t", string_storage=string_storage,
+            nrows=nrows)
+    elif extension == ".xlsx":
+        # NB: this loads (only) the first sheet of the input excel file.
+        # If needed, can expand with pandas.read_excel sheet_name parameter.
+        raw_metadata_df = pandas.read_excel(raw_metadata_fp, nrows=nrows)
+        if string_storage is not None:
+            raw_metadata_df = convert_str_cols_to_string_dtype(
+                raw_metadata_df, string_storage)
+    else:
+        raise ValueError("Unrecognized input file extension; "
+                         "must be .csv, .txt, or .xlsx")
+
+    return raw_metadata_df
+
+
 def _get_study_specific_config(study_specific_config_fp: Optional[str]) -> Optional[Dict[str, Any]]:
     """Load study-specific flat-host-type configuration from a YAML file.
 
@@ -437,7 +1097,16 @@ def extend_metadata_df(
         raw_metadata_df: pandas.DataFrame,
         study_specific_config_dict: Optional[Dict[str, Any]],
         study_specific_transformers_dict: Optional[Dict[str, Any]] = None,
-        software_config_dict: Optional[Dict[str, Any]] = None
+        software_config_dict: Optional[Dict[str, Any]] = None,
+        use_categoricals: Optional[bool] = None,
+        n_jobs: int = 1,
+        copy: bool = True,
+        string_storage: Optional[str] = None,
+        backend: str = PANDAS_BACKEND,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timings_callback: Optional[Callable[[Dict[str, Any]], None]] = None
 ) -> Tuple[pandas.DataFrame, pandas.DataFrame]:
     """Extend a metadata DataFrame based on metadata standards and study-specific configurations.
 
@@ -452,6 +1121,70 @@ def extend_metadata_df(
     software_config_dict : Optional[Dict[str, Any]], default=None
         Software configuration dictionary. If None, the default software
         config pulled from the config.yml file will be used.
+    use_categoricals : Optional[bool], default=None
+        Whether to carry the internal columns (host type shorthand, sample
+        type shorthand, and QC note) as pandas Categoricals. If True, they
+        are categoricals both during extension and in the returned
+        DataFrame. If None, categoricals are used during extension of inputs
+        with at least CATEGORICAL_MIN_ROWS rows, but the internal columns
+        are decoded back to object columns before being returned.
+    n_jobs : int, default=1
+        Number of worker processes to extend the host type + sample type
+        groups in; 1 extends them all in this process, and a value less than
+        1 uses all available cores. Results are the same regardless.
+    copy : bool, default=True
+        Whether to start extension from a copy of the raw metadata. If
+        False, extension starts from a shallow copy of the raw
+        metadata instead, which saves a full copy of the input; the raw
+        metadata DataFrame is not modified either way, but the returned
+        DataFrame may share memory with it.
+    string_storage : Optional[str], default=None
+        If given, one of STRING_STORAGE_OPTIONS: "pyarrow" (which requires
+        pyarrow) or "python". Columns of the raw metadata holding only
+        strings are then converted to pandas' string dtype with that storage
+        before extension, and every column of the extended metadata holding
+        only strings is returned that way; missing values in them are
+        pandas.NA. In between, the conversion is not kept up throughout:
+        a string column that extension sets a non-string value in (e.g., a
+        numeric default) goes back to being an object column, columns added
+        during extension are object columns until the end, and validation
+        works on object copies of the values. Columns with any non-string
+        values are returned as object columns. The extended values and
+        validation messages are the same either way.
+    backend : str, default=PANDAS_BACKEND
+        One of EXTENSION_BACKENDS: "pandas", or "polars" (which requires
+        polars) to run the constant-valued updates of each host type +
+        sample type group, and the built-in single-source transformers,
+        as vectorized polars expressions instead of pandas row-wise
+        operations. The polars backend gives the same extended metadata
+        and validation messages as the pandas one, but does not support
+        n_jobs other than 1 or use_categoricals=True.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES: "cerberus" to validate each host type +
+        sample type group a row at a time, or "vectorized" to check it a
+        column at a time; see validate_metadata_df. The validation
+        messages are the same either way.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each host type + sample type group stops, to keep turnaround quick
+        for badly broken metadata; the first error over the budget is
+        replaced by a message saying that validation stopped there. See
+        validate_metadata_df.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each host type + sample type
+        group; the field's first error over the budget is replaced by a
+        message saying that its validation stopped there. See
+        validate_metadata_df.
+    timings_callback : Optional[Callable[[Dict[str, Any]], None]], default=None
+        If given, called with a StageTimer event (stage name, seconds, rows
+        in and out, and bytes allocated) at the end of each stage of the
+        extension: INITIALIZE_STAGE, PRE_TRANSFORM_STAGE,
+        ENCODE_CATEGORICALS_STAGE (if categoricals are used),
+        GENERATE_GROUP_STAGE and VALIDATE_GROUP_STAGE (for each host type +
+        sample type group, with its host_type and sample_type),
+        COMBINE_GROUPS_STAGE, POST_TRANSFORM_STAGE, CONVERT_STRINGS_STAGE
+        (if string_storage is given) and REORDER_STAGE.
 
     Returns
     -------
@@ -463,34 +1196,539 @@ def extend_metadata_df(
     Raises
     ------
     ValueError
-        If required columns are missing from the metadata.
+        If required columns are missing from the metadata, if
+        string_storage, backend or validation_engine is not recognized, or
+        if the polars backend is asked for along with n_jobs or
+        categoricals.
+    ImportError
+        If string_storage is "pyarrow" and pyarrow is not installed, or if
+        backend is "polars" and polars is not installed.
+    """
+    validate_required_columns_exist(
+        raw_metadata_df, REQUIRED_RAW_METADATA_FIELDS,
+        "metadata missing required columns")
+
+    schema_index = _resolve_schema_index(
+        study_specific_config_dict, software_config_dict)
+
+    metadata_df, validation_msgs_df = _populate_metadata_df(
+        raw_metadata_df, schema_index, study_specific_transformers_dict,
+        use_categoricals=use_categoricals, n_jobs=n_jobs, copy=copy,
+        string_storage=string_storage, backend=backend,
+        validation_engine=validation_engine,
+        max_errors=max_errors,
+        max_errors_per_field=max_errors_per_field,
+        timings_callback=timings_callback)
+
+    return metadata_df, validation_msgs_df
+
+
+def extend_metadata_dfs(
+        raw_metadata_dfs: Dict[str, pandas.DataFrame],
+        study_specific_config_dict: Optional[Dict[str, Any]],
+        study_specific_transformers_dict: Optional[Dict[str, Any]] = None,
+        software_config_dict: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Tuple[pandas.DataFrame, pandas.DataFrame]],
+           pandas.DataFrame]:
+    """Extend many metadata DataFrames that share one study-specific configuration.
+
+    The config is resolved once for the whole batch rather than once per
+    DataFrame.
+
+    Parameters
+    ----------
+    raw_metadata_dfs : Dict[str, pandas.DataFrame]
+        The raw metadata DataFrames to extend, keyed by a name for each.
+    study_specific_config_dict : Optional[Dict[str, Any]]
+        Study-specific flat-host-type config dictionary.
+    study_specific_transformers_dict : Optional[Dict[str, Any]], default=None
+        Dictionary of custom transformers for this study (only).
+    software_config_dict : Optional[Dict[str, Any]], default=None
+        Software configuration dictionary. If None, the default software
+        config pulled from the config.yml file will be used.
+
+    Returns
+    -------
+    Tuple[Dict[str, Tuple[pandas.DataFrame, pandas.DataFrame]], pandas.DataFrame]
+        A tuple containing:
+            - A dictionary of name to a tuple of the extended metadata
+              DataFrame and the DataFrame of its validation messages,
+              in input order
+            - A summary DataFrame with one row per input, holding the
+              columns in BATCH_SUMMARY_COLS: the input name and its
+              numbers of samples, QC failures, and validation messages
+
+    Raises
+    ------
+    ValueError
+        If required columns are missing from any of the metadata; this is
+        checked for all inputs before any are extended.
+    """
+    for curr_name, curr_raw_df in raw_metadata_dfs.items():
+        validate_required_columns_exist(
+            curr_raw_df, REQUIRED_RAW_METADATA_FIELDS,
+            f"metadata in {curr_name} missing required columns")
+
+    schema_index = _resolve_schema_index(
+        study_specific_config_dict, software_config_dict)
+
+    results = {}
+    summary_records = []
+    for curr_name, curr_raw_df in raw_metadata_dfs.items():
+        curr_metadata_df, curr_validation_msgs_df = _populate_metadata_df(
+            curr_raw_df, schema_index, study_specific_transformers_dict)
+        results[curr_name] = (curr_metadata_df, curr_validation_msgs_df)
+        summary_records.append(_summarize_extended_metadata(
+            curr_name, curr_metadata_df, curr_validation_msgs_df))
+    # next metadata DataFrame
+
+    summary_df = pandas.DataFrame(summary_records, columns=BATCH_SUMMARY_COLS)
+    return results, summary_df
+
+
+def _summarize_extended_metadata(
+        input_name: str,
+        metadata_df: pandas.DataFrame,
+        validation_msgs_df: pandas.DataFrame) -> Dict[str, Any]:
+    """Summarize the results of extending one input of a batch.
+
+    Parameters
+    ----------
+    input_name : str
+        Name of the input.
+    metadata_df : pandas.DataFrame
+        The extended metadata DataFrame.
+    validation_msgs_df : pandas.DataFrame
+        DataFrame containing validation messages.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Record with the keys in BATCH_SUMMARY_COLS.
+    """
+    return {
+        BATCH_INPUT_KEY: input_name,
+        BATCH_NUM_SAMPLES_KEY: len(metadata_df),
+        BATCH_NUM_QC_FAILS_KEY: len(get_qc_failures(metadata_df)),
+        BATCH_NUM_VALIDATION_MSGS_KEY: len(validation_msgs_df)}
+
+
+class IncrementalExtension:
+    """Extended metadata plus the per-row fingerprints needed to update it incrementally.
+
+    Returned by extend_metadata_df_incrementally and passed back to it as
+    the prior extension of the next version of the same raw metadata. It
+    can be pickled to keep it between runs.
+
+    Attributes
+    ----------
+    metadata_df : pandas.DataFrame
+        The extended metadata DataFrame.
+    validation_msgs_df : pandas.DataFrame
+        DataFrame containing validation messages.
+    row_fingerprints : pandas.Series
+        Fingerprint of each raw metadata row's values and of the config for
+        its host+sample type, indexed by sample name.
+    raw_cols : List[str]
+        Columns of the raw metadata DataFrame, in order.
+    """
+
+    def __init__(self, metadata_df: pandas.DataFrame,
+                 validation_msgs_df: pandas.DataFrame,
+                 row_fingerprints: pandas.Series,
+                 raw_cols: List[str]):
+        self.metadata_df = metadata_df
+        self.validation_msgs_df = validation_msgs_df
+        self.row_fingerprints = row_fingerprints
+        self.raw_cols = raw_cols
+
+
+def extend_metadata_df_incrementally(
+        raw_metadata_df: pandas.DataFrame,
+        study_specific_config_dict: Optional[Dict[str, Any]],
+        prior_extension: Optional[IncrementalExtension] = None,
+        study_specific_transformers_dict: Optional[Dict[str, Any]] = None,
+        software_config_dict: Optional[Dict[str, Any]] = None
+) -> IncrementalExtension:
+    """Extend a metadata DataFrame, re-extending only rows changed since a prior extension.
+
+    A row is re-extended (and re-validated) if it is new, if any of its raw
+    values changed, or if the config for its host+sample type (or the global
+    settings or transformers) changed; every other row's extended values and
+    validation messages are reused from the prior extension. Rows no longer
+    in the raw metadata are dropped. The result is the same as extending the
+    whole DataFrame with extend_metadata_df.
+
+    Parameters
+    ----------
+    raw_metadata_df : pandas.DataFrame
+        The raw metadata DataFrame to extend; sample names must be unique.
+    study_specific_config_dict : Optional[Dict[str, Any]]
+        Study-specific flat-host-type config dictionary.
+    prior_extension : Optional[IncrementalExtension], default=None
+        The result of the previous extension of this metadata. If None, or
+        if the raw metadata's columns have changed since, every row is
+        extended.
+    study_specific_transformers_dict : Optional[Dict[str, Any]], default=None
+        Dictionary of custom transformers for this study (only). Changes to
+        the transformer functions themselves can't be detected, so extend
+        from scratch (with no prior extension) after changing them.
+    software_config_dict : Optional[Dict[str, Any]], default=None
+        Software configuration dictionary. If None, the default software
+        config pulled from the config.yml file will be used.
+
+    Returns
+    -------
+    IncrementalExtension
+        The extended metadata and validation messages, plus the row
+        fingerprints to pass back in for the next incremental extension.
+
+    Raises
+    ------
+    ValueError
+        If required columns are missing from the metadata or sample names
+        are not unique.
     """
     validate_required_columns_exist(
         raw_metadata_df, REQUIRED_RAW_METADATA_FIELDS,
         "metadata missing required columns")
+    if raw_metadata_df[SAMPLE_NAME_KEY].duplicated().any():
+        raise ValueError("Metadata contains duplicate sample names")
 
+    schema_index = _resolve_schema_index(
+        study_specific_config_dict, software_config_dict)
+    row_fingerprints = _fingerprint_raw_metadata_rows(
+        raw_metadata_df, schema_index)
+    raw_cols = raw_metadata_df.columns.tolist()
+
+    if prior_extension is None or prior_extension.raw_cols != raw_cols:
+        changed_mask = np.ones(len(raw_metadata_df), dtype=bool)
+    else:
+        prior_fingerprints = \
+            prior_extension.row_fingerprints.reindex(row_fingerprints.index)
+        changed_mask = (prior_fingerprints != row_fingerprints).to_numpy()
+    # endif there is a usable prior extension
+
+    extended_dfs = []
+    validation_msgs_dfs = []
+    output_cols = set()
+    if not changed_mask.all():
+        unchanged_names = row_fingerprints.index[~changed_mask]
+        prior_metadata_df = prior_extension.metadata_df
+        unchanged_df = _infer_reused_col_dtypes(
+            prior_metadata_df.loc[
+                prior_metadata_df[SAMPLE_NAME_KEY].isin(unchanged_names), :],
+            raw_metadata_df)
+        extended_dfs.append(unchanged_df)
+        # the prior extension may have columns that only rows no longer
+        # present needed, so keep only those the unchanged rows need
+        output_cols.update(_get_extended_cols(
+            unchanged_df, raw_cols, schema_index))
+        prior_msgs_df = prior_extension.validation_msgs_df
+        if not prior_msgs_df.empty:
+            validation_msgs_dfs.append(prior_msgs_df.loc[
+                prior_msgs_df[SAMPLE_NAME_KEY].isin(unchanged_names), :])
+    # endif any rows are unchanged
+
+    if changed_mask.any():
+        changed_df, changed_msgs_df = _populate_metadata_df(
+            raw_metadata_df.loc[changed_mask, :], schema_index,
+            study_specific_transformers_dict)
+        extended_dfs.append(changed_df)
+        validation_msgs_dfs.append(changed_msgs_df)
+        output_cols.update(changed_df.columns)
+    # endif any rows changed
+
+    if changed_mask.all():
+        metadata_df = extended_dfs[0]
+    else:
+        # even if no rows changed, rows may have been removed or reordered,
+        # which can change the order of the host+sample type groups
+        metadata_df = _splice_extended_metadata(
+            extended_dfs, raw_metadata_df[SAMPLE_NAME_KEY], schema_index,
+            output_cols)
+
+    validation_msgs_dfs = [x for x in validation_msgs_dfs if not x.empty]
+    if not validation_msgs_dfs:
+        validation_msgs_df = pandas.DataFrame([])
+    else:
+        # put the validation msgs in the order of their samples in the output
+        validation_msgs_df = pandas.concat(
+            validation_msgs_dfs, ignore_index=True)
+        output_positions = pandas.Series(
+            np.arange(len(metadata_df)), index=metadata_df[SAMPLE_NAME_KEY])
+        msg_order = np.argsort(
+            output_positions[validation_msgs_df[SAMPLE_NAME_KEY]].to_numpy(),
+            kind="stable")
+        validation_msgs_df = \
+            validation_msgs_df.take(msg_order).reset_index(drop=True)
+    # endif there are any validation msgs
+
+    return IncrementalExtension(
+        metadata_df, validation_msgs_df, row_fingerprints, raw_cols)
+
+
+def _fingerprint_raw_metadata_rows(
+        raw_metadata_df: pandas.DataFrame,
+        schema_index: ResolvedSchemaIndex) -> pandas.Series:
+    """Fingerprint each raw metadata row's values and the config that applies to it.
+
+    Parameters
+    ----------
+    raw_metadata_df : pandas.DataFrame
+        The raw metadata DataFrame, which must contain at least
+        the columns in REQUIRED_RAW_METADATA_FIELDS.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+
+    Returns
+    -------
+    pandas.Series
+        String fingerprint of each row, indexed by sample name.
+    """
+    # transformers apply to every row, so they are part of every fingerprint
+    transformers_fingerprint = fingerprint_obj(
+        schema_index.full_flat_config_dict.get(METADATA_TRANSFORMERS_KEY))
+    values_hashes = pandas.util.hash_pandas_object(
+        raw_metadata_df, index=False).to_numpy()
+
+    # as in extension, NaN shorthands are treated as "empty"
+    shorthands_df = raw_metadata_df[
+        [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]].astype(
+        object).fillna("empty")
+
+    row_fingerprints = [
+        f"{transformers_fingerprint}:"
+        f"{schema_index.get_schema_fingerprint(curr_host, curr_sample)}:"
+        f"{curr_hash:016x}"
+        for (curr_host, curr_sample), curr_hash in zip(
+            shorthands_df.itertuples(index=False, name=None), values_hashes)]
+    return pandas.Series(
+        row_fingerprints, index=raw_metadata_df[SAMPLE_NAME_KEY].to_numpy())
+
+
+def _infer_reused_col_dtypes(
+        reused_df: pandas.DataFrame,
+        raw_metadata_df: pandas.DataFrame) -> pandas.DataFrame:
+    """Give reused rows of a prior extension the dtypes their own values give them.
+
+    A column of the prior extension may have been upcast (e.g., to object)
+    only because of rows that are no longer present, which extending the
+    remaining rows afresh would not do.
+
+    Parameters
+    ----------
+    reused_df : pandas.DataFrame
+        Rows of the prior extended metadata being reused.
+    raw_metadata_df : pandas.DataFrame
+        The current raw metadata; columns it holds as objects stay objects,
+        as extension leaves them.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The reused rows, with their other object columns converted to a
+        more specific dtype where all their values allow it.
+    """
+    raw_object_cols = set(
+        raw_metadata_df.columns[raw_metadata_df.dtypes == object])
+    inferred_cols = {
+        x: reused_df[x].infer_objects() for x in reused_df.columns
+        if reused_df[x].dtype == object and x not in raw_object_cols}
+    if not inferred_cols:
+        return reused_df
+    return reused_df.assign(**inferred_cols)
+
+
+def _get_extended_cols(
+        extended_df: pandas.DataFrame,
+        raw_cols: List[str],
+        schema_index: ResolvedSchemaIndex) -> Set[str]:
+    """Get the columns that extending the samples of an extended DataFrame gives.
+
+    Parameters
+    ----------
+    extended_df : pandas.DataFrame
+        Extended metadata, possibly holding more columns than its own samples
+        need (e.g., the rows of a larger extended DataFrame).
+    raw_cols : List[str]
+        The columns of the raw metadata the samples were extended from.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+
+    Returns
+    -------
+    Set[str]
+        The raw columns, the sample name and internal columns, the targets of
+        any transformers, and the fields extension adds for each host type +
+        sample type of the samples.
+    """
+    extended_cols = {SAMPLE_NAME_KEY, *raw_cols, *INTERNAL_COL_KEYS}
+    extended_cols.update(
+        _get_transformer_target_fields(schema_index.full_flat_config_dict))
+
+    # the shorthands in extended metadata are the ones the samples were
+    # grouped by, after any pre-transformers
+    pairs_df = extended_df[
+        [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]].drop_duplicates()
+    for curr_host_type, curr_sample_type in pairs_df.astype(
+            object).itertuples(index=False, name=None):
+        extended_cols.update(schema_index.get_reserved_fields(
+            curr_host_type, curr_sample_type))
+    # next host type + sample type combination
+    return extended_cols
+
+
+def _splice_extended_metadata(
+        extended_dfs: List[pandas.DataFrame],
+        sample_names: pandas.Series,
+        schema_index: ResolvedSchemaIndex,
+        output_cols: Set[str]) -> pandas.DataFrame:
+    """Combine separately-extended metadata as if it had been extended all at once.
+
+    Parameters
+    ----------
+    extended_dfs : List[pandas.DataFrame]
+        Extended metadata DataFrames for disjoint sets of samples.
+    sample_names : pandas.Series
+        Names of all the samples, in raw metadata order.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    output_cols : Set[str]
+        The columns that extending all the samples at once gives; columns
+        of the inputs that are not in it are dropped.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The combined extended metadata, with output columns that some inputs
+        lack given the global default value, and with rows and columns in
+        the order extend_metadata_df would give them.
+    """
+    default_val = schema_index.settings_dict[DEFAULT_KEY]
+
+    dfs_to_concat = []
+    for curr_df in extended_dfs:
+        extra_cols = [x for x in curr_df.columns if x not in output_cols]
+        if extra_cols:
+            curr_df = curr_df.drop(columns=extra_cols)
+        missing_cols = [x for x in output_cols if x not in curr_df.columns]
+        if missing_cols and default_val:
+            curr_df = update_metadata_df_fields(
+                curr_df, dict.fromkeys(missing_cols, default_val))
+        dfs_to_concat.append(curr_df)
+    # next extended df
+    combined_df = pandas.concat(dfs_to_concat, ignore_index=True)
+
+    # put the rows in raw metadata order, then group them the same way
+    # extension does
+    raw_positions = pandas.Series(
+        np.arange(len(sample_names)), index=sample_names.to_numpy())
+    combined_df = combined_df.take(np.argsort(
+        raw_positions[combined_df[SAMPLE_NAME_KEY]].to_numpy()))
+    grouped_positions = np.concatenate([
+        x[2] for x in _get_host_and_sample_type_groups(
+            combined_df, schema_index)])
+    combined_df = combined_df.take(grouped_positions).reset_index(drop=True)
+
+    return _reorder_df(combined_df, INTERNAL_COL_KEYS)
+
+
+def clear_config_cache() -> None:
+    """Empty the in-process cache of resolved configs.
+
+    Only needed if the standards are changed by means other than editing the
+    standards file (which changes its fingerprint), or to release memory.
+    """
+    _SCHEMA_INDEX_CACHE.clear()
+
+
+def _resolve_schema_index(
+        study_specific_config_dict: Optional[Dict[str, Any]],
+        software_config_dict: Optional[Dict[str, Any]] = None) \
+        -> ResolvedSchemaIndex:
+    """Get the resolved schema index for a config, reusing a cached one if possible.
+
+    Resolved configs are kept in a bounded LRU cache keyed by fingerprints of
+    the study config, the software config, and the standards file, so
+    repeated calls with unchanged inputs skip combining and flattening and
+    reuse every host+sample type schema already resolved.
+
+    Parameters
+    ----------
+    study_specific_config_dict : Optional[Dict[str, Any]]
+        Study-specific flat-host-type config dictionary.
+    software_config_dict : Optional[Dict[str, Any]], default=None
+        Software configuration dictionary. If None, the default software
+        config pulled from the config.yml file will be used.
+
+    Returns
+    -------
+    ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config
+        dictionary. NB: this may be shared with other callers, so neither it
+        nor anything it returns may be modified.
+    """
     if software_config_dict is None:
-        software_config_dict = extract_config_dict(None)
+        software_config_dict = extract_config_dict(None, use_cache=True)
+
+    cache_key = (fingerprint_obj(study_specific_config_dict),
+                 fingerprint_obj(software_config_dict),
+                 fingerprint_file(get_stds_fp()))
+    schema_index = _SCHEMA_INDEX_CACHE.get(cache_key)
+    if schema_index is not None:
+        _SCHEMA_INDEX_CACHE.move_to_end(cache_key)
+        return schema_index
+
+    full_flat_config_dict = _build_full_flat_config_dict(
+        study_specific_config_dict, software_config_dict)
+    schema_index = ResolvedSchemaIndex(full_flat_config_dict)
+
+    _SCHEMA_INDEX_CACHE[cache_key] = schema_index
+    if len(_SCHEMA_INDEX_CACHE) > MAX_CACHED_CONFIGS:
+        _SCHEMA_INDEX_CACHE.popitem(last=False)
+    return schema_index
+
+
+def _build_full_flat_config_dict(
+        study_specific_config_dict: Optional[Dict[str, Any]],
+        software_config_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine software, study, and standards configs into a full flat-host-type config dict.
+
+    Parameters
+    ----------
+    study_specific_config_dict : Optional[Dict[str, Any]]
+        Study-specific flat-host-type config dictionary.
+    software_config_dict : Dict[str, Any]
+        Software configuration dictionary.
 
+    Returns
+    -------
+    Dict[str, Any]
+        Fully combined flat-host-type config dictionary.
+    """
     if study_specific_config_dict:
         # overwrite default settings in software config with study-specific ones (if any)
         software_plus_study_flat_config_dict = deepcopy_dict(study_specific_config_dict)
         software_plus_study_flat_config_dict = \
             software_config_dict | software_plus_study_flat_config_dict
-        
+
         # combine the software+study flat-host-type config's host type specific info
         # with the standards nested-host-type config's host type specific info
         # to get a full combined, nested dictionary starting from HOST_TYPE_SPECIFIC_METADATA_KEY
         full_nested_hosts_dict = combine_stds_and_study_config(
             software_plus_study_flat_config_dict)
     else:
-        software_plus_study_flat_config_dict = software_config_dict
+        # copy (shallowly) so that adding the hosts below doesn't change
+        # the input software config
+        software_plus_study_flat_config_dict = dict(software_config_dict)
         # no need to combine the standards' host info with anything else,
         # since the software config doesn't include any host type specific info
         full_nested_hosts_dict = extract_stds_config(None)
 
-    full_flat_hosts_dict = flatten_nested_stds_dict(
-        full_nested_hosts_dict, None)
+    # host types are flattened lazily, when first looked up, so only those
+    # actually present in the metadata (plus their ancestors) are flattened
+    full_flat_hosts_dict = LazyFlatHostTypesDict(full_nested_hosts_dict)
     software_plus_study_flat_config_dict[HOST_TYPE_SPECIFIC_METADATA_KEY] = \
         full_flat_hosts_dict
     # this is just a renaming to indicate that, having overwritten any original
@@ -498,18 +1736,23 @@ def extend_metadata_df(
     # with the complete and flattened combination of software+study+standards, it is now
     # the "full" flat-host-type config dictionary
     full_flat_config_dict = software_plus_study_flat_config_dict
-
-    metadata_df, validation_msgs_df = _populate_metadata_df(
-        raw_metadata_df, full_flat_config_dict,
-        study_specific_transformers_dict)
-
-    return metadata_df, validation_msgs_df
+    return full_flat_config_dict
 
 
 def _populate_metadata_df(
         raw_metadata_df: pandas.DataFrame,
-        full_flat_config_dict: Dict[str, Any],
-        transformer_funcs_dict: Optional[Dict[str, Any]]) -> Tuple[pandas.DataFrame, pandas.DataFrame]:
+        schema_index: ResolvedSchemaIndex,
+        transformer_funcs_dict: Optional[Dict[str, Any]],
+        use_categoricals: Optional[bool] = None,
+        n_jobs: int = 1,
+        copy: bool = True,
+        string_storage: Optional[str] = None,
+        backend: str = PANDAS_BACKEND,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timings_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Tuple[pandas.DataFrame, pandas.DataFrame]:
     """Populate columns and fields in a metadata DataFrame.
 
     Parameters
@@ -517,13 +1760,39 @@ def _populate_metadata_df(
     raw_metadata_df : pandas.DataFrame
         The raw metadata DataFrame to populate, which must contain at least
         the columns in REQUIRED_RAW_METADATA_FIELDS.
-    full_flat_config_dict : Dict[str, Any]
-        Fully combined flat-host-type config dictionary.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
     transformer_funcs_dict : Optional[Dict[str, Any]]
         Dictionary of transformer functions, keyed by field name,
         with each value being a dict with keys SOURCES_KEY and FUNCTION_KEY,
         which map to lists of source field names for the transformer to use
         and an existing transformer function name, respectively.
+    use_categoricals : Optional[bool], default=None
+        Whether to carry the internal columns as pandas Categoricals. If
+        None, categoricals are used during extension of inputs with at least
+        CATEGORICAL_MIN_ROWS rows and decoded back to object columns before
+        being returned.
+    n_jobs : int, default=1
+        Number of worker processes to extend the host type + sample type
+        groups in.
+    copy : bool, default=True
+        Whether to start from a deep copy of the raw metadata rather than a
+        shallow copy of it. The raw metadata is not modified either way.
+    string_storage : Optional[str], default=None
+        If given, the storage ("pyarrow" or "python") of the pandas string
+        dtype to carry string columns in.
+    backend : str, default=PANDAS_BACKEND
+        One of EXTENSION_BACKENDS.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each group stops.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each group.
+    timings_callback : Optional[Callable[[Dict[str, Any]], None]], default=None
+        If given, called with a StageTimer event at the end of each stage.
 
     Returns
     -------
@@ -531,34 +1800,146 @@ def _populate_metadata_df(
         A tuple containing:
             - The populated metadata DataFrame
             - A DataFrame containing validation messages
-    """
-    metadata_df = raw_metadata_df.copy()
-    # Don't try to populate the QC_NOTE_KEY field, since it is an internal field
-    update_metadata_df_field(metadata_df, QC_NOTE_KEY, LEAVE_BLANK_VAL)
 
-    # Error for NaNs in sample name, warn for NaNs in host- and sample-type- shorthand fields.
-    metadata_df = _catch_nan_required_fields(metadata_df)
+    Raises
+    ------
+    ValueError
+        If backend or validation_engine is not recognized, or if the polars
+        backend is asked for along with n_jobs other than 1 or
+        use_categoricals=True.
+
+    Notes
+    -----
+    No step makes a defensive full copy of the metadata: fields are updated
+    by swapping in new columns rather than writing into existing ones, so
+    DataFrames that share columns (e.g., a shallow copy of the raw
+    metadata) are never modified through each other. This doesn't rely on
+    pandas' copy-on-write mode, whose global option is left alone.
+    """
+    if backend not in EXTENSION_BACKENDS:
+        raise ValueError(f"Unrecognized extension backend '{backend}'; "
+                         f"must be one of {EXTENSION_BACKENDS}")
+    if validation_engine not in VALIDATION_ENGINES:
+        raise ValueError(f"Unrecognized validation engine "
+                         f"'{validation_engine}'; must be one of "
+                         f"{VALIDATION_ENGINES}")
+
+    if backend == POLARS_BACKEND:
+        if n_jobs != 1:
+            raise ValueError("The polars backend does not support n_jobs "
+                             "other than 1")
+        if use_categoricals:
+            raise ValueError("The polars backend does not support "
+                             "categoricals")
+        use_categoricals = False
+
+    # categoricals chosen automatically (rather than asked for) are an
+    # internal detail, so don't change the dtypes the caller gets back
+    decode_categoricals = use_categoricals is None
+    if use_categoricals is None:
+        use_categoricals = len(raw_metadata_df) >= CATEGORICAL_MIN_ROWS
+
+    timer = StageTimer(timings_callback)
+    full_flat_config_dict = schema_index.full_flat_config_dict
+    if backend == POLARS_BACKEND:
+        # the polars backend never modifies the raw metadata, and its own
+        # string handling makes converting to string dtype up front moot
+        polars_backend = _get_polars_backend()
+        metadata_df, validation_msgs = \
+            polars_backend.generate_metadata_with_polars(
+                raw_metadata_df, schema_index, transformer_funcs_dict,
+                validation_engine=validation_engine, max_errors=max_errors,
+                max_errors_per_field=max_errors_per_field, timer=timer)
+        with timer.time_stage(POST_TRANSFORM_STAGE, len(metadata_df)):
+            metadata_df = polars_backend.transform_metadata_df_by_value(
+                metadata_df, full_flat_config_dict,
+                POST_TRANSFORMERS_KEY, transformer_funcs_dict)
+        return _finish_metadata_df(
+            metadata_df, validation_msgs, string_storage, timer)
+
+    with timer.time_stage(INITIALIZE_STAGE, len(raw_metadata_df)):
+        metadata_df = raw_metadata_df.copy(deep=copy)
+        if string_storage is not None:
+            metadata_df = convert_str_cols_to_string_dtype(
+                metadata_df, string_storage)
+        # Don't try to populate the QC_NOTE_KEY field, since it is an internal field
+        update_metadata_df_field(metadata_df, QC_NOTE_KEY, LEAVE_BLANK_VAL)
+
+        # Error for NaNs in sample name, warn for NaNs in host- and sample-type- shorthand fields.
+        metadata_df = _catch_nan_required_fields(metadata_df)
 
     # Apply pre-transformers to the metadata, adding values that depend on transforming other fields.
-    metadata_df = _transform_metadata(
-        metadata_df, full_flat_config_dict,
-        PRE_TRANSFORMERS_KEY, transformer_funcs_dict)
+    with timer.time_stage(PRE_TRANSFORM_STAGE, len(metadata_df)):
+        metadata_df = _transform_metadata(
+            metadata_df, full_flat_config_dict,
+            PRE_TRANSFORMERS_KEY, transformer_funcs_dict)
+
+    # Now that the shorthand fields are final, optionally switch the internal
+    # fields to categoricals so grouping and masking work on integer codes.
+    if use_categoricals:
+        with timer.time_stage(ENCODE_CATEGORICALS_STAGE, len(metadata_df)):
+            metadata_df = _encode_internal_cols_as_categoricals(metadata_df)
 
     # Add specific metadata based on each host type present in the metadata.
     metadata_df, validation_msgs = _generate_metadata_for_host_types(
-        metadata_df, full_flat_config_dict)
+        metadata_df, schema_index, n_jobs=n_jobs,
+        validation_engine=validation_engine, max_errors=max_errors,
+        max_errors_per_field=max_errors_per_field, timer=timer)
 
     # Apply post-transformers to the metadata, adding values that depend on transforming other fields
     # that only now have values.
-    metadata_df = _transform_metadata(
-        metadata_df, full_flat_config_dict,
-        POST_TRANSFORMERS_KEY, transformer_funcs_dict)
+    with timer.time_stage(POST_TRANSFORM_STAGE, len(metadata_df)):
+        metadata_df = _transform_metadata(
+            metadata_df, full_flat_config_dict,
+            POST_TRANSFORMERS_KEY, transformer_funcs_dict)
 
-    # Reorder the metadata columns for better readability.
-    metadata_df = _reorder_df(metadata_df, INTERNAL_COL_KEYS)
+    if use_categoricals and decode_categoricals:
+        metadata_df = _decode_internal_cols_from_categoricals(metadata_df)
+
+    return _finish_metadata_df(
+        metadata_df, validation_msgs, string_storage, timer)
+
+
+def _finish_metadata_df(
+        metadata_df: pandas.DataFrame,
+        validation_msgs: List[str],
+        string_storage: Optional[str],
+        timer: StageTimer) -> Tuple[pandas.DataFrame, pandas.DataFrame]:
+    """Convert string columns if asked, reorder columns and gather validation messages.
 
-    # Turn the validation messages into a DataFrame of validation messages for easier use downstream.
-    validation_msgs_df = pandas.DataFrame(validation_msgs)
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The fully populated and transformed metadata DataFrame.
+    validation_msgs : List[str]
+        The validation messages from all host type + sample type groups.
+    string_storage : Optional[str]
+        If given, the storage ("pyarrow" or "python") of the pandas string
+        dtype to carry string columns in.
+    timer : StageTimer
+        Timer for the stages.
+
+    Returns
+    -------
+    Tuple[pandas.DataFrame, pandas.DataFrame]
+        A tuple containing:
+            - The finished metadata DataFrame
+            - A DataFrame containing validation messages
+    """
+    # Columns added during extension (and any raw columns that picked up
+    # object values along the way) start out as object columns, so convert
+    # the string ones too.
+    if string_storage is not None:
+        with timer.time_stage(CONVERT_STRINGS_STAGE, len(metadata_df)):
+            metadata_df = convert_str_cols_to_string_dtype(
+                metadata_df, string_storage)
+
+    with timer.time_stage(REORDER_STAGE, len(metadata_df)):
+        # Reorder the metadata columns for better readability.
+        metadata_df = _reorder_df(metadata_df, INTERNAL_COL_KEYS)
+
+        # Turn the validation messages into a DataFrame of validation messages for easier use downstream.
+        validation_msgs_df = pandas.DataFrame(validation_msgs)
 
     return metadata_df, validation_msgs_df
 
@@ -591,13 +1972,79 @@ def _catch_nan_required_fields(metadata_df: pandas.DataFrame) -> pandas.DataFram
     for curr_key in [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]:
         nan_mask = metadata_df[curr_key].isna()
         if nan_mask.any():
-            metadata_df.loc[nan_mask, curr_key] = "empty"
+            # swap in a new column rather than writing into this one, which
+            # may be shared with the raw metadata
+            metadata_df[curr_key] = metadata_df[curr_key].mask(
+                nan_mask, "empty")
             logging.warning(f"Metadata contains NaN {curr_key}s; "
                             f"these have been set to 'empty'")
 
     return metadata_df
 
 
+def _encode_internal_cols_as_categoricals(
+        metadata_df: pandas.DataFrame) -> pandas.DataFrame:
+    """Convert the internal columns of a metadata DataFrame to categoricals.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata DataFrame to process, which must contain the columns
+        in INTERNAL_COL_KEYS and no NaNs in them. Modified in place.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The processed DataFrame. The QC_NOTE_KEY column has the fixed
+        categories in QC_NOTE_CATEGORIES so that notes can be set later;
+        the shorthand columns have the categories found in the metadata.
+    """
+    for curr_key in [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]:
+        metadata_df[curr_key] = metadata_df[curr_key].astype("category")
+    metadata_df[QC_NOTE_KEY] = pandas.Categorical(
+        metadata_df[QC_NOTE_KEY], categories=QC_NOTE_CATEGORIES)
+    return metadata_df
+
+
+def _decode_internal_cols_from_categoricals(
+        metadata_df: pandas.DataFrame) -> pandas.DataFrame:
+    """Convert the categorical internal columns of a metadata DataFrame to objects.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata DataFrame to process.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The processed DataFrame, in which any of the columns in
+        INTERNAL_COL_KEYS that were categoricals are object columns.
+    """
+    categorical_cols = [x for x in _get_categorical_cols(metadata_df)
+                        if x in INTERNAL_COL_KEYS]
+    if categorical_cols:
+        metadata_df = metadata_df.astype(
+            {x: object for x in categorical_cols})
+    return metadata_df
+
+
+def _get_categorical_cols(a_df: pandas.DataFrame) -> List[str]:
+    """Get the names of the categorical columns in a DataFrame.
+
+    Parameters
+    ----------
+    a_df : pandas.DataFrame
+        The DataFrame to check.
+
+    Returns
+    -------
+    List[str]
+        Names of the columns with a categorical dtype, in column order.
+    """
+    return a_df.select_dtypes(include="category").columns.tolist()
+
+
 # transformer runner function
 def _transform_metadata(
         metadata_df: pandas.DataFrame,
@@ -643,22 +2090,9 @@ def _transform_metadata(
             for curr_target_field, curr_transformer_dict in \
                     stage_transformers.items():
                 curr_source_fields = curr_transformer_dict[SOURCES_KEY]
-                curr_func_name = curr_transformer_dict[FUNCTION_KEY]
-
-                try:
-                    curr_func = transformer_funcs_dict[curr_func_name]
-                except KeyError:
-                    try:
-                        # if the transformer function isn't in the dictionary
-                        # that was passed in, probably it is a built-in one,
-                        # so look for it in the qiimp transformers module
-                        # looking into the qiimp transformers module
-                        curr_func = getattr(transformers, curr_func_name)
-                    except AttributeError:
-                        raise ValueError(
-                            f"Unable to find transformer '{curr_func_name}'")
-                    # end try to find in qiimp transformers
-                # end try to find in input (study-specific) transformers
+                curr_func = _get_transformer_func(
+                    curr_transformer_dict[FUNCTION_KEY],
+                    transformer_funcs_dict)
 
                 # apply the function named curr_func_name to the column(s) of the
                 # metadata_df named curr_source_fields to fill curr_target_field
@@ -672,9 +2106,54 @@ def _transform_metadata(
     return metadata_df
 
 
+def _get_transformer_func(
+        func_name: str,
+        transformer_funcs_dict: Dict[str, Any]) -> Callable:
+    """Find a transformer function by name.
+
+    Parameters
+    ----------
+    func_name : str
+        Name of the transformer function.
+    transformer_funcs_dict : Dict[str, Any]
+        Dictionary of study-specific transformer functions, keyed by name;
+        these take precedence over the built-in transformers.
+
+    Returns
+    -------
+    Callable
+        The transformer function, which takes a row and a list of source
+        field names.
+
+    Raises
+    ------
+    ValueError
+        If the transformer function cannot be found.
+    """
+    try:
+        curr_func = transformer_funcs_dict[func_name]
+    except KeyError:
+        try:
+            # if the transformer function isn't in the dictionary
+            # that was passed in, probably it is a built-in one,
+            # so look for it in the qiimp transformers module
+            curr_func = getattr(transformers, func_name)
+        except AttributeError:
+            raise ValueError(
+                f"Unable to find transformer '{func_name}'")
+        # end try to find in qiimp transformers
+    # end try to find in input (study-specific) transformers
+    return curr_func
+
+
 def _generate_metadata_for_host_types(
         metadata_df: pandas.DataFrame,
-        full_flat_config_dict: Dict[str, Any]) -> Tuple[pandas.DataFrame, List[str]]:
+        schema_index: ResolvedSchemaIndex,
+        n_jobs: int = 1,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timer: Optional[StageTimer] = None) -> Tuple[pandas.DataFrame, List[str]]:
     """Generate metadata for samples of all host types in the DataFrame.
 
     Parameters
@@ -682,8 +2161,24 @@ def _generate_metadata_for_host_types(
     metadata_df : pandas.DataFrame
         The metadata DataFrame to process, which must contain at least
         the columns in REQUIRED_RAW_METADATA_FIELDS.
-    full_flat_config_dict : Dict[str, Any]
-        Fully combined flat-host-type config dictionary.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    n_jobs : int, default=1
+        Number of worker processes to spread the host type + sample type
+        groups over; 1 processes them all in this process, and a value less
+        than 1 uses all available cores.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES, to validate each group with.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each group stops.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each group.
+    timer : Optional[StageTimer], default=None
+        Timer for the generation and validation of each group and for their
+        combination. Groups processed in worker processes are timed there
+        and reported in group order once all are done.
 
     Returns
     -------
@@ -691,28 +2186,127 @@ def _generate_metadata_for_host_types(
         A tuple containing:
             - The processed DataFrame with specific metadata added to each sample of each host type
             - A list of validation messages
+
+    Notes
+    -----
+    The group indices for every host type + sample type combination are
+    computed in a single pass over the input; each group is then taken
+    directly from the input by position and all processed groups are
+    concatenated once at the end.  Output rows are ordered by host type (in
+    order of first appearance) and then by sample type within host type (in
+    order of first appearance), with invalid host types kept as one group.
+    Whether or not the groups are processed in parallel, their results are
+    merged in this order.
     """
     # gather global settings
-    settings_dict = {DEFAULT_KEY: full_flat_config_dict.get(DEFAULT_KEY),
-                     LEAVE_REQUIREDS_BLANK_KEY:
-                         full_flat_config_dict.get(LEAVE_REQUIREDS_BLANK_KEY),
-                     OVERWRITE_NON_NANS_KEY:
-                         full_flat_config_dict.get(OVERWRITE_NON_NANS_KEY)}
+    settings_dict = schema_index.settings_dict
+    if timer is None:
+        timer = StageTimer()
+    is_timing = timer.callback is not None
+
+    groups = _get_host_and_sample_type_groups(metadata_df, schema_index)
+    group_results = [None] * len(groups)
+    # timing events of each group, reported in group order once all are done
+    group_events = [[] for _ in groups]
+    sample_type_tasks = []
+    for curr_index, (curr_host_type, curr_sample_type, curr_positions) in \
+            enumerate(groups):
+        curr_group_df = metadata_df.take(curr_positions)
+
+        if curr_sample_type is None:
+            # if the host type is not in the config, add a QC note to the
+            # metadata for these samples but do not error out; move on
+            curr_timer = StageTimer(
+                group_events[curr_index].append if is_timing else None)
+            with curr_timer.time_stage(
+                    GENERATE_GROUP_STAGE, len(curr_group_df),
+                    host_type=curr_host_type, sample_type=curr_sample_type):
+                update_metadata_df_field(
+                    curr_group_df, QC_NOTE_KEY, INVALID_HOST_TYPE_QC_NOTE)
+            group_results[curr_index] = (curr_group_df, [])
+        else:
+            sample_type_tasks.append(
+                (curr_index, curr_group_df, curr_host_type, curr_sample_type))
+        # endif host_type is valid
+    # next host type + sample type group
+
+    # generate the specific metadata for each sample type *in each host type*
+    if n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    n_workers = min(n_jobs, len(sample_type_tasks))
+    if n_workers <= 1:
+        for curr_index, curr_group_df, curr_host_type, curr_sample_type in \
+                sample_type_tasks:
+            group_results[curr_index] = \
+                _generate_metadata_for_a_sample_type_in_a_host_type(
+                    curr_group_df, curr_host_type, curr_sample_type,
+                    schema_index, validation_engine=validation_engine,
+                    max_errors=max_errors,
+                    max_errors_per_field=max_errors_per_field,
+                    timer=StageTimer(
+                        group_events[curr_index].append if is_timing
+                        else None))
+        # next sample type group
+    else:
+        # ship the resolved config to each worker once, rather than
+        # with every group
+        with ProcessPoolExecutor(
+                max_workers=n_workers, initializer=_init_group_worker,
+                initargs=(schema_index,)) as executor:
+            # map returns results in the order of its inputs
+            task_results = executor.map(
+                _generate_metadata_for_a_group_in_worker,
+                [x[1] for x in sample_type_tasks],
+                [x[2] for x in sample_type_tasks],
+                [x[3] for x in sample_type_tasks],
+                [validation_engine] * len(sample_type_tasks),
+                [max_errors] * len(sample_type_tasks),
+                [max_errors_per_field] * len(sample_type_tasks),
+                [is_timing] * len(sample_type_tasks))
+            for curr_task, curr_result in zip(sample_type_tasks, task_results):
+                group_results[curr_task[0]] = curr_result[:2]
+                group_events[curr_task[0]] = curr_result[2]
+        # end using executor
+    # endif processing groups in parallel
+
+    for curr_events in group_events:
+        for curr_event in curr_events:
+            timer.report(curr_event)
+    # next group
+
+    with timer.time_stage(COMBINE_GROUPS_STAGE, len(metadata_df)):
+        output_df, validation_msgs = _combine_host_type_groups(
+            group_results, settings_dict)
+    return output_df, validation_msgs
+
 
+def _combine_host_type_groups(
+        group_results: List[Tuple[pandas.DataFrame, List[str]]],
+        settings_dict: Dict[str, Any]) -> Tuple[pandas.DataFrame, List[str]]:
+    """Combine the processed host type + sample type groups into one DataFrame.
+
+    Parameters
+    ----------
+    group_results : List[Tuple[pandas.DataFrame, List[str]]]
+        The (metadata DataFrame, validation messages) of each processed
+        group, in output order.
+    settings_dict : Dict[str, Any]
+        Dictionary containing the global settings.
+
+    Returns
+    -------
+    Tuple[pandas.DataFrame, List[str]]
+        A tuple containing:
+            - The combined DataFrame, with NAs filled with the global
+              default and LEAVE_BLANK_VAL replaced with an empty string
+            - A list of validation messages
+    """
     validation_msgs = []
-    host_type_dfs = []
-    # For all the host types present in the metadata, generate the specific metadata
-    host_type_shorthands = pandas.unique(metadata_df[HOSTTYPE_SHORTHAND_KEY])
-    for curr_host_type_shorthand in host_type_shorthands:
-        concatted_dfs, curr_validation_msgs = _generate_metadata_for_a_host_type(
-                metadata_df, curr_host_type_shorthand, settings_dict, full_flat_config_dict)
-
-        host_type_dfs.append(concatted_dfs)
+    for _, curr_validation_msgs in group_results:
         validation_msgs.extend(curr_validation_msgs)
-    # next host type
 
-    # Concatenate the processed host-type-specific metadata DataFrames into a single output DataFrame
-    output_df = pandas.concat(host_type_dfs, ignore_index=True)
+    # Concatenate the processed group-specific metadata DataFrames into a single output DataFrame
+    output_df = pandas.concat([x[0] for x in group_results], ignore_index=True)
 
     # concatting dfs from different hosts can create large numbers of NAs--
     # for example, if concatting a host-associated df with a control df, where
@@ -726,99 +2320,175 @@ def _generate_metadata_for_host_types(
     # TODO: this is setting a value in the output; should it be centralized
     #  so it is easy to find?
     # Replace the LEAVE_BLANK_VAL with an empty string in the output DataFrame
-    output_df.replace(LEAVE_BLANK_VAL, "", inplace=True)
+    categorical_cols = _get_categorical_cols(output_df)
+    if not categorical_cols:
+        output_df.replace(LEAVE_BLANK_VAL, "", inplace=True)
+    else:
+        # replacing values in a categorical via replace is deprecated, so
+        # mask them instead (every categorical column has "" as a category)
+        for curr_col in categorical_cols:
+            curr_mask = output_df[curr_col] == LEAVE_BLANK_VAL
+            if curr_mask.any():
+                output_df.loc[curr_mask, curr_col] = ""
+        # next categorical column
+        output_df.replace(
+            {x: {LEAVE_BLANK_VAL: ""} for x in output_df.columns
+             if x not in categorical_cols},
+            inplace=True)
+    # endif there are categorical columns
     return output_df, validation_msgs
 
 
-def _generate_metadata_for_a_host_type(
-        metadata_df: pandas.DataFrame,
+def _init_group_worker(schema_index: ResolvedSchemaIndex) -> None:
+    """Store the resolved schema index in a worker process.
+
+    Parameters
+    ----------
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    """
+    global _WORKER_SCHEMA_INDEX
+    _WORKER_SCHEMA_INDEX = schema_index
+
+
+def _generate_metadata_for_a_group_in_worker(
+        sample_type_df: pandas.DataFrame,
         a_host_type: str,
-        settings_dict: Dict[str, Any],
-        full_flat_config_dict: Dict[str, Any]) -> Tuple[pandas.DataFrame, List[str]]:
-    """Generate metadata df for samples with a specific host type.
+        a_sample_type: str,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        is_timing: bool = False) -> \
+        Tuple[pandas.DataFrame, List[str], List[Dict[str, Any]]]:
+    """Generate metadata df for one host type + sample type group in a worker process.
 
     Parameters
     ----------
-    metadata_df : pandas.DataFrame
-        The metadata DataFrame to process, which must contain at least
-        the columns in REQUIRED_RAW_METADATA_FIELDS.
+    sample_type_df : pandas.DataFrame
+        DataFrame containing only the metadata samples for a specific sample
+        type within a specific host type.
     a_host_type : str
-        The specific host type for which to process samples.
-    settings_dict : Dict[str, Any]
-        Dictionary containing global settings for default/nan/etc.
-    full_flat_config_dict : Dict[str, Any]
-        Fully combined flat-host-type config dictionary.
+        The (valid) host type being processed.
+    a_sample_type : str
+        The sample type to process.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES, to validate the group with.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        the group stops.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in the group.
+    is_timing : bool, default=False
+        Whether to time the group's generation and validation.
 
     Returns
     -------
-    Tuple[pandas.DataFrame, List[str]]
-        A tuple containing:
-            - The processed DataFrame with specific metadata added to each sample of the input host type
-            - A list of validation messages
+    Tuple[pandas.DataFrame, List[str], List[Dict[str, Any]]]
+        As for _generate_metadata_for_a_sample_type_in_a_host_type, using the
+        schema index stored by _init_group_worker, plus the StageTimer events
+        for the group (empty if not timing).
     """
-    # get the subset of the metadata DataFrame that contains samples of the input host type
-    host_type_mask = \
-        metadata_df[HOSTTYPE_SHORTHAND_KEY] == a_host_type
-    host_type_df = metadata_df.loc[host_type_mask, :].copy()
-
-    validation_msgs = []
-    known_host_shorthands = full_flat_config_dict[HOST_TYPE_SPECIFIC_METADATA_KEY].keys()
-    if a_host_type not in known_host_shorthands:
-        # if the input host type is not in the config, add a QC note to the metadata
-        # for these samples but do not error out; move on to the next host type
-        update_metadata_df_field(
-            host_type_df, QC_NOTE_KEY, "invalid host_type")
-        # host_type_df[QC_NOTE_KEY] = "invalid host_type"
-        concatted_df = host_type_df
-    else:
-        # gather host-type-specific settings and overwrite the global settings with them, if any
-        a_host_type_config_dict = \
-            full_flat_config_dict[HOST_TYPE_SPECIFIC_METADATA_KEY][a_host_type]
-        global_plus_host_settings_dict = deepcopy_dict(settings_dict)
-        # if this host type has a default value for empty fields, use it; otherwise, use the global default
-        global_plus_host_settings_dict[DEFAULT_KEY] = a_host_type_config_dict.get(
-            DEFAULT_KEY, global_plus_host_settings_dict[DEFAULT_KEY])
-
-        dfs_to_concat = []
-        # loop through each sample type in the metadata for this host type
-        found_host_sample_types = \
-            pandas.unique(host_type_df[SAMPLETYPE_SHORTHAND_KEY])
-        for curr_sample_type in found_host_sample_types:
-            # generate the specific metadata for this sample type *in this host type*
-            curr_sample_type_df, curr_validation_msgs = \
-                _generate_metadata_for_a_sample_type_in_a_host_type(
-                    host_type_df, curr_sample_type, global_plus_host_settings_dict,
-                    a_host_type_config_dict)
+    group_events = []
+    sample_type_df, validation_msgs = \
+        _generate_metadata_for_a_sample_type_in_a_host_type(
+            sample_type_df, a_host_type, a_sample_type,
+            _WORKER_SCHEMA_INDEX, validation_engine=validation_engine,
+            max_errors=max_errors,
+            max_errors_per_field=max_errors_per_field,
+            timer=StageTimer(group_events.append if is_timing else None))
+    return sample_type_df, validation_msgs, group_events
+
+
+def _get_host_and_sample_type_groups(
+        metadata_df: pandas.DataFrame,
+        schema_index: ResolvedSchemaIndex) -> \
+        List[Tuple[str, Optional[str], np.ndarray]]:
+    """Compute the row positions of each host type + sample type group.
 
-            dfs_to_concat.append(curr_sample_type_df)
-            validation_msgs.extend(curr_validation_msgs)
-        # next sample type in metadata for this host type
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata DataFrame to group, which must contain at least
+        the columns in REQUIRED_RAW_METADATA_FIELDS.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
 
-        # Concatenate the processed sample-type-specific metadata DataFrames
-        # for the host type into a single output DataFrame
-        concatted_df = pandas.concat(dfs_to_concat, ignore_index=True)
-    # endif host_type is valid
+    Returns
+    -------
+    List[Tuple[str, Optional[str], np.ndarray]]
+        A list of (host type, sample type, row positions) tuples, ordered by
+        first appearance of the host type and then by first appearance of
+        the sample type within that host type.  Host types that are not in
+        the config are returned as a single group with a sample type of None
+        and their row positions in input order.
+    """
+    pair_positions = metadata_df.groupby(
+        [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY],
+        sort=False, observed=True).indices
+    # with two keys, sort=False orders the groups by the first appearance
+    # of each key separately, not of each host type + sample type pair, so
+    # put the pairs in order of their first row (positions are ascending)
+    sorted_pairs = sorted(
+        pair_positions.items(), key=lambda x: x[1][0])
+
+    # bucket the pairs by host type; dicts keep insertion order, so host
+    # types stay in order of first appearance as well
+    positions_by_host_type = {}
+    for (curr_host_type, curr_sample_type), curr_positions in sorted_pairs:
+        positions_by_host_type.setdefault(curr_host_type, []).append(
+            (curr_sample_type, curr_positions))
+    # next host type + sample type pair
+
+    groups = []
+    for curr_host_type, curr_sample_groups in positions_by_host_type.items():
+        if not schema_index.has_host_type(curr_host_type):
+            host_positions = np.sort(np.concatenate(
+                [x[1] for x in curr_sample_groups]))
+            groups.append((curr_host_type, None, host_positions))
+        else:
+            groups.extend(
+                (curr_host_type, curr_sample_type, curr_positions)
+                for curr_sample_type, curr_positions in curr_sample_groups)
+        # endif host_type is valid
+    # next host type
 
-    return concatted_df, validation_msgs
+    return groups
 
 
 def _generate_metadata_for_a_sample_type_in_a_host_type(
-        host_type_metadata_df: pandas.DataFrame,
+        sample_type_df: pandas.DataFrame,
+        a_host_type: str,
         a_sample_type: str,
-        global_plus_host_settings_dict: Dict[str, Any],
-        a_host_type_config_dict: Dict[str, Any]) -> Tuple[pandas.DataFrame, List[str]]:
+        schema_index: ResolvedSchemaIndex,
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timer: Optional[StageTimer] = None) -> Tuple[pandas.DataFrame, List[str]]:
     """Generate metadata df for samples with a specific sample type within a specific host type.
 
     Parameters
     ----------
-    host_type_metadata_df : pandas.DataFrame
-        DataFrame containing metadata samples for a specific host type.
+    sample_type_df : pandas.DataFrame
+        DataFrame containing only the metadata samples for a specific sample
+        type within a specific host type; it is modified in place.
+    a_host_type : str
+        The (valid) host type being processed.
     a_sample_type : str
         The sample type to process.
-    global_plus_host_settings_dict : Dict[str, Any]
-        Dictionary containing default/nan/etc settings for current context.
-    a_host_type_config_dict : Dict[str, Any]
-        Dictionary containing config for this host type.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES, to validate the group with.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        the group stops.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in the group.
+    timer : Optional[StageTimer], default=None
+        Timer for the group's generation and (if the sample type is valid)
+        validation stages.
 
     Returns
     -------
@@ -827,152 +2497,68 @@ def _generate_metadata_for_a_sample_type_in_a_host_type(
             - The updated metadata DataFrame with sample-type-specific elements added
             - A list of validation messages
     """
-    # copy the metadata fields dict from the host type config to be the
-    # basis of the work-in-progress metadata dict--these are the default fields
-    # that will be overwritten, if necessary, by sample type-specific fields
-    wip_metadata_fields_dict = deepcopy_dict(
-        a_host_type_config_dict.get(METADATA_FIELDS_KEY, {}))
-
-    # get the config section for *all* sample types within this host type
-    host_sample_types_config_dict = \
-        a_host_type_config_dict[SAMPLE_TYPE_SPECIFIC_METADATA_KEY]
-
-    # get df of records for this sample type in this host type
-    sample_type_mask = \
-        host_type_metadata_df[SAMPLETYPE_SHORTHAND_KEY] == a_sample_type
-    sample_type_df = host_type_metadata_df.loc[sample_type_mask, :].copy()
+    if timer is None:
+        timer = StageTimer()
+    stage_details = {"host_type": a_host_type, "sample_type": a_sample_type}
 
     validation_msgs = []
-    known_sample_types = host_sample_types_config_dict.keys()
-    if a_sample_type not in known_sample_types:
+    if not schema_index.has_sample_type(a_host_type, a_sample_type):
         # if the input sample type is not in the config, add a QC note to the metadata
         # for these samples but do not error out; move on to the next sample type
-        update_metadata_df_field(
-            sample_type_df, QC_NOTE_KEY, "invalid sample_type")
+        with timer.time_stage(
+                GENERATE_GROUP_STAGE, len(sample_type_df), **stage_details):
+            update_metadata_df_field(
+                sample_type_df, QC_NOTE_KEY, INVALID_SAMPLE_TYPE_QC_NOTE)
         # sample_type_df[QC_NOTE_KEY] = "invalid sample_type"
     else:
-        # resolve any aliases and base types for the sample type and combine its
-        # specific metadata fields with the host type's metadata fields
-        # to get the full set of config info for this host+sample type
+        # look up the full set of config info for this host+sample type, with
+        # any aliases and base types already resolved and the sample type's
+        # specific metadata fields already combined with the host type's
+        global_plus_host_settings_dict = \
+            schema_index.get_host_type_settings_dict(a_host_type)
+        sample_type_schema = schema_index.get_sample_type_schema(
+            a_host_type, a_sample_type)
         full_sample_type_metadata_fields_dict = \
-            _construct_sample_type_metadata_fields_dict(
-                a_sample_type, host_sample_types_config_dict, wip_metadata_fields_dict)
-
-        # update the metadata df with the sample type specific metadata fields
-        # TODO: this is taking in wip_metadata_fields_dict instead of full_sample_type_metadata_fields_dict,
-        # which only works because the code underlying _construct_sample_type_metadata_fields_dict
-        # is *modifying* wip_metadata_fields_dict in place. This should be corrected, but that
-        # needs to wait until there are tests to make sure doing so doesn't break anything.
-        sample_type_df = _update_metadata_from_dict(
-            sample_type_df, wip_metadata_fields_dict, dict_is_metadata_fields=True,
-            overwrite_non_nans=global_plus_host_settings_dict[OVERWRITE_NON_NANS_KEY])
-
-        # for fields that are required but not yet filled, either leave blank
-        # or fill with NA (later replaced with default) based on config setting
-        leave_reqs_blank = global_plus_host_settings_dict[LEAVE_REQUIREDS_BLANK_KEY]
-        reqs_val = LEAVE_BLANK_VAL if leave_reqs_blank else np.nan
-        sample_type_df.replace(
-            to_replace=REQ_PLACEHOLDER, value=reqs_val, inplace=True)
-
-        # fill NAs with default value if any is set
-        sample_type_df = _fill_na_if_default(
-            sample_type_df, full_sample_type_metadata_fields_dict, global_plus_host_settings_dict)
+            sample_type_schema.metadata_fields_dict
+
+        with timer.time_stage(
+                GENERATE_GROUP_STAGE, len(sample_type_df), **stage_details):
+            # update the metadata df with the sample type specific metadata fields
+            sample_type_df = _update_metadata_from_dict(
+                sample_type_df, full_sample_type_metadata_fields_dict,
+                dict_is_metadata_fields=True,
+                overwrite_non_nans=global_plus_host_settings_dict[OVERWRITE_NON_NANS_KEY],
+                copy=False)
+
+            # for fields that are required but not yet filled, either leave blank
+            # or fill with NA (later replaced with default) based on config setting
+            leave_reqs_blank = global_plus_host_settings_dict[LEAVE_REQUIREDS_BLANK_KEY]
+            reqs_val = LEAVE_BLANK_VAL if leave_reqs_blank else np.nan
+            sample_type_df.replace(
+                to_replace=REQ_PLACEHOLDER, value=reqs_val, inplace=True)
+
+            # fill NAs with default value if any is set
+            sample_type_df = _fill_na_if_default(
+                sample_type_df, full_sample_type_metadata_fields_dict, global_plus_host_settings_dict)
 
         # validate the metadata df based on the specific requirements
         # for this host+sample type
-        validation_msgs = validate_metadata_df(
-            sample_type_df, full_sample_type_metadata_fields_dict)
+        with timer.time_stage(
+                VALIDATE_GROUP_STAGE, len(sample_type_df), **stage_details):
+            validation_msgs = validate_metadata_df(
+                sample_type_df, full_sample_type_metadata_fields_dict,
+                engine=validation_engine, max_errors=max_errors,
+                max_errors_per_field=max_errors_per_field)
 
     return sample_type_df, validation_msgs
 
 
-def _construct_sample_type_metadata_fields_dict(
-        sample_type: str,
-        host_sample_types_config_dict: Dict[str, Any],
-        a_host_type_metadata_fields_dict: Dict[str, Any]) -> Dict[str, Any]:
-    """Construct metadata fields dictionary for a specific host+sample type, resolving aliases and base types.
-
-    Parameters
-    ----------
-    sample_type : str
-        The sample type to process.
-    host_sample_types_config_dict : Dict[str, Any]
-        Dictionary containing config for *all* sample types in
-        the host type in question.
-    a_host_type_metadata_fields_dict : Dict[str, Any]
-        Dictionary containing metadata fields for the host type in question.
-
-    Returns
-    -------
-    Dict[str, Any]
-        The constructed metadata fields dictionary for this host-and-sample-type combination.
-
-    Raises
-    ------
-    ValueError
-        If there are invalid alias chains or base type configurations.
-    """
-    sample_type_for_metadata = sample_type
-
-    # get dict associated with the naive sample type
-    sample_type_specific_dict = \
-        host_sample_types_config_dict[sample_type]
-
-    # if naive sample type contains an alias
-    sample_type_alias = sample_type_specific_dict.get(ALIAS_KEY)
-    if sample_type_alias:
-        # change the sample type to the alias sample type
-        # and use the alias's sample type dict
-        sample_type_for_metadata = sample_type_alias
-        sample_type_specific_dict = \
-            host_sample_types_config_dict[sample_type_alias]
-        if METADATA_FIELDS_KEY not in sample_type_specific_dict:
-            raise ValueError(f"May not chain aliases "
-                             f"('{sample_type}' to '{sample_type_alias}')")
-    # endif sample type is an alias
-
-    # if the sample type has a base type
-    sample_type_base = sample_type_specific_dict.get(BASE_TYPE_KEY)
-    if sample_type_base:
-        # get the base's sample type dict and add this sample type's
-        # info on top of it
-        base_sample_dict = host_sample_types_config_dict[sample_type_base]
-        if list(base_sample_dict.keys()) != [METADATA_FIELDS_KEY]:
-            raise ValueError(f"Base sample type '{sample_type_base}' "
-                             f"must only have metadata fields")
-        sample_type_specific_dict_metadata = update_wip_metadata_dict(
-            sample_type_specific_dict.get(METADATA_FIELDS_KEY, {}),
-            base_sample_dict[METADATA_FIELDS_KEY])
-        sample_type_specific_dict[METADATA_FIELDS_KEY] = \
-            sample_type_specific_dict_metadata
-    # endif sample type has a base type
-
-    # add the sample-type-specific info generated above on top of the host info
-    sample_type_metadata_dict = update_wip_metadata_dict(
-        a_host_type_metadata_fields_dict,
-        sample_type_specific_dict.get(METADATA_FIELDS_KEY, {}))
-
-    # set sample_type, and qiita_sample_type if it is not already set
-    sample_type_definition = {
-        ALLOWED_KEY: [sample_type_for_metadata],
-        DEFAULT_KEY: sample_type_for_metadata,
-        TYPE_KEY: "string"
-    }
-    sample_type_metadata_dict = update_wip_metadata_dict(
-        sample_type_metadata_dict, {SAMPLE_TYPE_KEY: sample_type_definition})
-    if QIITA_SAMPLE_TYPE not in sample_type_metadata_dict:
-        sample_type_metadata_dict = update_wip_metadata_dict(
-            sample_type_metadata_dict, {QIITA_SAMPLE_TYPE: sample_type_definition})
-    # end if qiita_sample_type not already set
-
-    return sample_type_metadata_dict
-
-
 def _update_metadata_from_dict(
         metadata_df: pandas.DataFrame,
         config_section_dict: Dict[str, Any],
         dict_is_metadata_fields: bool = False,
-        overwrite_non_nans: bool = False) -> pandas.DataFrame:
+        overwrite_non_nans: bool = False,
+        copy: bool = True) -> pandas.DataFrame:
     """Create an updated copy of the metadata DataFrame based on an input dictionary.
 
     Parameters
@@ -987,6 +2573,9 @@ def _update_metadata_from_dict(
         a METADATA_FIELDS_KEY (in which case True).
     overwrite_non_nans : bool, default=False
         Whether to overwrite non-NaN values with default values.
+    copy : bool, default=True
+        Whether to leave the input DataFrame unmodified. If False, fields
+        already in the metadata are updated in place.
 
     Returns
     -------
@@ -1000,14 +2589,15 @@ def _update_metadata_from_dict(
 
     output_df = _update_metadata_from_metadata_fields_dict(
         metadata_df, metadata_fields_dict,
-        overwrite_non_nans=overwrite_non_nans)
+        overwrite_non_nans=overwrite_non_nans, copy=copy)
     return output_df
 
 
 def _update_metadata_from_metadata_fields_dict(
         metadata_df: pandas.DataFrame,
         metadata_fields_dict: Dict[str, Any],
-        overwrite_non_nans: bool) -> pandas.DataFrame:
+        overwrite_non_nans: bool,
+        copy: bool = True) -> pandas.DataFrame:
     """Create an updated copy of the metadata DataFrame based on a metadata fields dictionary.
 
     Parameters
@@ -1018,13 +2608,47 @@ def _update_metadata_from_metadata_fields_dict(
         Dictionary containing metadata field definitions and required values.
     overwrite_non_nans : bool
         Whether to overwrite non-NaN values with default values.
+    copy : bool, default=True
+        Whether to leave the input DataFrame unmodified. If False, fields
+        already in the metadata are updated in place.
 
     Returns
     -------
     pandas.DataFrame
         An updated copy of the metadata DataFrame.
     """
-    output_df = metadata_df.copy()
+    fill_vals_dict = _get_metadata_fields_fill_vals(
+        metadata_fields_dict, metadata_df.columns)
+
+    # set all the fields at once so that new fields are added as a single
+    # block rather than inserted into the df one column at a time
+    output_df = update_metadata_df_fields(
+        metadata_df, fill_vals_dict, overwrite_non_nans=overwrite_non_nans,
+        copy=copy)
+    return output_df
+
+
+def _get_metadata_fields_fill_vals(
+        metadata_fields_dict: Dict[str, Any],
+        existing_col_names: Iterable[str]) -> Dict[str, Any]:
+    """Get the constant values to set fields to based on a metadata fields dictionary.
+
+    Parameters
+    ----------
+    metadata_fields_dict : Dict[str, Any]
+        Dictionary containing metadata field definitions and required values.
+    existing_col_names : Iterable[str]
+        Names of the columns already in the metadata.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Dictionary of field name to the value to set that field to, in
+        metadata fields dictionary order: the field's default if it has one,
+        or REQ_PLACEHOLDER if it is required, has no default and is not
+        already in the metadata.
+    """
+    fill_vals_dict = {}
     # loop through each metadata field in the metadata fields dict
     for curr_field_name, curr_field_vals_dict in metadata_fields_dict.items():
         # if the field has a default value (regardless of whether it is
@@ -1035,22 +2659,20 @@ def _update_metadata_from_metadata_fields_dict(
         # if the field already exists in the metadata; otherwise, the field
         # will be added to the metadata with the default value throughout.
         if DEFAULT_KEY in curr_field_vals_dict:
-            curr_default_val = curr_field_vals_dict[DEFAULT_KEY]
-            update_metadata_df_field(
-                output_df, curr_field_name, curr_default_val,
-                overwrite_non_nans=overwrite_non_nans)
+            fill_vals_dict[curr_field_name] = curr_field_vals_dict[DEFAULT_KEY]
         # if the field is required BUT has no default value, then if the field does not
         # already exist in the metadata, add the field to the metadata with a placeholder value.
         elif REQUIRED_KEY in curr_field_vals_dict:
             curr_required_val = curr_field_vals_dict[REQUIRED_KEY]
-            if curr_required_val and curr_field_name not in output_df:
-                update_metadata_df_field(
-                    output_df, curr_field_name, REQ_PLACEHOLDER,
-                    overwrite_non_nans=overwrite_non_nans)
+            if curr_required_val and \
+                    curr_field_name not in existing_col_names:
+                fill_vals_dict[curr_field_name] = REQ_PLACEHOLDER
         # note that if the field is (a) required, (b) does not have a
         # default value, and (c) IS already in the metadata, it will
         # be left alone, with no changes made to it!
-    return output_df
+    # next metadata field
+
+    return fill_vals_dict
 
 
 # fill NAs with default value if any is set
@@ -1077,11 +2699,13 @@ def _fill_na_if_default(
     """
     default_val = specific_dict.get(DEFAULT_KEY, settings_dict[DEFAULT_KEY])
     if default_val:
+        # categorical (internal) columns never hold NaNs and can't be filled
+        # with a value that isn't one of their categories, so skip them
+        categorical_cols = _get_categorical_cols(metadata_df)
         # TODO: this is setting a value in the output; should it be
         #  centralized so it is easy to find?
-        metadata_df = \
-            metadata_df.fillna(default_val)
-#             metadata_df.astype("string").fillna(default_val)
+        metadata_df = fill_nas_with_constant(
+            metadata_df, default_val, skip_cols=categorical_cols)
 
     return metadata_df
 
@@ -1137,8 +2761,7 @@ def _output_metadata_df_to_files(
         # then remove the qc fails and the internal columns from the metadata
         # TODO: I'd like to avoid repeating this mask here + in get_qc_failures
         fails_qc_mask = a_df[QC_NOTE_KEY] != ""
-        a_df = a_df.loc[~fails_qc_mask, :].copy()
-        a_df = a_df.drop(columns=internal_col_names)
+        a_df = a_df.loc[~fails_qc_mask, :].drop(columns=internal_col_names)
 
     # output the metadata
     out_fp = os.path.join(out_dir, f"{timestamp_str}_{out_base}.{extension}")
@@ -1158,21 +2781,42 @@ def _reorder_df(a_df: pandas.DataFrame, internal_col_names: List[str]) -> pandas
     Returns
     -------
     pandas.DataFrame
-        A reordered copy of the input DataFrame with:
+        A reordered version of the input DataFrame with:
             - sample_name as the first column
             - remaining columns except for internal columns in alphabetical order
             - internal columns at the end in the order they were provided
     """
     # sort columns alphabetically
-    working_df = a_df.copy().reindex(sorted(a_df.columns), axis=1)
+    col_names = sorted(a_df.columns)
 
     # move the internal columns to the end of the list of cols to output
-    col_names = list(working_df)
     for curr_internal_col_name in internal_col_names:
         col_names.pop(col_names.index(curr_internal_col_name))
         col_names.append(curr_internal_col_name)
 
     # move sample name to the first column
     col_names.insert(0, col_names.pop(col_names.index(SAMPLE_NAME_KEY)))
-    output_df = working_df.loc[:, col_names].copy()
+    output_df = a_df.reindex(columns=col_names)
     return output_df
+
+
+def _get_polars_backend():
+    """Import the polars extension backend, which requires polars.
+
+    Returns
+    -------
+    module
+        The qiimp.src.metadata_extender_polars module.
+
+    Raises
+    ------
+    ImportError
+        If polars is not installed.
+    """
+    try:
+        import qiimp.src.metadata_extender_polars as polars_backend
+    except ImportError as e:
+        raise ImportError(
+            "The polars extension backend requires polars to be "
+            "installed") from e
+    return polars_backend
@@ -0,0 +1,986 @@
+import logging
+import numbers
+import numpy as np
+import pandas
+import polars as pl
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from qiimp.src.util import update_metadata_df_field, \
+    update_metadata_df_fields, HOSTTYPE_SHORTHAND_KEY, \
+    SAMPLETYPE_SHORTHAND_KEY, QC_NOTE_KEY, SAMPLE_NAME_KEY, DEFAULT_KEY, \
+    LEAVE_BLANK_VAL, LEAVE_REQUIREDS_BLANK_KEY, OVERWRITE_NON_NANS_KEY, \
+    METADATA_TRANSFORMERS_KEY, PRE_TRANSFORMERS_KEY, SOURCES_KEY, \
+    FUNCTION_KEY, StageTimer
+from qiimp.src.metadata_configurator import ResolvedSchemaIndex
+from qiimp.src.metadata_validator import validate_metadata_df, \
+    CERBERUS_ENGINE
+from qiimp.src.metadata_extender import REQ_PLACEHOLDER, \
+    INVALID_HOST_TYPE_QC_NOTE, INVALID_SAMPLE_TYPE_QC_NOTE, \
+    INITIALIZE_STAGE, PRE_TRANSFORM_STAGE, GENERATE_GROUP_STAGE, \
+    VALIDATE_GROUP_STAGE, COMBINE_GROUPS_STAGE, \
+    _get_host_and_sample_type_groups, _combine_host_type_groups, \
+    _get_metadata_fields_fill_vals, _get_transformer_func
+import qiimp.src.metadata_transformers as transformers
+
+# kinds of column carried in polars: the ones whose values and pandas dtype
+# survive the round trip exactly. All other columns are carried in pandas.
+_STRING_KIND = "string"
+_INT_KIND = "int"
+_FLOAT_KIND = "float"
+_BOOL_KIND = "bool"
+
+# operations on a column carried in pandas, applied in order
+_UPDATE_OP = "update"
+_REPLACE_PLACEHOLDER_OP = "replace_placeholder"
+_FILL_NA_OP = "fill_na"
+
+# Define a logger for this module
+logger = logging.getLogger(__name__)
+
+
+def _pass_through_value(x: Any, source_name: str) -> Any:
+    return x
+
+
+def _standardize_input_sex_value(x: Any, source_name: str) -> Any:
+    return transformers.standardize_input_sex(x)
+
+
+# built-in transformers whose result depends only on the value of their one
+# source field, mapped to a function of (value, source field name) giving
+# the same result
+_VALUE_TRANSFORMERS = {
+    transformers.pass_through: _pass_through_value,
+    transformers.transform_input_sex_to_std_sex: _standardize_input_sex_value,
+    transformers.transform_age_to_life_stage:
+        transformers.set_life_stage_from_age_yrs,
+    transformers.transform_date_to_formatted_date:
+        transformers.format_a_datetime
+}
+
+
+class SplitMetadataDf:
+    """Metadata whose columns are carried partly in polars and partly in pandas.
+
+    Columns holding only strings (and NaNs), or with a numpy integer, float
+    or bool dtype, are carried in polars; any other column is carried in
+    pandas, as is any column that an operation would give values of mixed
+    types (which polars cannot hold).  Converting back to pandas gives
+    exactly the values and dtypes the columns would have had in pandas.
+
+    Parameters
+    ----------
+    pl_df : polars.DataFrame
+        The columns carried in polars.
+    pd_df : pandas.DataFrame
+        The columns carried in pandas, with a default RangeIndex.
+    col_names : List[str]
+        Names of all the columns, in order.
+    col_kinds : Dict[str, str]
+        Kind of each column carried in polars.
+    num_rows : int
+        Number of rows in the metadata.
+    """
+
+    def __init__(self, pl_df: pl.DataFrame, pd_df: pandas.DataFrame,
+                 col_names: List[str], col_kinds: Dict[str, str],
+                 num_rows: int):
+        self.pl_df = pl_df
+        self.pd_df = pd_df
+        self.col_names = col_names
+        self.col_kinds = col_kinds
+        self.num_rows = num_rows
+
+    @classmethod
+    def from_pandas(cls, a_df: pandas.DataFrame) -> "SplitMetadataDf":
+        """Split a pandas DataFrame into columns carried in polars and in pandas.
+
+        Parameters
+        ----------
+        a_df : pandas.DataFrame
+            The DataFrame to split. Not modified.
+
+        Returns
+        -------
+        SplitMetadataDf
+            The split metadata.
+        """
+        pl_cols = []
+        col_kinds = {}
+        pd_col_names = []
+        # polars needs unique, string column names
+        has_dup_cols = a_df.columns.duplicated().any()
+        for curr_col_name in a_df.columns:
+            curr_kind = None
+            if isinstance(curr_col_name, str) and not has_dup_cols:
+                curr_kind = _get_polars_kind(a_df[curr_col_name])
+
+            if curr_kind is None:
+                pd_col_names.append(curr_col_name)
+            else:
+                pl_cols.append(_make_polars_col(
+                    a_df[curr_col_name], curr_kind))
+                col_kinds[curr_col_name] = curr_kind
+        # next column
+
+        return cls(pl.DataFrame(pl_cols),
+                   a_df[pd_col_names].reset_index(drop=True),
+                   list(a_df.columns), col_kinds, len(a_df))
+
+    def take(self, positions: np.ndarray) -> "SplitMetadataDf":
+        """Get the rows at the given positions.
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Positions of the rows to get.
+
+        Returns
+        -------
+        SplitMetadataDf
+            The rows at the given positions, in that order.
+        """
+        return SplitMetadataDf(
+            self.pl_df[positions],
+            self.pd_df.take(positions).reset_index(drop=True),
+            list(self.col_names), dict(self.col_kinds), len(positions))
+
+    def count_nulls(self, col_name: str) -> int:
+        """Count the missing values in a column.
+
+        Parameters
+        ----------
+        col_name : str
+            Name of the column.
+
+        Returns
+        -------
+        int
+            Number of missing values in the column.
+        """
+        if col_name in self.col_kinds:
+            return self.pl_df.get_column(col_name).null_count()
+        return int(self.pd_df[col_name].isna().sum())
+
+    def set_polars_col(self, col_name: str, col_expr: pl.Expr,
+                       col_kind: str) -> None:
+        """Set (or add) a column carried in polars.
+
+        Parameters
+        ----------
+        col_name : str
+            Name of the column.
+        col_expr : polars.Expr
+            Expression for the column's new values, over the columns
+            carried in polars.
+        col_kind : str
+            Kind of the column's new values.
+        """
+        self.pl_df = self.pl_df.with_columns(col_expr.alias(col_name))
+        self._add_col(col_name)
+        if col_name in self.pd_df.columns:
+            self.pd_df = self.pd_df.drop(columns=col_name)
+        self.col_kinds[col_name] = col_kind
+
+    def set_pandas_col(self, col_name: str, col: pandas.Series) -> None:
+        """Set (or add) a column carried in pandas.
+
+        Parameters
+        ----------
+        col_name : str
+            Name of the column.
+        col : pandas.Series
+            The column's new values, with a default RangeIndex.
+        """
+        self.pd_df[col_name] = col
+        self._add_col(col_name)
+        if col_name in self.col_kinds:
+            self.pl_df = self.pl_df.drop(col_name)
+            del self.col_kinds[col_name]
+
+    def to_pandas(self, col_names: Optional[List[str]] = None) -> \
+            pandas.DataFrame:
+        """Convert (some of) the columns to a pandas DataFrame.
+
+        Parameters
+        ----------
+        col_names : Optional[List[str]]
+            Names of the columns to convert. If None, all columns are
+            converted.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The columns, in order, with a default RangeIndex.
+        """
+        if col_names is None:
+            col_names = self.col_names
+
+        cols = {}
+        for curr_col_name in col_names:
+            if curr_col_name in self.col_kinds:
+                cols[curr_col_name] = _make_numpy_col(
+                    self.pl_df.get_column(curr_col_name),
+                    self.col_kinds[curr_col_name])
+            else:
+                cols[curr_col_name] = self.pd_df[curr_col_name]
+        # next column
+
+        # build from a list of columns rather than a dict so that any
+        # duplicate column names (which can only be carried in pandas)
+        # survive
+        output_df = pandas.concat(
+            [pandas.Series(cols[x], name=x) for x in col_names], axis=1) \
+            if col_names else pandas.DataFrame(index=range(self.num_rows))
+        output_df.index = pandas.RangeIndex(self.num_rows)
+        return output_df
+
+    def _add_col(self, col_name: str) -> None:
+        if col_name not in self.col_names:
+            self.col_names.append(col_name)
+
+
+def generate_metadata_with_polars(
+        metadata_df: pandas.DataFrame,
+        schema_index: ResolvedSchemaIndex,
+        transformer_funcs_dict: Optional[Dict[str, Any]],
+        validation_engine: str = CERBERUS_ENGINE,
+        max_errors: Optional[int] = None,
+        max_errors_per_field: Optional[int] = None,
+        timer: Optional[StageTimer] = None) -> \
+        Tuple[pandas.DataFrame, List[str]]:
+    """Add the QC note, pre-transform and extend each host type + sample type group using polars.
+
+    Does the same as the QC note initialization, _catch_nan_required_fields,
+    pre-transformation and _generate_metadata_for_host_types steps of
+    _populate_metadata_df, and gives the same result.  The constant-valued
+    column updates (QC notes, defaults, required placeholders and fills)
+    and the built-in single-source pre-transformers are run as polars
+    expressions, with each group's updates run as one lazy query; a
+    transformer is mapped over the unique values of its source rather than
+    applied row by row.  Anything polars cannot do exactly--study-specific
+    transformers, and updates that would mix value types in a column--is
+    done in pandas for just the columns concerned.  Validation, and the
+    combination of the groups, are done in pandas as for the pandas backend.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata DataFrame to process, which must contain at least
+        the columns in REQUIRED_RAW_METADATA_FIELDS. Not modified.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    transformer_funcs_dict : Optional[Dict[str, Any]]
+        Dictionary of study-specific transformer functions, keyed by name.
+    validation_engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES, to validate each group with.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation of
+        each group stops.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in each group.
+    timer : Optional[StageTimer], default=None
+        Timer for the same stages as the pandas backend times for these
+        steps.
+
+    Returns
+    -------
+    Tuple[pandas.DataFrame, List[str]]
+        A tuple containing:
+            - The processed DataFrame with specific metadata added to each sample of each host type
+            - A list of validation messages
+
+    Raises
+    ------
+    ValueError
+        If any sample names are NaN, or if a specified transformer function
+        cannot be found.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    with timer.time_stage(INITIALIZE_STAGE, len(metadata_df)):
+        split_df = SplitMetadataDf.from_pandas(metadata_df)
+
+        # Don't try to populate the QC_NOTE_KEY field, since it is an internal field
+        split_df.set_polars_col(
+            QC_NOTE_KEY, pl.lit(LEAVE_BLANK_VAL, dtype=pl.String),
+            _STRING_KIND)
+
+        # Error for NaNs in sample name, set NaNs in host- and sample-type-
+        # shorthand fields to "empty".
+        _catch_nan_required_fields(split_df)
+
+    # Apply pre-transformers to the metadata.
+    with timer.time_stage(PRE_TRANSFORM_STAGE, split_df.num_rows):
+        _transform_metadata(
+            split_df, schema_index.full_flat_config_dict, PRE_TRANSFORMERS_KEY,
+            transformer_funcs_dict)
+
+    groups = _get_host_and_sample_type_groups(
+        split_df.to_pandas([HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]),
+        schema_index)
+    group_results = []
+    for curr_host_type, curr_sample_type, curr_positions in groups:
+        group_results.append(_generate_metadata_for_a_group(
+            split_df.take(curr_positions), curr_host_type, curr_sample_type,
+            schema_index, validation_engine, max_errors,
+            max_errors_per_field, timer))
+    # next host type + sample type group
+
+    with timer.time_stage(COMBINE_GROUPS_STAGE, split_df.num_rows):
+        output_df, validation_msgs = _combine_host_type_groups(
+            group_results, schema_index.settings_dict)
+    return output_df, validation_msgs
+
+
+def transform_metadata_df_by_value(
+        metadata_df: pandas.DataFrame,
+        full_flat_config_dict: Dict[str, Any],
+        stage_key: str,
+        transformer_funcs_dict: Optional[Dict[str, Any]]) -> pandas.DataFrame:
+    """Apply a stage of transformers to a metadata DataFrame, mapping built-in ones over unique values.
+
+    Gives the same result as _transform_metadata in the metadata extender,
+    but each built-in single-source transformer is computed once per unique
+    value of its source field rather than once per row.  It works on pandas
+    rather than polars because, once the host type + sample type groups
+    have been combined, columns can hold values of mixed types.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata DataFrame to transform. Modified in place.
+    full_flat_config_dict : Dict[str, Any]
+        Fully combined flat-host-type config dictionary.
+    stage_key : str
+        Key indicating the transformation stage (pre or post).
+    transformer_funcs_dict : Optional[Dict[str, Any]]
+        Dictionary of study-specific transformer functions, keyed by name.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The transformed metadata DataFrame.
+
+    Raises
+    ------
+    ValueError
+        If a specified transformer function cannot be found.
+    """
+    overwrite_non_nans = full_flat_config_dict.get(OVERWRITE_NON_NANS_KEY, False)
+    for curr_target_field, curr_func, curr_source_fields in \
+            _get_stage_transformers(
+                full_flat_config_dict, stage_key, transformer_funcs_dict):
+        curr_value_func = _get_value_transformer(curr_func, curr_source_fields)
+        if curr_value_func is None:
+            update_metadata_df_field(
+                metadata_df, curr_target_field, curr_func,
+                curr_source_fields, overwrite_non_nans=overwrite_non_nans)
+            continue
+
+        # map each unique source value, in order of first appearance so
+        # that any error is for the same value as it would be row by row
+        curr_source_name = curr_source_fields[0]
+        curr_codes, curr_uniques = pandas.factorize(
+            metadata_df[curr_source_name], use_na_sentinel=False)
+        curr_mapped_vals = np.empty(len(curr_uniques), dtype=object)
+        curr_mapped_vals[:] = \
+            [curr_value_func(x, curr_source_name) for x in curr_uniques]
+        # build the result from a list, as apply does, so it gets the dtype
+        # that applying the transformer row by row would give it
+        curr_result = pandas.Series(
+            curr_mapped_vals[curr_codes].tolist(), index=metadata_df.index,
+            dtype=None if len(curr_codes) else object)
+
+        # set the result as update_metadata_df_field would
+        set_all = overwrite_non_nans or \
+            (curr_target_field not in metadata_df.columns)
+        row_mask = metadata_df.index if set_all else \
+            metadata_df[curr_target_field].isnull()
+        metadata_df.loc[row_mask, curr_target_field] = curr_result
+    # next stage transformer
+
+    return metadata_df
+
+
+def _catch_nan_required_fields(split_df: SplitMetadataDf) -> None:
+    """Error for NaNs in sample name, set NaNs in host- and sample-type- shorthand fields to "empty".
+
+    Parameters
+    ----------
+    split_df : SplitMetadataDf
+        The metadata to check. Modified in place.
+
+    Raises
+    ------
+    ValueError
+        If any sample names are NaN.
+    """
+    if split_df.count_nulls(SAMPLE_NAME_KEY):
+        raise ValueError("Metadata contains NaN sample names")
+
+    for curr_key in [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY]:
+        if not split_df.count_nulls(curr_key):
+            continue
+
+        if split_df.col_kinds.get(curr_key) == _STRING_KIND:
+            split_df.set_polars_col(
+                curr_key, pl.col(curr_key).fill_null("empty"), _STRING_KIND)
+        else:
+            curr_col = split_df.to_pandas([curr_key])[curr_key]
+            curr_col.loc[curr_col.isna()] = "empty"
+            split_df.set_pandas_col(curr_key, curr_col)
+        logging.warning(f"Metadata contains NaN {curr_key}s; "
+                        f"these have been set to 'empty'")
+    # next shorthand field
+
+
+def _transform_metadata(
+        split_df: SplitMetadataDf,
+        full_flat_config_dict: Dict[str, Any],
+        stage_key: str,
+        transformer_funcs_dict: Optional[Dict[str, Any]]) -> None:
+    """Apply a stage of transformers to split metadata.
+
+    Parameters
+    ----------
+    split_df : SplitMetadataDf
+        The metadata to transform. Modified in place.
+    full_flat_config_dict : Dict[str, Any]
+        Fully combined flat-host-type config dictionary.
+    stage_key : str
+        Key indicating the transformation stage (pre or post).
+    transformer_funcs_dict : Optional[Dict[str, Any]]
+        Dictionary of study-specific transformer functions, keyed by name.
+
+    Raises
+    ------
+    ValueError
+        If a specified transformer function cannot be found.
+    """
+    overwrite_non_nans = full_flat_config_dict.get(OVERWRITE_NON_NANS_KEY, False)
+    for curr_target_field, curr_func, curr_source_fields in \
+            _get_stage_transformers(
+                full_flat_config_dict, stage_key, transformer_funcs_dict):
+        curr_result = _get_polars_transformer_result(
+            split_df, curr_func, curr_source_fields)
+
+        set_all = overwrite_non_nans or \
+            curr_target_field not in split_df.col_names
+        curr_target_kind = split_df.col_kinds.get(curr_target_field)
+        if curr_result is not None:
+            curr_expr, curr_kind, curr_all_null = curr_result
+            if set_all:
+                if curr_target_field not in split_df.col_names:
+                    # a column of nothing but NaNs comes out of apply as float
+                    if curr_all_null:
+                        curr_expr = pl.lit(None, dtype=pl.Float64)
+                        curr_kind = _FLOAT_KIND
+                    split_df.set_polars_col(
+                        curr_target_field, curr_expr, curr_kind)
+                    continue
+                elif curr_target_kind == curr_kind and not curr_all_null:
+                    split_df.set_polars_col(
+                        curr_target_field, curr_expr, curr_kind)
+                    continue
+            elif curr_all_null:
+                # only NaNs would be written over NaNs
+                continue
+            elif curr_target_kind == curr_kind:
+                split_df.set_polars_col(
+                    curr_target_field,
+                    pl.when(pl.col(curr_target_field).is_null()).then(
+                        curr_expr).otherwise(pl.col(curr_target_field)),
+                    curr_kind)
+                continue
+        # endif the transformer can be run in polars
+
+        # otherwise, run it row by row in pandas, exactly as the pandas
+        # backend would, and carry the target field in pandas from now on
+        curr_metadata_df = split_df.to_pandas()
+        update_metadata_df_field(
+            curr_metadata_df, curr_target_field, curr_func,
+            curr_source_fields, overwrite_non_nans=overwrite_non_nans)
+        split_df.set_pandas_col(
+            curr_target_field, curr_metadata_df[curr_target_field])
+    # next stage transformer
+
+
+def _get_stage_transformers(
+        full_flat_config_dict: Dict[str, Any],
+        stage_key: str,
+        transformer_funcs_dict: Optional[Dict[str, Any]]) -> \
+        List[Tuple[str, Callable, List[str]]]:
+    """Get the transformers for a stage, in order.
+
+    Parameters
+    ----------
+    full_flat_config_dict : Dict[str, Any]
+        Fully combined flat-host-type config dictionary.
+    stage_key : str
+        Key indicating the transformation stage (pre or post).
+    transformer_funcs_dict : Optional[Dict[str, Any]]
+        Dictionary of study-specific transformer functions, keyed by name.
+
+    Returns
+    -------
+    List[Tuple[str, Callable, List[str]]]
+        The (target field, transformer function, source fields) of each
+        transformer in the stage.
+
+    Raises
+    ------
+    ValueError
+        If a specified transformer function cannot be found.
+    """
+    if transformer_funcs_dict is None:
+        transformer_funcs_dict = {}
+
+    stage_transformers = []
+    metadata_transformers = full_flat_config_dict.get(METADATA_TRANSFORMERS_KEY, None)
+    if metadata_transformers:
+        for curr_target_field, curr_transformer_dict in \
+                (metadata_transformers.get(stage_key, None) or {}).items():
+            stage_transformers.append((
+                curr_target_field,
+                _get_transformer_func(
+                    curr_transformer_dict[FUNCTION_KEY],
+                    transformer_funcs_dict),
+                curr_transformer_dict[SOURCES_KEY]))
+        # next stage transformer
+    # end if there are any metadata transformers
+
+    return stage_transformers
+
+
+def _get_value_transformer(
+        a_func: Callable, source_fields: List[str]) -> Optional[Callable]:
+    """Get the function of a single value that a transformer is equivalent to, if any.
+
+    Parameters
+    ----------
+    a_func : Callable
+        The transformer function, which takes a row and source field names.
+    source_fields : List[str]
+        The transformer's source field names.
+
+    Returns
+    -------
+    Optional[Callable]
+        A function of (source value, source field name) giving the
+        transformer's result, or None if the transformer is not a built-in
+        one with a single source field.
+    """
+    if len(source_fields) != 1:
+        return None
+    return _VALUE_TRANSFORMERS.get(a_func)
+
+
+def _get_polars_transformer_result(
+        split_df: SplitMetadataDf,
+        a_func: Callable,
+        source_fields: List[str]) -> Optional[Tuple[pl.Expr, str, bool]]:
+    """Get a polars expression for the result of a transformer, if possible.
+
+    Parameters
+    ----------
+    split_df : SplitMetadataDf
+        The metadata to transform.
+    a_func : Callable
+        The transformer function, which takes a row and source field names.
+    source_fields : List[str]
+        The transformer's source field names.
+
+    Returns
+    -------
+    Optional[Tuple[polars.Expr, str, bool]]
+        The expression for the result, the kind of the result and whether
+        the result is all nulls; or None if the transformer can't be run
+        in polars.
+    """
+    value_func = _get_value_transformer(a_func, source_fields)
+    source_name = source_fields[0] if value_func is not None else None
+    source_kind = split_df.col_kinds.get(source_name)
+    if source_kind is None:
+        return None
+
+    source_col = split_df.pl_df.get_column(source_name)
+    if value_func is _pass_through_value:
+        return pl.col(source_name), source_kind, \
+            source_col.null_count() == split_df.num_rows
+
+    # map each unique source value, in order of first appearance so that
+    # any error is for the same value as it would be row by row. The
+    # built-in transformers give back nulls unchanged and strings otherwise.
+    uniques = source_col.drop_nulls().unique(maintain_order=True)
+    mapped_vals = [value_func(x, source_name) for x in uniques.to_list()]
+    if not all(isinstance(x, str) for x in mapped_vals):
+        return None
+    if not mapped_vals:
+        return pl.lit(None, dtype=pl.String), _STRING_KIND, True
+
+    result_expr = pl.col(source_name).replace_strict(
+        uniques, pl.Series(mapped_vals, dtype=pl.String), default=None,
+        return_dtype=pl.String)
+    return result_expr, _STRING_KIND, source_col.null_count() == \
+        split_df.num_rows
+
+
+def _generate_metadata_for_a_group(
+        group_df: SplitMetadataDf,
+        a_host_type: str,
+        a_sample_type: Optional[str],
+        schema_index: ResolvedSchemaIndex,
+        validation_engine: str,
+        max_errors: Optional[int],
+        max_errors_per_field: Optional[int],
+        timer: StageTimer) -> \
+        Tuple[pandas.DataFrame, List[str]]:
+    """Generate metadata df for one host type + sample type group.
+
+    Parameters
+    ----------
+    group_df : SplitMetadataDf
+        The metadata samples for the group. Modified in place.
+    a_host_type : str
+        The host type being processed.
+    a_sample_type : Optional[str]
+        The sample type being processed, or None if the host type is not
+        in the config.
+    schema_index : ResolvedSchemaIndex
+        Schema index over the fully combined flat-host-type config dictionary.
+    validation_engine : str
+        One of VALIDATION_ENGINES, to validate the group with.
+    max_errors : Optional[int]
+        If given, the number of validation errors after which validation of
+        the group stops.
+    max_errors_per_field : Optional[int]
+        If given, the number of validation errors in a field after which
+        that field is no longer validated in the group.
+    timer : StageTimer
+        Timer for the group's generation and validation stages.
+
+    Returns
+    -------
+    Tuple[pandas.DataFrame, List[str]]
+        A tuple containing:
+            - The updated metadata DataFrame for the group
+            - A list of validation messages
+    """
+    with timer.time_stage(
+            GENERATE_GROUP_STAGE, group_df.num_rows, host_type=a_host_type,
+            sample_type=a_sample_type):
+        sample_type_df, fields_dict = _generate_group_metadata(
+            group_df, a_host_type, a_sample_type, schema_index)
+    if fields_dict is None:
+        return sample_type_df, []
+
+    # validate the metadata df based on the specific requirements
+    # for this host+sample type
+    with timer.time_stage(
+            VALIDATE_GROUP_STAGE, len(sample_type_df), host_type=a_host_type,
+            sample_type=a_sample_type):
+        validation_msgs = validate_metadata_df(
+            sample_type_df, fields_dict, engine=validation_engine,
+            max_errors=max_errors, max_errors_per_field=max_errors_per_field)
+    return sample_type_df, validation_msgs
+
+
+def _generate_group_metadata(
+        group_df: SplitMetadataDf,
+        a_host_type: str,
+        a_sample_type: Optional[str],
+        schema_index: ResolvedSchemaIndex) -> \
+        Tuple[pandas.DataFrame, Optional[Dict[str, Any]]]:
+    """Update the metadata of one host type + sample type group, without validating it.
+
+    Parameters are as for _generate_metadata_for_a_group.
+
+    Returns
+    -------
+    Tuple[pandas.DataFrame, Optional[Dict[str, Any]]]
+        A tuple containing:
+            - The updated metadata DataFrame for the group
+            - The metadata fields dictionary to validate the group against,
+              or None if the host type or sample type is invalid
+    """
+    if a_sample_type is None:
+        group_df.set_polars_col(
+            QC_NOTE_KEY, pl.lit(INVALID_HOST_TYPE_QC_NOTE, dtype=pl.String),
+            _STRING_KIND)
+        return group_df.to_pandas(), None
+
+    if not schema_index.has_sample_type(a_host_type, a_sample_type):
+        group_df.set_polars_col(
+            QC_NOTE_KEY, pl.lit(INVALID_SAMPLE_TYPE_QC_NOTE, dtype=pl.String),
+            _STRING_KIND)
+        return group_df.to_pandas(), None
+
+    global_plus_host_settings_dict = \
+        schema_index.get_host_type_settings_dict(a_host_type)
+    full_sample_type_metadata_fields_dict = schema_index.get_sample_type_schema(
+        a_host_type, a_sample_type).metadata_fields_dict
+    overwrite_non_nans = \
+        global_plus_host_settings_dict[OVERWRITE_NON_NANS_KEY]
+    leave_reqs_blank = global_plus_host_settings_dict[LEAVE_REQUIREDS_BLANK_KEY]
+    reqs_val = LEAVE_BLANK_VAL if leave_reqs_blank else np.nan
+    default_val = full_sample_type_metadata_fields_dict.get(
+        DEFAULT_KEY, global_plus_host_settings_dict[DEFAULT_KEY])
+
+    plan = _GroupPlan(group_df)
+
+    # update the metadata with the sample type specific metadata fields
+    fill_vals_dict = _get_metadata_fields_fill_vals(
+        full_sample_type_metadata_fields_dict, group_df.col_names)
+    for curr_field_name, curr_val in fill_vals_dict.items():
+        plan.update_field(curr_field_name, curr_val, overwrite_non_nans)
+
+    # for fields that are required but not yet filled, either leave blank
+    # or fill with NA (later replaced with default) based on config setting
+    plan.replace_placeholder(reqs_val)
+
+    # fill NAs with default value if any is set
+    if default_val:
+        plan.fill_na(default_val)
+
+    return plan.run(), full_sample_type_metadata_fields_dict
+
+
+class _GroupPlan:
+    """The updates to make to one host type + sample type group, split between polars and pandas.
+
+    Parameters
+    ----------
+    group_df : SplitMetadataDf
+        The metadata samples for the group.
+    """
+
+    def __init__(self, group_df: SplitMetadataDf):
+        self.group_df = group_df
+        self.col_names = list(group_df.col_names)
+        self.col_kinds = dict(group_df.col_kinds)
+        # expression for each changed or added polars column
+        self.col_exprs = {}
+        # whether each polars column may hold nulls
+        self.col_has_nulls = {
+            curr_name: curr_count > 0 for curr_name, curr_count in
+            group_df.pl_df.null_count().row(0, named=True).items()}
+        # operations still to apply to each column carried in pandas
+        self.pandas_ops = {x: [] for x in group_df.pd_df.columns}
+
+    def update_field(self, field_name: str, field_val: Any,
+                     overwrite_non_nans: bool) -> None:
+        """Plan the equivalent of update_metadata_df_field with a constant value."""
+        if field_name not in self.col_names:
+            self.col_names.append(field_name)
+            # new fields get the dtype update_metadata_df_fields gives them
+            if isinstance(field_val, str):
+                self._set_expr(field_name, pl.lit(field_val, dtype=pl.String),
+                               _STRING_KIND, False)
+            elif _is_real_number(field_val):
+                self._set_expr(
+                    field_name, pl.lit(float(field_val), dtype=pl.Float64),
+                    _FLOAT_KIND, False)
+            else:
+                self.pandas_ops[field_name] = \
+                    [(_UPDATE_OP, field_val, overwrite_non_nans)]
+            return
+
+        if field_name not in self.pandas_ops:
+            field_kind = self.col_kinds[field_name]
+            val_kind = _get_val_kind(field_val)
+            if overwrite_non_nans:
+                # pandas sets all values in place, upcasting an int column
+                # to float for a float value
+                if val_kind == field_kind or \
+                        (field_kind == _INT_KIND and val_kind == _FLOAT_KIND):
+                    self._set_expr(
+                        field_name, _make_lit(field_val, val_kind),
+                        val_kind, False)
+                    return
+                if field_kind == _FLOAT_KIND and val_kind == _INT_KIND:
+                    self._set_expr(
+                        field_name, _make_lit(float(field_val), _FLOAT_KIND),
+                        _FLOAT_KIND, False)
+                    return
+            elif val_kind == field_kind or \
+                    (field_kind == _FLOAT_KIND and val_kind == _INT_KIND):
+                # int and bool columns never hold nulls, so this only
+                # changes string and float columns
+                self._fill_null(field_name, field_val)
+                return
+        # endif the field is carried in polars
+
+        self._add_pandas_op(
+            field_name, (_UPDATE_OP, field_val, overwrite_non_nans))
+
+    def replace_placeholder(self, reqs_val: Any) -> None:
+        """Plan replacing REQ_PLACEHOLDER with reqs_val throughout."""
+        for curr_col_name in self.col_names:
+            if curr_col_name in self.pandas_ops:
+                self.pandas_ops[curr_col_name].append(
+                    (_REPLACE_PLACEHOLDER_OP, reqs_val))
+            elif self.col_kinds[curr_col_name] == _STRING_KIND:
+                # only string columns can hold the placeholder
+                is_nan = isinstance(reqs_val, float) and np.isnan(reqs_val)
+                curr_expr = self._get_expr(curr_col_name)
+                self._set_expr(
+                    curr_col_name,
+                    pl.when(curr_expr == REQ_PLACEHOLDER).then(pl.lit(
+                        None if is_nan else reqs_val, dtype=pl.String)).
+                    otherwise(curr_expr),
+                    _STRING_KIND,
+                    self.col_has_nulls[curr_col_name] or is_nan)
+        # next column
+
+    def fill_na(self, fill_val: Any) -> None:
+        """Plan the equivalent of DataFrame.fillna(fill_val)."""
+        val_kind = _get_val_kind(fill_val)
+        for curr_col_name in self.col_names:
+            if curr_col_name in self.pandas_ops:
+                self.pandas_ops[curr_col_name].append((_FILL_NA_OP, fill_val))
+                continue
+
+            col_kind = self.col_kinds[curr_col_name]
+            if not self.col_has_nulls[curr_col_name]:
+                continue
+            elif val_kind == col_kind or \
+                    (col_kind == _FLOAT_KIND and val_kind == _INT_KIND):
+                self._fill_null(curr_col_name, fill_val)
+            else:
+                self._add_pandas_op(curr_col_name, (_FILL_NA_OP, fill_val))
+        # next column
+
+    def run(self) -> pandas.DataFrame:
+        """Run the plan.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The updated metadata for the group, with a default RangeIndex.
+        """
+        group_df = self.group_df
+        pl_df = group_df.pl_df.lazy().with_columns(
+            [x.alias(n) for n, x in self.col_exprs.items()]).collect()
+        output_split_df = SplitMetadataDf(
+            pl_df, group_df.pd_df,
+            [x for x in self.col_names if x in pl_df.columns or
+             x in group_df.pd_df.columns],
+            self.col_kinds, group_df.num_rows)
+        output_df = output_split_df.to_pandas()
+
+        for curr_col_name, curr_ops in self.pandas_ops.items():
+            for curr_op in curr_ops:
+                if curr_op[0] == _UPDATE_OP:
+                    output_df = update_metadata_df_fields(
+                        output_df, {curr_col_name: curr_op[1]},
+                        overwrite_non_nans=curr_op[2], copy=False)
+                elif curr_op[0] == _REPLACE_PLACEHOLDER_OP:
+                    output_df[curr_col_name] = output_df[curr_col_name].replace(
+                        to_replace=REQ_PLACEHOLDER, value=curr_op[1])
+                else:
+                    output_df[curr_col_name] = \
+                        output_df[curr_col_name].fillna(curr_op[1])
+            # next operation
+        # next pandas column
+
+        return output_df.reindex(columns=self.col_names)
+
+    def _get_expr(self, col_name: str) -> pl.Expr:
+        return self.col_exprs.get(col_name, pl.col(col_name))
+
+    def _set_expr(self, col_name: str, col_expr: pl.Expr, col_kind: str,
+                  has_nulls: bool) -> None:
+        self.col_exprs[col_name] = col_expr
+        self.col_kinds[col_name] = col_kind
+        self.col_has_nulls[col_name] = has_nulls
+
+    def _fill_null(self, col_name: str, fill_val: Any) -> None:
+        col_kind = self.col_kinds[col_name]
+        if not self.col_has_nulls[col_name]:
+            return
+        if col_kind == _FLOAT_KIND:
+            fill_val = float(fill_val)
+        self._set_expr(
+            col_name, self._get_expr(col_name).fill_null(
+                _make_lit(fill_val, col_kind)), col_kind, False)
+
+    def _add_pandas_op(self, col_name: str, an_op: tuple) -> None:
+        # from now on the column is updated in pandas, starting from
+        # whatever the polars expressions planned so far give
+        self.pandas_ops[col_name] = [an_op]
+
+
+def _get_polars_kind(a_col: pandas.Series) -> Optional[str]:
+    """Get the kind of polars column that can carry a pandas column exactly, if any.
+
+    Parameters
+    ----------
+    a_col : pandas.Series
+        The column.
+
+    Returns
+    -------
+    Optional[str]
+        The column's kind, or None if it can't be carried in polars.
+    """
+    a_dtype = a_col.dtype
+    if not isinstance(a_dtype, np.dtype):
+        return None
+    if a_dtype.kind == "b":
+        return _BOOL_KIND
+    if a_dtype.kind in "iu":
+        return _INT_KIND
+    if a_dtype.kind == "f":
+        return _FLOAT_KIND
+    if a_dtype.kind == "O" and \
+            pandas.api.types.infer_dtype(a_col, skipna=True) == "string":
+        # the missing values must be NaNs, which is what they come back as
+        na_vals = a_col.values[pandas.isna(a_col.values)]
+        if all(isinstance(x, float) for x in na_vals):
+            return _STRING_KIND
+    return None
+
+
+def _get_val_kind(a_val: Any) -> Optional[str]:
+    if isinstance(a_val, str):
+        return _STRING_KIND
+    if isinstance(a_val, (bool, np.bool_)):
+        return _BOOL_KIND
+    if isinstance(a_val, numbers.Integral):
+        return _INT_KIND
+    if isinstance(a_val, numbers.Real):
+        return _FLOAT_KIND
+    return None
+
+
+def _is_real_number(a_val: Any) -> bool:
+    return _get_val_kind(a_val) in (_INT_KIND, _FLOAT_KIND)
+
+
+def _make_lit(a_val: Any, a_kind: str) -> pl.Expr:
+    kind_dtypes = {_STRING_KIND: pl.String, _INT_KIND: pl.Int64,
+                   _FLOAT_KIND: pl.Float64, _BOOL_KIND: pl.Boolean}
+    return pl.lit(a_val, dtype=kind_dtypes[a_kind])
+
+
+def _make_polars_col(a_col: pandas.Series, a_kind: str) -> pl.Series:
+    if a_kind == _STRING_KIND:
+        # polars can't build a string column from an object array starting
+        # with missing values, so build it without them and add them after
+        col_vals = a_col.to_numpy(dtype=object, copy=True)
+        na_mask = pandas.isna(col_vals)
+        col_vals[na_mask] = ""
+        return pl.Series(a_col.name, col_vals, dtype=pl.String).scatter(
+            np.flatnonzero(na_mask), None)
+    return pl.Series(a_col.name, a_col.to_numpy(), nan_to_null=True)
+
+
+def _make_numpy_col(a_col: pl.Series, a_kind: str) -> np.ndarray:
+    col_vals = a_col.to_numpy()
+    if a_kind == _STRING_KIND:
+        # missing strings come back as None; pandas has them as NaN
+        col_vals = np.array(col_vals, dtype=object)
+        col_vals[a_col.is_null().to_numpy()] = np.nan
+    return col_vals
@@ -1,38 +1,239 @@
 import cerberus
+from cerberus import errors as cerberus_errors
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import copy
 from datetime import datetime
 from dateutil import parser
 import logging
+import math
+import numpy as np
 import os
+import pandas
 from pathlib import Path
-from qiimp.src.util import SAMPLE_NAME_KEY, get_extension
+from typing import Any, Dict, List, Optional
+from qiimp.src.util import SAMPLE_NAME_KEY, get_extension, fingerprint_obj
 
 _TYPE_KEY = "type"
 _ANYOF_KEY = "anyof"
+_ALLOWED_KEY = "allowed"
+_CHECK_WITH_KEY = "check_with"
+_DEFAULT_KEY = "default"
+_EMPTY_KEY = "empty"
+_MAX_KEY = "max"
+_MIN_KEY = "min"
+_REGEX_KEY = "regex"
+_REQUIRED_KEY = "required"
+
+# ways of checking the typed metadata against the schema; both give the same
+# validation messages
+CERBERUS_ENGINE = "cerberus"
+VECTORIZED_ENGINE = "vectorized"
+VALIDATION_ENGINES = [CERBERUS_ENGINE, VECTORIZED_ENGINE]
+
+# rules the vectorized engine can check; schemas using any other rule are
+# checked with cerberus
+_VECTORIZED_ANYOF_RULES = [_TYPE_KEY, _ALLOWED_KEY, _CHECK_WITH_KEY,
+                           _DEFAULT_KEY, _EMPTY_KEY, _MAX_KEY, _MIN_KEY,
+                           _REGEX_KEY, _REQUIRED_KEY]
+_VECTORIZED_RULES = _VECTORIZED_ANYOF_RULES + [_ANYOF_KEY]
+# types of (typed) values the vectorized engine can check
+_VECTORIZED_VALUE_TYPES = [str, int, float, bool]
+# gives the (object) array of the types of an (object) array of values
+_TYPE_UFUNC = np.frompyfunc(type, 1, 1)
+
+# rules that make a field's validity depend on more than its own value
+_CROSS_FIELD_RULES = ["dependencies", "excludes", "default_setter"]
+
+# maximum number of compiled schemas to keep in memory
+MAX_CACHED_SCHEMAS = 64
+_COMPILED_SCHEMA_CACHE = OrderedDict()
+
+# key of the ValueChecker in a QiimpValidator's config
+_VALUE_CHECKER_KEY = "value_checker"
+
+# number of rows validated at a time when validating within an error budget,
+# so that validation stops soon after the budget is used up
+ERROR_BUDGET_CHUNK_SIZE = 1000
+# error messages recorded in place of the first error over an error budget
+FIELD_ERRORS_TRUNCATED_MSG = \
+    "more than {0} validation errors in this field; validation of this " \
+    "field stopped here"
+RUN_ERRORS_TRUNCATED_MSG = \
+    "more than {0} validation errors; validation stopped here"
+
+# the compiled schema and value checker of a validation worker process, set
+# by _init_validation_worker
+_WORKER_COMPILED_SCHEMA = None
+_WORKER_VALUE_CHECKER = None
 
 # Define a logger for this module
 logger = logging.getLogger(__name__)
 
 
 class QiimpValidator(cerberus.Validator):
+    @property
+    def value_checker(self):
+        """The ValueChecker for this validator's custom check_with rules.
+
+        It is kept in the validator's config so that child validators (such
+        as those for anyof rules) share it. If none is set, each check gets
+        its own.
+        """
+        return self._config.get(_VALUE_CHECKER_KEY)
+
+    @value_checker.setter
+    def value_checker(self, value_checker):
+        self._config[_VALUE_CHECKER_KEY] = value_checker
+
     def _check_with_date_not_in_future(self, field, value):
-        # convert the field string to a date
+        value_checker = self.value_checker
+        if value_checker is None:
+            value_checker = ValueChecker()
+        error_msg = value_checker.check("date_not_in_future", value)
+        if error_msg is not None:
+            self._error(field, error_msg)
+
+
+class ValueChecker:
+    """Runs the custom check_with rules for one validation run.
+
+    The current time is captured once, when the checker is made, and each
+    check is run only once per distinct value; later checks of the same
+    value reuse the memoized result.
+
+    Parameters
+    ----------
+    now : Optional[datetime], default=None
+        The time to check dates against; if None, the current time.
+    """
+
+    def __init__(self, now: Optional[datetime] = None):
+        self.now = datetime.now() if now is None else now
+        self._memo = {}
+
+    def check(self, check_name: str, value: Any) -> Optional[str]:
+        """Run a custom check_with rule on a value.
+
+        Parameters
+        ----------
+        check_name : str
+            The name of the check, which must be in _VALUE_CHECKS.
+        value : Any
+            The value to check.
+
+        Returns
+        -------
+        Optional[str]
+            The error message for the value, or None if it passes.
+        """
+        # values of different types, and 0.0 and -0.0, are kept apart
+        memo_key = (check_name, type(value),
+                    value.hex() if isinstance(value, float) else value)
         try:
-            putative_date = parser.parse(value, fuzzy=True, dayfirst=False)
-        except Exception:  # noqa: E722
-            self._error(field, "Must be a valid date")
-            return
+            return self._memo[memo_key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable values are checked every time
+            return _VALUE_CHECKS[check_name](value, self.now)
+
+        error_msg = _VALUE_CHECKS[check_name](value, self.now)
+        self._memo[memo_key] = error_msg
+        return error_msg
+
+
+def _check_date_not_in_future(value, now):
+    # convert the field string to a date
+    try:
+        putative_date = parser.parse(value, fuzzy=True, dayfirst=False)
+    except Exception:  # noqa: E722
+        return "Must be a valid date"
+
+    if putative_date > now:
+        return "Date cannot be in the future"
+    return None
+
+
+# the custom check_with rules of QiimpValidator, as functions taking a value
+# and the current time and returning an error message (or None if the value
+# passes)
+_VALUE_CHECKS = {"date_not_in_future": _check_date_not_in_future}
+
+
+def validate_metadata_df(metadata_df, sample_type_full_metadata_fields_dict,
+                         engine=CERBERUS_ENGINE, n_jobs=1, max_errors=None,
+                         max_errors_per_field=None, keep_uncastable=False):
+    """Validate metadata against the schema for its sample type.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata to validate; it is not modified.
+    sample_type_full_metadata_fields_dict : Dict[str, Any]
+        The metadata fields dictionary of the sample type, holding a
+        cerberus-style definition for each field.
+    engine : str, default=CERBERUS_ENGINE
+        One of VALIDATION_ENGINES. The cerberus engine validates the
+        metadata a row at a time; the vectorized engine checks a column at a
+        time and falls back to cerberus for schemas using rules it does not
+        support. Both give the same validation messages.
+    n_jobs : int, default=1
+        Number of worker processes to spread the validation over, each
+        taking a contiguous chunk of rows; 1 validates all rows in this
+        process, and a value less than 1 uses all available cores. The
+        messages are the same either way.
+    max_errors : Optional[int], default=None
+        If given, the number of validation errors after which validation
+        stops altogether; the first error over the budget is replaced by a
+        record with RUN_ERRORS_TRUNCATED_MSG.
+    max_errors_per_field : Optional[int], default=None
+        If given, the number of validation errors in a field after which
+        that field is no longer validated; the field's first error over the
+        budget is replaced by a record with FIELD_ERRORS_TRUNCATED_MSG.
+    keep_uncastable : bool, default=False
+        Whether to leave values that cannot be cast to any of their field's
+        allowed types as they are, so they fail validation with a type error,
+        rather than raising.
 
-        if putative_date > datetime.now():
-            self._error(field, "Date cannot be in the future")
+    Returns
+    -------
+    List[Dict[str, Any]]
+        A record (with SAMPLE_NAME_KEY, "field_name" and "error_message")
+        for each field that fails validation in each sample, in row order.
 
+    Raises
+    ------
+    ValueError
+        If engine is not recognized, if max_errors or max_errors_per_field
+        is negative, if either is given along with n_jobs other than 1, or
+        if a value cannot be cast to any of its field's allowed types and
+        keep_uncastable is False.
+    """
+    if engine not in VALIDATION_ENGINES:
+        raise ValueError(f"Unrecognized validation engine '{engine}'; "
+                         f"must be one of {VALIDATION_ENGINES}")
+    is_budgeted = max_errors is not None or max_errors_per_field is not None
+    for curr_name, curr_budget in [("max_errors", max_errors),
+                                   ("max_errors_per_field",
+                                    max_errors_per_field)]:
+        if curr_budget is not None and curr_budget < 0:
+            raise ValueError(f"{curr_name} must not be negative")
+    # next error budget
+    if is_budgeted and n_jobs != 1:
+        raise ValueError("Error budgets are not supported with n_jobs other "
+                         "than 1")
 
-def validate_metadata_df(metadata_df, sample_type_full_metadata_fields_dict):
-    config = _make_cerberus_schema(sample_type_full_metadata_fields_dict)
+    compiled_schema = _get_compiled_schema(
+        sample_type_full_metadata_fields_dict)
+    # checks of the same value give the same result throughout the run
+    value_checker = ValueChecker()
 
     # NB: typed_metadata_df (the type-cast version of metadata_df) is only
     # used for generating validation messages, after which it is discarded.
-    typed_metadata_df = metadata_df.copy()
+    # Each cast column is replaced wholesale rather than written into, so a
+    # shallow copy is enough to leave metadata_df untouched.
+    typed_metadata_df = metadata_df.copy(deep=False)
     for curr_field, curr_definition in \
             sample_type_full_metadata_fields_dict.items():
 
@@ -43,14 +244,87 @@ def validate_metadata_df(metadata_df, sample_type_full_metadata_fields_dict):
 
         curr_allowed_types = _get_allowed_pandas_types(
             curr_field, curr_definition)
-        typed_metadata_df[curr_field] = typed_metadata_df[curr_field].apply(
-            lambda x: _cast_field_to_type(x, curr_allowed_types))
+        typed_metadata_df[curr_field] = _cast_col_to_types(
+            typed_metadata_df[curr_field], curr_allowed_types,
+            keep_uncastable)
     # next field in config
 
-    validation_msgs = _generate_validation_msg(typed_metadata_df, config)
+    if is_budgeted:
+        return _generate_validation_msg_within_budget(
+            typed_metadata_df, sample_type_full_metadata_fields_dict, engine,
+            value_checker, max_errors, max_errors_per_field)
+
+    if n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    n_workers = min(n_jobs, len(typed_metadata_df))
+    if n_workers <= 1:
+        return _validate_typed_metadata_df(
+            typed_metadata_df, compiled_schema, engine, value_checker)
+
+    # each worker compiles the schema once and validates one chunk of rows;
+    # all check dates against the same time
+    chunk_bounds = np.linspace(
+        0, len(typed_metadata_df), n_workers + 1).astype(int)
+    with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_validation_worker,
+            initargs=(sample_type_full_metadata_fields_dict,
+                      value_checker.now)) as executor:
+        # map returns results in the order of its inputs
+        chunk_results = executor.map(
+            _validate_chunk_in_worker,
+            [typed_metadata_df.iloc[start:stop] for start, stop
+             in zip(chunk_bounds[:-1], chunk_bounds[1:])],
+            [engine] * n_workers)
+        validation_msgs = []
+        for curr_chunk_msgs in chunk_results:
+            validation_msgs.extend(curr_chunk_msgs)
+        # next chunk
+    # end using executor
     return validation_msgs
 
 
+def convert_numeric_text(metadata_df, sample_type_full_metadata_fields_dict):
+    """Read the text values of non-string fields as numbers where they are numbers.
+
+    Metadata read from a file entirely as text (e.g., with dtype=str) has no
+    numbers in it; this gives each field that is not first allowed to be a
+    string the numbers pandas would have inferred for it, so that, e.g.,
+    "408170.0" in an integer field validates as it did before it was
+    written out. Text that is not a finite number is left as it is.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        The metadata, holding text values; it is not modified.
+    sample_type_full_metadata_fields_dict : Dict[str, Any]
+        The metadata fields dictionary of the sample type.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A (shallow) copy of the metadata with the numeric text of each
+        non-string field replaced by floats.
+    """
+    converted_df = metadata_df.copy(deep=False)
+    for curr_field, curr_definition in \
+            sample_type_full_metadata_fields_dict.items():
+        if curr_field not in converted_df.columns or \
+                _get_allowed_pandas_types(
+                    curr_field, curr_definition)[0] is str:
+            continue
+
+        # parse each distinct value only once
+        value_codes, distinct_values = pandas.factorize(
+            converted_df[curr_field], use_na_sentinel=False)
+        parsed_values = np.empty(len(distinct_values), dtype=object)
+        parsed_values[:] = [_parse_number(x) for x in distinct_values]
+        converted_df[curr_field] = pandas.Series(
+            parsed_values[value_codes], index=converted_df.index,
+            name=curr_field)
+    # next field in config
+    return converted_df
+
+
 def output_validation_msgs(validation_msgs_df, out_dir, out_base, sep="\t",
                            suppress_empty_fails=False):
     timestamp_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
@@ -66,6 +340,284 @@ def output_validation_msgs(validation_msgs_df, out_dir, out_base, sep="\t",
         validation_msgs_df.to_csv(out_fp, sep=sep, index=False)
 
 
+def _validate_typed_metadata_df(typed_metadata_df, compiled_schema, engine,
+                                value_checker):
+    """Generate validation messages for typed metadata with the given engine.
+
+    Parameters
+    ----------
+    typed_metadata_df : pandas.DataFrame
+        The metadata to validate, with each field in the schema cast to one
+        of its allowed types.
+    compiled_schema : _CompiledSchema
+        The compiled schema to validate against.
+    engine : str
+        One of VALIDATION_ENGINES.
+    value_checker : ValueChecker
+        The checker to run custom check_with rules with.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The validation messages, in row order.
+    """
+    validation_msgs = None
+    if engine == VECTORIZED_ENGINE:
+        validation_msgs = _generate_validation_msg_by_column(
+            typed_metadata_df, compiled_schema.config, value_checker)
+        if validation_msgs is None:
+            logger.info("Schema or values not supported by the vectorized "
+                        "validation engine; validating with cerberus")
+    if validation_msgs is None:
+        validation_msgs = _generate_validation_msg(
+            typed_metadata_df, compiled_schema, value_checker)
+    return validation_msgs
+
+
+def _generate_validation_msg_within_budget(
+        typed_metadata_df, fields_dict, engine, value_checker, max_errors,
+        max_errors_per_field):
+    """Generate validation messages until the error budgets are used up.
+
+    The rows are validated ERROR_BUDGET_CHUNK_SIZE at a time. Once a field
+    has used up max_errors_per_field, it is dropped from the schema for the
+    remaining rows; once the run has used up max_errors, no more rows are
+    validated. The first error over either budget is replaced by a record
+    saying that validation stopped there.
+
+    Parameters
+    ----------
+    typed_metadata_df : pandas.DataFrame
+        The metadata to validate, with each field in the schema cast to one
+        of its allowed types.
+    fields_dict : Dict[str, Any]
+        The metadata fields dictionary of the sample type.
+    engine : str
+        One of VALIDATION_ENGINES.
+    value_checker : ValueChecker
+        The checker to run custom check_with rules with.
+    max_errors : Optional[int]
+        The number of errors after which validation stops, or None for no
+        limit.
+    max_errors_per_field : Optional[int]
+        The number of errors in a field after which the field is no longer
+        validated, or None for no limit.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The validation messages within the budgets, plus any truncation
+        records, in row order.
+    """
+    validation_msgs = []
+    num_errors = 0
+    field_error_counts = defaultdict(int)
+    truncated_fields = set()
+    compiled_schema = _get_compiled_schema(fields_dict)
+    for chunk_start in range(
+            0, len(typed_metadata_df), ERROR_BUDGET_CHUNK_SIZE):
+        chunk_df = typed_metadata_df.iloc[
+            chunk_start:chunk_start + ERROR_BUDGET_CHUNK_SIZE]
+        chunk_msgs = _validate_typed_metadata_df(
+            chunk_df, compiled_schema, engine, value_checker)
+
+        num_truncated_fields = len(truncated_fields)
+        for curr_msg in chunk_msgs:
+            curr_field = curr_msg["field_name"]
+            if curr_field in truncated_fields:
+                # truncated earlier in this chunk
+                continue
+
+            if max_errors is not None and num_errors >= max_errors:
+                logger.warning(f"Stopped validation after {max_errors} "
+                               f"errors")
+                validation_msgs.append(_make_truncation_msg(
+                    curr_msg, RUN_ERRORS_TRUNCATED_MSG.format(max_errors)))
+                return validation_msgs
+
+            if max_errors_per_field is not None and \
+                    field_error_counts[curr_field] >= max_errors_per_field:
+                logger.warning(f"Stopped validation of field {curr_field} "
+                               f"after {max_errors_per_field} errors")
+                validation_msgs.append(_make_truncation_msg(
+                    curr_msg,
+                    FIELD_ERRORS_TRUNCATED_MSG.format(max_errors_per_field)))
+                truncated_fields.add(curr_field)
+                continue
+
+            validation_msgs.append(curr_msg)
+            num_errors += 1
+            field_error_counts[curr_field] += 1
+        # next validation msg
+
+        if len(truncated_fields) > num_truncated_fields:
+            compiled_schema = _get_compiled_schema(
+                {k: v for k, v in fields_dict.items()
+                 if k not in truncated_fields})
+    # next chunk
+
+    return validation_msgs
+
+
+def _make_truncation_msg(validation_msg, error_message):
+    """Make the record replacing the first validation error over a budget.
+
+    Parameters
+    ----------
+    validation_msg : Dict[str, Any]
+        The first validation message over the budget.
+    error_message : str
+        The truncation message to record in its place.
+
+    Returns
+    -------
+    Dict[str, Any]
+        A record for the same sample and field with the truncation message.
+    """
+    return {SAMPLE_NAME_KEY: validation_msg[SAMPLE_NAME_KEY],
+            "field_name": validation_msg["field_name"],
+            "error_message": [error_message]}
+
+
+def _init_validation_worker(fields_dict, now):
+    """Compile the schema and make the value checker in a worker process.
+
+    Parameters
+    ----------
+    fields_dict : Dict[str, Any]
+        The metadata fields dictionary of the sample type being validated.
+    now : datetime
+        The time of the validation run, to check dates against.
+    """
+    global _WORKER_COMPILED_SCHEMA, _WORKER_VALUE_CHECKER
+    _WORKER_COMPILED_SCHEMA = _get_compiled_schema(fields_dict)
+    _WORKER_VALUE_CHECKER = ValueChecker(now)
+
+
+def _validate_chunk_in_worker(typed_chunk_df, engine):
+    """Generate validation messages for a chunk of rows in a worker process.
+
+    Parameters
+    ----------
+    typed_chunk_df : pandas.DataFrame
+        A chunk of the typed metadata to validate.
+    engine : str
+        One of VALIDATION_ENGINES.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The validation messages for the chunk, in row order, using the
+        schema and value checker stored by _init_validation_worker.
+    """
+    return _validate_typed_metadata_df(
+        typed_chunk_df, _WORKER_COMPILED_SCHEMA, engine,
+        _WORKER_VALUE_CHECKER)
+
+
+class _CompiledSchema:
+    """A cerberus schema with the validators to check metadata against it.
+
+    Parameters
+    ----------
+    config : Dict[str, Any]
+        The cerberus schema.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.validator = _make_validator(config)
+
+        # rows can only be validated once per distinct set of values if no
+        # rule looks beyond the value of the field it is on
+        self.is_deduplicable = not any(
+            _uses_other_fields(x) for x in config.values())
+
+        # every sample name is different, so sample names are validated
+        # apart from the other fields when possible
+        self.sample_name_validator = None
+        self.other_fields_validator = self.validator
+        if self.is_deduplicable and SAMPLE_NAME_KEY in config:
+            self.sample_name_validator = _make_validator(
+                {SAMPLE_NAME_KEY: config[SAMPLE_NAME_KEY]})
+            self.other_fields_validator = _make_validator(
+                {k: v for k, v in config.items() if k != SAMPLE_NAME_KEY})
+
+
+def clear_schema_cache() -> None:
+    """Empty the in-process cache of compiled validation schemas."""
+    _COMPILED_SCHEMA_CACHE.clear()
+
+
+def _get_compiled_schema(
+        sample_type_full_metadata_fields_dict: Dict[str, Any]) -> \
+        _CompiledSchema:
+    """Get the compiled schema for a fields dict, reusing a cached one if possible.
+
+    Stripping the fields dict down to a cerberus schema and having cerberus
+    check and normalize that schema is done only once per distinct fields
+    dict per process: the results are kept in a bounded LRU cache keyed by
+    a fingerprint of the fields dict.
+
+    Parameters
+    ----------
+    sample_type_full_metadata_fields_dict : Dict[str, Any]
+        The metadata fields dictionary of a sample type.
+
+    Returns
+    -------
+    _CompiledSchema
+        The cerberus schema for the fields dict and its validators. NB:
+        this may be shared with other callers, so must not be modified.
+    """
+    cache_key = fingerprint_obj(sample_type_full_metadata_fields_dict)
+    compiled_schema = _COMPILED_SCHEMA_CACHE.get(cache_key)
+    if compiled_schema is not None:
+        _COMPILED_SCHEMA_CACHE.move_to_end(cache_key)
+        return compiled_schema
+
+    compiled_schema = _CompiledSchema(
+        _make_cerberus_schema(sample_type_full_metadata_fields_dict))
+
+    _COMPILED_SCHEMA_CACHE[cache_key] = compiled_schema
+    if len(_COMPILED_SCHEMA_CACHE) > MAX_CACHED_SCHEMAS:
+        _COMPILED_SCHEMA_CACHE.popitem(last=False)
+    return compiled_schema
+
+
+def _make_validator(config):
+    validator = QiimpValidator(config)
+    validator.allow_unknown = True
+    return validator
+
+
+def _uses_other_fields(definition):
+    # err on the side of caution: any dict or list in the definition is
+    # searched for rules, even if its keys are really field names
+    if isinstance(definition, list):
+        return any(_uses_other_fields(x) for x in definition)
+    if not isinstance(definition, dict):
+        return False
+
+    for curr_rule, curr_constraint in definition.items():
+        if curr_rule in _CROSS_FIELD_RULES:
+            return True
+        if curr_rule == _CHECK_WITH_KEY:
+            # only the registered custom checks are known to look at just
+            # the value
+            checks = [curr_constraint] \
+                if isinstance(curr_constraint, str) else curr_constraint
+            if not isinstance(checks, list) or \
+                    not all(isinstance(x, str) and x in _VALUE_CHECKS
+                            for x in checks):
+                return True
+        if _uses_other_fields(curr_constraint):
+            return True
+    # next rule
+
+    return False
+
+
 def _make_cerberus_schema(sample_type_metadata_dict):
     unrecognized_keys = ['is_phi', 'field_desc', 'units',
                          'min_exclusive', 'unique']
@@ -107,6 +659,16 @@ def _remove_keys_from_dict_in_list(input_list, keys_to_remove):
     return output_list
 
 
+def _get_object_col(a_col):
+    # string dtype columns hold pandas.NA for missing values and skip them
+    # when mapping; cast them back to object columns holding NaNs, as they
+    # would have been without the string dtype, so they validate the same
+    if not isinstance(a_col.dtype, pandas.StringDtype):
+        return a_col
+
+    return a_col.astype(object).where(a_col.notna(), np.nan)
+
+
 def _cast_field_to_type(raw_field_val, allowed_pandas_types):
     typed_field_val = None
     for curr_type in allowed_pandas_types:
@@ -126,6 +688,215 @@ def _cast_field_to_type(raw_field_val, allowed_pandas_types):
     return typed_field_val
 
 
+def _parse_number(a_val):
+    if not isinstance(a_val, str):
+        return a_val
+
+    try:
+        parsed_val = float(a_val)
+    except ValueError:
+        return a_val
+    return parsed_val if math.isfinite(parsed_val) else a_val
+
+
+def _cast_field_to_type_or_keep(raw_field_val, allowed_pandas_types):
+    try:
+        return _cast_field_to_type(raw_field_val, allowed_pandas_types)
+    except ValueError:
+        return raw_field_val
+
+
+def _cast_col_to_types(a_col, allowed_pandas_types, keep_uncastable=False):
+    """Cast each value of a field to the first of its allowed types that takes it.
+
+    The values are the same as those from casting each value with
+    _cast_field_to_type, but each distinct value (of each type) is cast only
+    once, and the distinct values are cast a type at a time: values already
+    of a type pass through, numbers and booleans are converted with numpy,
+    and only strings (and values of other types) being cast to another type
+    are cast individually.
+
+    Parameters
+    ----------
+    a_col : pandas.Series
+        The values of the field.
+    allowed_pandas_types : List[type]
+        The python types to try casting each value to, in order.
+    keep_uncastable : bool, default=False
+        Whether to leave values that cannot be cast to any of the allowed
+        types as they are rather than raising.
+
+    Returns
+    -------
+    pandas.Series
+        The cast values, with the dtype Series.apply would infer for them.
+
+    Raises
+    ------
+    ValueError
+        If a value cannot be cast to any of the allowed types and
+        keep_uncastable is False.
+    """
+    if len(a_col) == 0 or \
+            not isinstance(a_col.dtype, (np.dtype, pandas.StringDtype)):
+        # mapping a categorical casts only its categories, and mapping an
+        # empty column keeps its dtype
+        return _get_object_col(a_col).apply(
+            lambda x: _cast_field_to_type_or_keep(x, allowed_pandas_types)
+            if keep_uncastable else
+            _cast_field_to_type(x, allowed_pandas_types))
+
+    values = _get_object_col(a_col).to_numpy(dtype=object)
+    type_codes, value_codes = _get_value_codes(values)
+    # value codes are less than the number of values, so this numbers each
+    # distinct value of each type, in order of first appearance
+    distinct_codes, distinct_keys = pandas.factorize(
+        type_codes * len(values) + value_codes)
+    # the first position of each distinct value
+    distinct_idxs = np.empty(len(distinct_keys), dtype=np.intp)
+    distinct_idxs[distinct_codes[::-1]] = np.arange(len(values))[::-1]
+    distinct_values = values[distinct_idxs]
+    distinct_types = _get_value_types(distinct_values)
+
+    typed_values = np.empty(len(distinct_values), dtype=object)
+    is_pending = np.ones(len(distinct_values), dtype=bool)
+    for curr_type in allowed_pandas_types:
+        pending_idxs = np.flatnonzero(is_pending)
+        if len(pending_idxs) == 0:
+            break
+
+        curr_caster = _COLUMN_CASTERS.get(curr_type)
+        if curr_caster is None:
+            curr_values, is_cast = _cast_values_individually(
+                distinct_values[pending_idxs], curr_type)
+        else:
+            curr_values, is_cast = curr_caster(
+                distinct_values[pending_idxs], distinct_types[pending_idxs])
+        typed_values[pending_idxs[is_cast]] = curr_values[is_cast]
+        is_pending[pending_idxs[is_cast]] = False
+    # next allowed type
+
+    if keep_uncastable:
+        typed_values[is_pending] = distinct_values[is_pending]
+    elif is_pending.any():
+        raise ValueError(
+            f"Unable to cast '{distinct_values[is_pending][0]}' to any of "
+            f"the allowed types: {allowed_pandas_types}")
+
+    # infer the dtype as Series.apply would
+    return pandas.Series(
+        typed_values[distinct_codes], index=a_col.index,
+        name=a_col.name).infer_objects()
+
+
+def _get_value_types(values):
+    # a ufunc builds the (object) array of types much faster than np.array
+    # does from a list of them
+    return _TYPE_UFUNC(values)
+
+
+def _cast_values_to_str(values, value_types):
+    cast_values = values.copy()
+    is_cast = value_types == str
+    is_number = (value_types == int) | (value_types == float) | \
+        (value_types == bool)
+    cast_values[is_number] = [str(x) for x in values[is_number]]
+    is_cast |= is_number
+    return _cast_others_individually(values, cast_values, is_cast, str)
+
+
+def _cast_values_to_float(values, value_types):
+    cast_values = values.copy()
+    is_cast = value_types == float
+    is_number = (value_types == int) | (value_types == bool)
+    try:
+        cast_values[is_number] = values[is_number].astype(float)
+        is_cast |= is_number
+    except OverflowError:
+        # some int is too large for a float; leave them all to be cast
+        # individually
+        pass
+    return _cast_others_individually(values, cast_values, is_cast, float)
+
+
+def _cast_values_to_int(values, value_types):
+    cast_values = values.copy()
+    is_cast = value_types == int
+    is_bool = value_types == bool
+    cast_values[is_bool] = values[is_bool].astype(np.int64).tolist()
+    is_cast |= is_bool
+
+    # int() truncates floats, and fails for NaN and infinity
+    is_float = value_types == float
+    float_values = values[is_float].astype(float)
+    is_int64_float = np.abs(float_values) < 2 ** 63
+    is_int64 = np.zeros(len(values), dtype=bool)
+    is_int64[is_float] = is_int64_float
+    cast_values[is_int64] = np.trunc(
+        float_values[is_int64_float]).astype(np.int64).tolist()
+    is_cast |= is_int64
+    is_failed = np.zeros(len(values), dtype=bool)
+    is_failed[is_float] = ~np.isfinite(float_values)
+
+    is_other = ~(is_cast | is_failed)
+    cast_values[is_other], is_cast[is_other] = _cast_values_individually(
+        values[is_other], int)
+    return cast_values, is_cast
+
+
+def _cast_values_to_bool(values, value_types):
+    cast_values = np.empty(len(values), dtype=object)
+    is_str = value_types == str
+    cast_values[is_str] = values[is_str] != ""
+    is_number = (value_types == int) | (value_types == float) | \
+        (value_types == bool)
+    cast_values[is_number] = values[is_number] != 0
+    return _cast_others_individually(
+        values, cast_values, is_str | is_number, bool)
+
+
+def _cast_others_individually(values, cast_values, is_cast, a_type):
+    is_other = ~is_cast
+    cast_values[is_other], is_cast[is_other] = _cast_values_individually(
+        values[is_other], a_type)
+    return cast_values, is_cast
+
+
+def _cast_values_individually(values, a_type):
+    """Cast values to a type one at a time, as _cast_field_to_type does.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The (object) array of values to cast.
+    a_type : type
+        The python type to cast the values to.
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        The (object) array of cast values and the mask of the values that
+        could be cast.
+    """
+    cast_values = np.empty(len(values), dtype=object)
+    is_cast = np.zeros(len(values), dtype=bool)
+    for curr_idx, curr_value in enumerate(values):
+        # noinspection PyBroadException
+        try:
+            cast_values[curr_idx] = a_type(curr_value)
+            is_cast[curr_idx] = True
+        except Exception:  # noqa: E722
+            pass
+    # next value
+    return cast_values, is_cast
+
+
+# the python types values can be cast to a column at a time; values are cast
+# to any other type individually
+_COLUMN_CASTERS = {str: _cast_values_to_str, float: _cast_values_to_float,
+                   int: _cast_values_to_int, bool: _cast_values_to_bool}
+
+
 def _get_allowed_pandas_types(field_name, field_definition):
     cerberus_to_python_types = {
         "string": str,
@@ -153,14 +924,182 @@ def _get_allowed_pandas_types(field_name, field_definition):
     return allowed_pandas_types
 
 
-def _generate_validation_msg(typed_metadata_df, config):
-    v = QiimpValidator()
-    v.allow_unknown = True
+def _generate_validation_msg(typed_metadata_df, compiled_schema,
+                             value_checker=None):
+    """Generate validation messages for typed metadata with cerberus.
+
+    Unless the schema has rules that look across fields, each distinct
+    combination of values of the validated fields other than the sample
+    name is validated only once, and the sample names are validated
+    separately; the errors are then fanned back out to every sample with
+    those values. The messages are the same as those from validating every
+    row in full.
+
+    Parameters
+    ----------
+    typed_metadata_df : pandas.DataFrame
+        The metadata to validate, with each field in the schema cast to one
+        of its allowed types.
+    compiled_schema : _CompiledSchema
+        The compiled schema to validate against.
+    value_checker : Optional[ValueChecker], default=None
+        The checker to run custom check_with rules with; if None, a new one
+        is used.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The validation messages, in row order.
+    """
+    if value_checker is None:
+        value_checker = ValueChecker()
+    validators = [compiled_schema.validator,
+                  compiled_schema.other_fields_validator,
+                  compiled_schema.sample_name_validator]
+    validators = [x for x in validators if x is not None]
+    for curr_validator in validators:
+        curr_validator.value_checker = value_checker
+    try:
+        return _generate_validation_msg_with_validators(
+            typed_metadata_df, compiled_schema)
+    finally:
+        # don't keep the run's memo alive in the (cached) validators
+        for curr_validator in validators:
+            curr_validator.value_checker = None
 
+
+def _generate_validation_msg_with_validators(
+        typed_metadata_df, compiled_schema):
+    if not compiled_schema.is_deduplicable or \
+            not typed_metadata_df.columns.is_unique:
+        return _generate_validation_msg_by_row(
+            typed_metadata_df, compiled_schema.validator)
+
+    num_rows = len(typed_metadata_df)
+    is_sample_name_apart = \
+        compiled_schema.sample_name_validator is not None and \
+        SAMPLE_NAME_KEY in typed_metadata_df.columns
+    if is_sample_name_apart:
+        row_errors = _find_distinct_row_errors(
+            typed_metadata_df, compiled_schema.other_fields_validator)
+        sample_name_errors = _find_distinct_row_errors(
+            typed_metadata_df, compiled_schema.sample_name_validator)
+    else:
+        row_errors = _find_distinct_row_errors(
+            typed_metadata_df, compiled_schema.validator)
+        sample_name_errors = [[]] * num_rows
+
+    validation_msgs = []
+    sample_names = None
+    for curr_idx in range(num_rows):
+        curr_errors = row_errors[curr_idx]
+        if sample_name_errors[curr_idx]:
+            # cerberus reports a row's errors in field name order
+            curr_errors = sorted(curr_errors + sample_name_errors[curr_idx],
+                                 key=lambda x: x[0])
+        if not curr_errors:
+            continue
+
+        if sample_names is None:
+            sample_names = typed_metadata_df[SAMPLE_NAME_KEY].tolist()
+        for curr_field_name, curr_err_msg in curr_errors:
+            validation_msgs.append({
+                SAMPLE_NAME_KEY: sample_names[curr_idx],
+                "field_name": curr_field_name,
+                "error_message": curr_err_msg})
+        # next error for curr row
+    # next row
+
+    return validation_msgs
+
+
+def _find_distinct_row_errors(typed_metadata_df, v):
+    """Validate each distinct combination of values of the schema's fields once.
+
+    Parameters
+    ----------
+    typed_metadata_df : pandas.DataFrame
+        The typed metadata to validate.
+    v : QiimpValidator
+        Validator holding the schema to validate against, none of whose
+        rules look beyond the value of the field they are on.
+
+    Returns
+    -------
+    List[List[Tuple[str, Any]]]
+        For each row, the (field name, errors) of each field that fails
+        validation, in field name order. NB: rows with the same values
+        share the same list.
+    """
+    num_rows = len(typed_metadata_df)
+    validated_fields = [x for x in v.schema
+                        if x in typed_metadata_df.columns]
+    field_values = {x: _get_python_values(typed_metadata_df[x])
+                    for x in validated_fields}
+
+    # number the distinct combinations of values in order of appearance
+    row_codes = np.zeros(num_rows, dtype=np.int64)
+    for curr_field in validated_fields:
+        for curr_codes in _get_value_codes(field_values[curr_field]):
+            row_codes, _ = pandas.factorize(
+                row_codes * (int(curr_codes.max(initial=0)) + 1) +
+                curr_codes)
+    # next validated field
+    _, first_rows = np.unique(row_codes, return_index=True)
+
+    distinct_errors = []
+    for curr_row in first_rows:
+        curr_doc = {x: field_values[x][curr_row] for x in validated_fields}
+        if v.validate(curr_doc):
+            distinct_errors.append([])
+        else:
+            distinct_errors.append(list(v.errors.items()))
+    # next distinct combination of values
+
+    return [distinct_errors[x] for x in row_codes]
+
+
+def _get_value_codes(values):
+    """Number values so that only values cerberus cannot tell apart share a number.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The (object) array of values of a field.
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        The code of the type of each value and the code of each value
+        within its type.
+    """
+    type_codes, value_types = pandas.factorize(
+        _get_value_types(values))
+    # values of types that cannot safely be compared are all different
+    value_codes = np.arange(len(values))
+    for curr_type_code, curr_type in enumerate(value_types):
+        curr_mask = type_codes == curr_type_code
+        if curr_type is float:
+            # compare the bits, so 0.0 and -0.0 differ and NaNs are the same
+            curr_keys = np.array(
+                values[curr_mask], dtype=float).view(np.int64)
+        elif curr_type in [str, int, bool]:
+            curr_keys = values[curr_mask]
+        else:
+            continue
+        value_codes[curr_mask], _ = pandas.factorize(curr_keys)
+    # next type of value
+
+    return type_codes, value_codes
+
+
+def _generate_validation_msg_by_row(typed_metadata_df, v):
+    # NB: v already holds the schema; passing the schema to validate would
+    # have cerberus re-check it for every row
     validation_msgs = []
     raw_metadata_dict = typed_metadata_df.to_dict(orient="records")
     for curr_idx, curr_row in enumerate(raw_metadata_dict):
-        if not v.validate(curr_row, config):
+        if not v.validate(curr_row):
             curr_sample_name = curr_row[SAMPLE_NAME_KEY]
             for curr_field_name, curr_err_msg in v.errors.items():
                 validation_msgs.append({
@@ -172,3 +1111,348 @@ def _generate_validation_msg(typed_metadata_df, config):
     # next row
 
     return validation_msgs
+
+
+def _generate_validation_msg_by_column(
+        typed_metadata_df: pandas.DataFrame,
+        config: Dict[str, Any],
+        value_checker: Optional[ValueChecker] = None) -> \
+        Optional[List[Dict[str, Any]]]:
+    """Generate validation messages for typed metadata a column at a time.
+
+    Each field's rules are checked against its whole column at once, with
+    cerberus's rule order, short-circuiting, error messages and error
+    sorting reproduced so that the messages are the same as those
+    _generate_validation_msg gets by validating each row with QiimpValidator.
+
+    Parameters
+    ----------
+    typed_metadata_df : pandas.DataFrame
+        The metadata to validate, with each field in the schema cast to one
+        of its allowed types.
+    config : Dict[str, Any]
+        The cerberus schema to validate against.
+    value_checker : Optional[ValueChecker], default=None
+        The checker to run custom check_with rules with; if None, a new one
+        is used.
+
+    Returns
+    -------
+    Optional[List[Dict[str, Any]]]
+        The validation messages, or None if the schema uses rules (or the
+        metadata holds values) that cannot be checked column-wise.
+    """
+    if not typed_metadata_df.columns.is_unique or \
+            not all(_is_vectorizable_definition(x, _VECTORIZED_RULES)
+                    for x in config.values()):
+        return None
+    if len(typed_metadata_df) == 0:
+        return []
+    if value_checker is None:
+        value_checker = ValueChecker()
+
+    num_rows = len(typed_metadata_df)
+    # cerberus reports the errors of a row in field name order
+    row_errors = defaultdict(list)
+    for curr_field in sorted(config):
+        curr_definition = config[curr_field]
+        if curr_field in typed_metadata_df.columns:
+            curr_values = _get_python_values(typed_metadata_df[curr_field])
+        elif _DEFAULT_KEY in curr_definition:
+            # cerberus fills a missing field with its default, if any,
+            # before validating it
+            curr_values = np.full(
+                num_rows, curr_definition[_DEFAULT_KEY], dtype=object)
+        else:
+            if curr_definition.get(_REQUIRED_KEY, False) is True:
+                required_msg = _format_cerberus_msg(
+                    cerberus_errors.REQUIRED_FIELD)
+                for curr_idx in range(num_rows):
+                    row_errors[curr_idx].append((curr_field, [required_msg]))
+            continue
+        # endif field is in metadata
+
+        type_codes, value_types = pandas.factorize(
+            _get_value_types(curr_values))
+        value_types = list(value_types)
+        if not all(x in _VECTORIZED_VALUE_TYPES for x in value_types):
+            return None
+
+        rule_errors = _find_rule_errors(
+            curr_definition, curr_values, type_codes, value_types,
+            value_checker)
+        for curr_idx, curr_err_msg in _get_error_lists(rule_errors).items():
+            row_errors[curr_idx].append((curr_field, curr_err_msg))
+    # next field in config
+
+    validation_msgs = []
+    if row_errors:
+        sample_names = typed_metadata_df[SAMPLE_NAME_KEY].tolist()
+        for curr_idx in sorted(row_errors):
+            for curr_field_name, curr_err_msg in row_errors[curr_idx]:
+                validation_msgs.append({
+                    SAMPLE_NAME_KEY: sample_names[curr_idx],
+                    "field_name": curr_field_name,
+                    "error_message": curr_err_msg})
+            # next error for curr row
+        # next row with errors
+    return validation_msgs
+
+
+def _is_vectorizable_definition(definition, allowed_rules):
+    if not isinstance(definition, dict) or \
+            not all(x in allowed_rules for x in definition):
+        return False
+
+    data_type = definition.get(_TYPE_KEY)
+    if data_type:
+        data_types = [data_type] if isinstance(data_type, str) else data_type
+        if not all(isinstance(x, str) and x in QiimpValidator.types_mapping
+                   for x in data_types):
+            return False
+
+    checks = definition.get(_CHECK_WITH_KEY, [])
+    if isinstance(checks, str):
+        checks = [checks]
+    if not all(isinstance(x, str) and x in _VALUE_CHECKS for x in checks):
+        return False
+
+    for curr_rule in [_MIN_KEY, _MAX_KEY]:
+        if curr_rule in definition and \
+                type(definition[curr_rule]) not in [int, float]:
+            return False
+    if _DEFAULT_KEY in definition and \
+            type(definition[_DEFAULT_KEY]) not in _VECTORIZED_VALUE_TYPES:
+        return False
+
+    return all(_is_vectorizable_definition(x, _VECTORIZED_ANYOF_RULES)
+               for x in definition.get(_ANYOF_KEY, []))
+
+
+def _get_python_values(a_col):
+    # cerberus sees the python (rather than numpy) values that to_dict gives
+    return pandas.Series(a_col.tolist(), dtype=object).to_numpy()
+
+
+def _find_rule_errors(definition, values, type_codes, value_types,
+                      value_checker):
+    """Find the errors cerberus would report for each value of a field.
+
+    Parameters
+    ----------
+    definition : Dict[str, Any]
+        The cerberus definition of the field.
+    values : numpy.ndarray
+        The (object) array of values of the field.
+    type_codes : numpy.ndarray
+        The index in value_types of the type of each value.
+    value_types : List[type]
+        The types of the values.
+    value_checker : ValueChecker
+        The checker to run custom check_with rules with.
+
+    Returns
+    -------
+    List[Tuple[Tuple[str, ...], numpy.ndarray, Any, Optional[numpy.ndarray]]]
+        For each rule broken by any value: the rule's schema path below the
+        field, a mask of the values breaking it, their error message (either
+        one string or an array of a message per value) and, for anyof
+        rules, an array of the sub-tree of errors per value (else None).
+    """
+    rule_errors = []
+    is_str = _get_types_mask(type_codes, value_types, lambda x: x is str)
+
+    # a value of the wrong type is not checked against any other rule
+    is_checked = np.ones(len(values), dtype=bool)
+    data_type = definition.get(_TYPE_KEY)
+    if data_type:
+        is_checked = _get_types_mask(
+            type_codes, value_types,
+            lambda x: _is_of_cerberus_type(x, data_type))
+        rule_errors.append((
+            (_TYPE_KEY,), ~is_checked,
+            _format_cerberus_msg(
+                cerberus_errors.BAD_TYPE, constraint=data_type),
+            None))
+
+    # an empty value is not checked against allowed, regex or check_with
+    is_filled = is_checked
+    if _EMPTY_KEY in definition:
+        is_empty = is_checked & is_str & (values == "")
+        if not definition[_EMPTY_KEY]:
+            rule_errors.append((
+                (_EMPTY_KEY,), is_empty,
+                _format_cerberus_msg(cerberus_errors.EMPTY_NOT_ALLOWED),
+                None))
+        is_filled = is_checked & ~is_empty
+
+    for curr_rule, curr_constraint in definition.items():
+        if curr_rule == _ALLOWED_KEY:
+            # NaN is never equal to an allowed value
+            is_error = is_filled & ~(
+                pandas.Series(values, dtype=object).isin(
+                    list(curr_constraint)).to_numpy() &
+                pandas.notna(values))
+            error_msgs = np.empty(len(values), dtype=object)
+            error_msgs[is_error] = [
+                _format_cerberus_msg(cerberus_errors.UNALLOWED_VALUE, value=x)
+                for x in values[is_error]]
+            rule_errors.append(((curr_rule,), is_error, error_msgs, None))
+        elif curr_rule == _REGEX_KEY:
+            # cerberus matches from the start of the value and anchors the
+            # pattern at its end
+            pattern = curr_constraint if curr_constraint.endswith("$") \
+                else curr_constraint + "$"
+            is_matched = is_filled & is_str
+            is_error = np.zeros(len(values), dtype=bool)
+            is_error[is_matched] = ~pandas.Series(
+                values[is_matched], dtype=object).str.match(
+                    pattern).to_numpy(dtype=bool)
+            rule_errors.append((
+                (curr_rule,), is_error,
+                _format_cerberus_msg(cerberus_errors.REGEX_MISMATCH,
+                                     constraint=curr_constraint),
+                None))
+        elif curr_rule in [_MIN_KEY, _MAX_KEY]:
+            is_max = curr_rule == _MAX_KEY
+            is_error = _find_out_of_bounds_values(
+                values, type_codes, is_checked, curr_constraint, is_max)
+            rule_errors.append((
+                (curr_rule,), is_error,
+                _format_cerberus_msg(
+                    cerberus_errors.MAX_VALUE if is_max
+                    else cerberus_errors.MIN_VALUE,
+                    constraint=curr_constraint),
+                None))
+        elif curr_rule == _CHECK_WITH_KEY:
+            checks = [curr_constraint] if isinstance(curr_constraint, str) \
+                else curr_constraint
+            for curr_check in checks:
+                # custom errors have no schema path, so sort first
+                error_msgs = _apply_value_check(
+                    value_checker, curr_check, values, type_codes, is_filled)
+                rule_errors.append(
+                    ((), pandas.notna(error_msgs), error_msgs, None))
+            # next check
+        elif curr_rule == _ANYOF_KEY:
+            rule_errors.append(_find_anyof_errors(
+                definition, values, type_codes, value_types, is_checked,
+                value_checker))
+        # endif which rule
+    # next rule in definition
+
+    return rule_errors
+
+
+def _find_anyof_errors(definition, values, type_codes, value_types,
+                       is_checked, value_checker):
+    checked_positions = np.flatnonzero(is_checked)
+    is_failed = np.ones(len(checked_positions), dtype=bool)
+    anyof_error_lists = []
+    for curr_anyof_definition in definition[_ANYOF_KEY]:
+        # each anyof definition inherits the field's type if it has none
+        curr_anyof_definition = dict(curr_anyof_definition)
+        if _TYPE_KEY not in curr_anyof_definition and \
+                _TYPE_KEY in definition:
+            curr_anyof_definition[_TYPE_KEY] = definition[_TYPE_KEY]
+
+        curr_rule_errors = _find_rule_errors(
+            curr_anyof_definition, values[checked_positions],
+            type_codes[checked_positions], value_types, value_checker)
+        curr_error_lists = _get_error_lists(curr_rule_errors)
+        is_failed &= np.isin(
+            np.arange(len(checked_positions)), list(curr_error_lists))
+        anyof_error_lists.append(curr_error_lists)
+    # next anyof definition
+
+    is_error = np.zeros(len(values), dtype=bool)
+    subtrees = np.empty(len(values), dtype=object)
+    for curr_idx in np.flatnonzero(is_failed):
+        curr_position = checked_positions[curr_idx]
+        is_error[curr_position] = True
+        subtrees[curr_position] = {
+            f"{_ANYOF_KEY} definition {i}": x[curr_idx]
+            for i, x in enumerate(anyof_error_lists)}
+    # next failed value
+
+    return ((_ANYOF_KEY,), is_error,
+            _format_cerberus_msg(cerberus_errors.ANYOF), subtrees)
+
+
+def _get_error_lists(rule_errors):
+    # cerberus lists a field's errors in order of their schema path, with
+    # the sub-tree of any anyof errors last
+    error_lists = defaultdict(list)
+    subtrees = defaultdict(dict)
+    for _, is_error, error_msgs, curr_subtrees in \
+            sorted(rule_errors, key=lambda x: x[0]):
+        for curr_idx in np.flatnonzero(is_error).tolist():
+            error_lists[curr_idx].append(
+                error_msgs if isinstance(error_msgs, str)
+                else error_msgs[curr_idx])
+            if curr_subtrees is not None:
+                subtrees[curr_idx].update(curr_subtrees[curr_idx])
+        # next value breaking the rule
+    # next rule
+
+    for curr_idx, curr_subtree in subtrees.items():
+        error_lists[curr_idx].append(curr_subtree)
+    return error_lists
+
+
+def _find_out_of_bounds_values(values, type_codes, is_checked, bound,
+                               is_max):
+    is_error = np.zeros(len(values), dtype=bool)
+    for curr_type_code in np.unique(type_codes[is_checked]):
+        curr_mask = is_checked & (type_codes == curr_type_code)
+        try:
+            # NaNs never fall out of bounds; don't warn about comparing them
+            with np.errstate(invalid="ignore"):
+                curr_is_error = values[curr_mask] > bound if is_max \
+                    else values[curr_mask] < bound
+        except TypeError:
+            # cerberus ignores values that cannot be compared to the bound
+            continue
+        is_error[curr_mask] = np.asarray(curr_is_error, dtype=bool)
+    # next type of value
+
+    return is_error
+
+
+def _apply_value_check(value_checker, check_name, values, type_codes,
+                       is_checked):
+    # look up the check's result once per distinct value (of each type)
+    error_msgs = np.full(len(values), None, dtype=object)
+    for curr_type_code in np.unique(type_codes[is_checked]):
+        curr_mask = is_checked & (type_codes == curr_type_code)
+        value_codes, unique_values = pandas.factorize(
+            values[curr_mask], use_na_sentinel=False)
+        unique_error_msgs = np.empty(len(unique_values), dtype=object)
+        unique_error_msgs[:] = [value_checker.check(check_name, x)
+                                for x in unique_values]
+        error_msgs[curr_mask] = unique_error_msgs[value_codes]
+    # next type of value
+
+    return error_msgs
+
+
+def _get_types_mask(type_codes, value_types, type_filter):
+    matching_codes = [i for i, x in enumerate(value_types) if type_filter(x)]
+    return np.isin(type_codes, matching_codes)
+
+
+def _is_of_cerberus_type(python_type, data_type):
+    data_types = (data_type,) if isinstance(data_type, str) else data_type
+    for curr_data_type in data_types:
+        type_definition = QiimpValidator.types_mapping[curr_data_type]
+        if issubclass(python_type, type_definition.included_types) and \
+                not issubclass(python_type, type_definition.excluded_types):
+            return True
+    # next allowed data type
+
+    return False
+
+
+def _format_cerberus_msg(error_definition, constraint=None, value=None):
+    return cerberus_errors.BasicErrorHandler.messages[
+        error_definition.code].format(constraint=constraint, value=value)
@@ -1,7 +1,16 @@
 import copy
+from contextlib import contextmanager
+import hashlib
+import logging
+import numbers
+import numpy as np
 import os
 import pandas
-from typing import List, Optional, Union, Callable
+from pandas.io.parsers import TextFileReader
+import pickle
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, List, Optional, Union, Callable, Iterator
 import yaml
 
 # config keys
@@ -46,10 +55,38 @@ REQUIRED_RAW_METADATA_FIELDS = [SAMPLE_NAME_KEY,
                                 HOSTTYPE_SHORTHAND_KEY,
                                 SAMPLETYPE_SHORTHAND_KEY]
 
+# on-disk cache of parsed yaml files
+CACHE_DIR_ENV_VAR = "QIIMP_CACHE_DIR"
+# bump this if the format of the cached objects changes
+_CACHE_FORMAT_VERSION = "1"
+# maximum number of cache files kept; least recently used ones are pruned
+MAX_CACHE_FILES = 16
+
+# encodings tried, in order, when loading a delimited file
+# (from https://stackoverflow.com/a/76366653)
+BEST_FIT_ENCODINGS = ["utf-8", "utf-8-sig", "iso-8859-1", "latin1", "cp1252"]
+# number of characters read at a time when checking a file's encoding
+_ENCODING_CHECK_BLOCK_SIZE = 1024 * 1024
+
+# storage options for pandas' string dtype: "pyarrow" (needs pyarrow
+# installed) or "python"
+STRING_STORAGE_OPTIONS = ["pyarrow", "python"]
+
+# keys of the event reported for each timed stage of a pipeline
+STAGE_NAME_KEY = "stage"
+STAGE_SECONDS_KEY = "seconds"
+STAGE_ROWS_IN_KEY = "rows_in"
+STAGE_ROWS_OUT_KEY = "rows_out"
+STAGE_BYTES_KEY = "bytes_allocated"
+
+# Define a logger for this module
+logger = logging.getLogger(__name__)
+
 
 def extract_config_dict(
         config_fp: Union[str, None],
-        starting_fp: Optional[str] = None) -> dict:
+        starting_fp: Optional[str] = None,
+        use_cache: bool = False) -> dict:
     """Extract configuration dictionary from a YAML file.
 
     If no config file path is provided, looks for config.yml in the grandparent
@@ -63,6 +100,9 @@ def extract_config_dict(
     starting_fp : Optional[str]
         Starting file path to use for finding the grandparent directory.
         If None, uses the current file's location.
+    use_cache : bool, default=False
+        If True, use the on-disk cache of parsed YAML files (see
+        extract_cached_yaml_dict) instead of always re-parsing the file.
 
     Returns
     -------
@@ -81,7 +121,10 @@ def extract_config_dict(
         config_fp = os.path.join(grandparent_dir, "config.yml")
 
     # read in config file
-    config_dict = extract_yaml_dict(config_fp)
+    if use_cache:
+        config_dict = extract_cached_yaml_dict(config_fp)
+    else:
+        config_dict = extract_yaml_dict(config_fp)
     return config_dict
 
 
@@ -110,7 +153,8 @@ def extract_yaml_dict(yaml_fp: str) -> dict:
     return yaml_dict
 
 
-def extract_stds_config(stds_fp: Union[str, None]) -> dict:
+def extract_stds_config(
+        stds_fp: Union[str, None], use_cache: bool = True) -> dict:
     """Extract standards dictionary from a YAML file.
 
     If no standards file path is provided, looks for standards.yml in the
@@ -121,6 +165,10 @@ def extract_stds_config(stds_fp: Union[str, None]) -> dict:
     stds_fp : Union[str, None]
         Path to the standards YAML file. If None, will look for
         standards.yml in the grandparent directory.
+    use_cache : bool, default=True
+        If True, use the on-disk cache of parsed YAML files (see
+        extract_cached_yaml_dict) instead of always re-parsing the file.
+        The cache directory must be trusted, since its files are unpickled.
 
     Returns
     -------
@@ -134,9 +182,147 @@ def extract_stds_config(stds_fp: Union[str, None]) -> dict:
     yaml.YAMLError
         If the YAML file is invalid.
     """
+    return extract_config_dict(get_stds_fp(stds_fp), use_cache=use_cache)
+
+
+def extract_cached_yaml_dict(
+        yaml_fp: str, cache_dir: Optional[str] = None) -> dict:
+    """Extract dictionary from a YAML file, using an on-disk cache if possible.
+
+    The cache entry for a file is keyed by a hash of the file's contents
+    plus the qiimp version, so an edited file or an upgraded qiimp never
+    sees a stale entry. Problems reading or writing the cache are logged
+    and otherwise ignored, falling back to parsing the YAML file directly.
+    At most MAX_CACHE_FILES entries are kept; writing a new entry prunes the
+    least recently used ones.
+
+    The cache directory must be trusted: its files are unpickled, so anyone
+    able to write to it can run arbitrary code as the user running qiimp.
+
+    Parameters
+    ----------
+    yaml_fp : str
+        Path to the YAML file.
+    cache_dir : Optional[str], default=None
+        Directory holding the cache files. If None, uses the directory named
+        in the QIIMP_CACHE_DIR environment variable or, if that is not set,
+        a qiimp directory in the user's cache directory.
+
+    Returns
+    -------
+    dict
+        Dictionary loaded from the YAML file (or its cache entry). This is
+        always a new object, so it may be freely modified by the caller.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the YAML file cannot be found.
+    yaml.YAMLError
+        If the YAML file is invalid.
+    """
+    with open(yaml_fp, "rb") as f:
+        yaml_contents = f.read()
+
+    cache_fp = os.path.join(
+        get_cache_dir(cache_dir), f"{_hash_yaml_contents(yaml_contents)}.pkl")
+    if os.path.isfile(cache_fp):
+        # noinspection PyBroadException
+        try:
+            with open(cache_fp, "rb") as f:
+                cached_dict = pickle.load(f)
+            # mark the entry as recently used so pruning keeps it
+            os.utime(cache_fp)
+            return cached_dict
+        except Exception as e:  # noqa: E722
+            logger.warning(f"Ignoring unreadable cache file {cache_fp}: {e}")
+    # endif there is a cache file for these contents
+
+    yaml_dict = yaml.safe_load(yaml_contents)
+    _write_cache_file(yaml_dict, cache_fp)
+    _prune_cache_dir(os.path.dirname(cache_fp))
+    return yaml_dict
+
+
+def get_cache_dir(cache_dir: Optional[str] = None) -> str:
+    """Get the directory holding qiimp's on-disk cache files.
+
+    Parameters
+    ----------
+    cache_dir : Optional[str], default=None
+        Directory to use. If None, uses the directory named in the
+        QIIMP_CACHE_DIR environment variable or, if that is not set, a qiimp
+        directory in the user's cache directory.
+
+    Returns
+    -------
+    str
+        Path to the cache directory (which may not yet exist).
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+    if not cache_dir:
+        user_cache_dir = os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        cache_dir = os.path.join(user_cache_dir, "qiimp")
+    return cache_dir
+
+
+def get_stds_fp(stds_fp: Optional[str] = None) -> str:
+    """Get the path to the standards YAML file.
+
+    Parameters
+    ----------
+    stds_fp : Optional[str], default=None
+        Path to the standards YAML file. If None, the path to standards.yml
+        in the grandparent directory of this code file is returned.
+
+    Returns
+    -------
+    str
+        Path to the standards YAML file.
+    """
     if not stds_fp:
         stds_fp = os.path.join(_get_grandparent_dir(), "standards.yml")
-    return extract_config_dict(stds_fp)
+    return stds_fp
+
+
+def fingerprint_file(a_fp: str) -> str:
+    """Get a hash of the contents of a file.
+
+    Parameters
+    ----------
+    a_fp : str
+        Path to the file.
+
+    Returns
+    -------
+    str
+        Hex digest of the file's contents.
+    """
+    with open(a_fp, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def fingerprint_obj(an_obj: Any) -> str:
+    """Get a stable hash of a (possibly nested) config-like object.
+
+    Two objects get the same fingerprint if they contain the same values in
+    the same order. Dictionary insertion order is significant, since configs
+    rely on it (e.g., transformers run, and fields are output, in order).
+
+    Parameters
+    ----------
+    an_obj : Any
+        Object to fingerprint; typically a dictionary loaded from YAML.
+
+    Returns
+    -------
+    str
+        Hex digest of a canonical representation of the object.
+    """
+    canonical_repr = repr(_canonicalize_obj(an_obj))
+    return hashlib.sha256(canonical_repr.encode("utf-8")).hexdigest()
 
 
 def deepcopy_dict(input_dict: dict) -> dict:
@@ -162,8 +348,9 @@ def deepcopy_dict(input_dict: dict) -> dict:
 
 
 def load_df_with_best_fit_encoding(
-        an_fp: str, a_file_separator: str, dtype: Optional[str] = None) -> \
-        pandas.DataFrame:
+        an_fp: str, a_file_separator: str, dtype: Optional[str] = None,
+        string_storage: Optional[str] = None,
+        nrows: Optional[int] = None) -> pandas.DataFrame:
     """Load a DataFrame from a file, trying multiple encodings.
 
     Attempts to load the file using various common encodings (utf-8, utf-8-sig,
@@ -177,6 +364,13 @@ def load_df_with_best_fit_encoding(
         Separator character used in the file (e.g., ',' for CSV).
     dtype : Optional[str]
         Data type to use for the DataFrame. If None, pandas will infer types.
+    string_storage : Optional[str]
+        If given, one of STRING_STORAGE_OPTIONS; columns holding only
+        strings are loaded as pandas' string dtype with this storage rather
+        than as object columns. See convert_str_cols_to_string_dtype.
+    nrows : Optional[int]
+        If given, the number of rows to load; 0 loads only the header.
+        If None, all rows are loaded.
 
     Returns
     -------
@@ -186,17 +380,19 @@ def load_df_with_best_fit_encoding(
     Raises
     ------
     ValueError
-        If the file cannot be decoded with any of the available encodings.
+        If the file cannot be decoded with any of the available encodings,
+        or if string_storage is not recognized.
+    ImportError
+        If string_storage is "pyarrow" and pyarrow is not installed.
     """
     result = None
 
-    # from https://stackoverflow.com/a/76366653
-    encodings = ["utf-8", "utf-8-sig", "iso-8859-1", "latin1", "cp1252"]
-    for encoding in encodings:
+    for encoding in BEST_FIT_ENCODINGS:
         # noinspection PyBroadException
         try:
             result = pandas.read_csv(
-                an_fp, sep=a_file_separator, encoding=encoding, dtype=dtype)
+                an_fp, sep=a_file_separator, encoding=encoding, dtype=dtype,
+                nrows=nrows)
             break
         except Exception:  # noqa: E722
             pass
@@ -205,9 +401,166 @@ def load_df_with_best_fit_encoding(
         raise ValueError(f"Unable to decode {an_fp} "
                          f"with any available encoder")
 
+    if string_storage is not None:
+        result = convert_str_cols_to_string_dtype(result, string_storage)
+
     return result
 
 
+def load_df_chunks_with_best_fit_encoding(
+        an_fp: str, a_file_separator: str, chunk_size: int,
+        dtype: Optional[str] = None,
+        keep_default_na: bool = True) -> TextFileReader:
+    """Open a delimited file for reading in chunks, trying multiple encodings.
+
+    Uses the first of the same encodings tried by
+    load_df_with_best_fit_encoding that can decode the whole file; the
+    file is checked in fixed-size blocks so it is never held in memory.
+    If no dtype is given, the dtype of each column is fixed from a first
+    pass over all the chunks, so every chunk gets the dtypes that loading
+    the whole file at once would have inferred (rather than ones that
+    depend on which values happen to share a chunk).
+
+    Parameters
+    ----------
+    an_fp : str
+        Path to the file to load.
+    a_file_separator : str
+        Separator character used in the file (e.g., ',' for CSV).
+    chunk_size : int
+        Number of rows in each chunk.
+    dtype : Optional[str]
+        Data type to use for the DataFrame. If None, pandas will infer types
+        (once, for the whole file).
+    keep_default_na : bool, default=True
+        Whether to read empty cells and pandas' default missing-value strings
+        as NaN; if False, they are read as they appear in the file.
+
+    Returns
+    -------
+    TextFileReader
+        Reader that yields DataFrames of up to chunk_size rows; it can be
+        used as a context manager to close the file.
+
+    Raises
+    ------
+    ValueError
+        If the file cannot be decoded with any of the available encodings.
+    """
+    for encoding in BEST_FIT_ENCODINGS:
+        try:
+            with open(an_fp, encoding=encoding) as a_file:
+                while a_file.read(_ENCODING_CHECK_BLOCK_SIZE):
+                    pass
+        except UnicodeDecodeError:
+            continue
+
+        if dtype is None:
+            dtype = _infer_whole_file_dtypes(
+                an_fp, a_file_separator, encoding, chunk_size,
+                keep_default_na)
+        return pandas.read_csv(
+            an_fp, sep=a_file_separator, encoding=encoding, dtype=dtype,
+            keep_default_na=keep_default_na, chunksize=chunk_size)
+    # next encoding
+
+    raise ValueError(f"Unable to decode {an_fp} "
+                     f"with any available encoder")
+
+
+def _infer_whole_file_dtypes(
+        an_fp: str, a_file_separator: str, encoding: str, chunk_size: int,
+        keep_default_na: bool) -> Dict[str, Any]:
+    """Infer the dtype of each column of a delimited file, one chunk at a time.
+
+    Parameters
+    ----------
+    an_fp : str
+        Path to the file.
+    a_file_separator : str
+        Separator character used in the file.
+    encoding : str
+        Encoding of the file.
+    chunk_size : int
+        Number of rows to read at a time.
+    keep_default_na : bool
+        Whether to read empty cells and pandas' default missing-value strings
+        as NaN.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The dtype of each column, as pandas would infer it from the whole
+        file: a column's own dtype if every chunk infers the same one,
+        float64 if the chunks infer a mix of (non-boolean) numeric dtypes
+        (e.g., integers in some and NaNs in others), and str otherwise.
+    """
+    chunk_dtypes = {}
+    with pandas.read_csv(
+            an_fp, sep=a_file_separator, encoding=encoding,
+            keep_default_na=keep_default_na,
+            chunksize=chunk_size) as chunks:
+        for curr_chunk in chunks:
+            for curr_col, curr_dtype in curr_chunk.dtypes.items():
+                chunk_dtypes.setdefault(curr_col, set()).add(curr_dtype)
+        # next chunk
+
+    col_dtypes = {}
+    for curr_col, curr_dtypes in chunk_dtypes.items():
+        if len(curr_dtypes) == 1:
+            col_dtypes[curr_col] = curr_dtypes.pop()
+        elif all(pandas.api.types.is_numeric_dtype(x) and
+                 not pandas.api.types.is_bool_dtype(x) for x in curr_dtypes):
+            col_dtypes[curr_col] = np.float64
+        else:
+            # pandas leaves a column with any non-numeric text as text
+            col_dtypes[curr_col] = str
+    # next column
+    return col_dtypes
+
+
+def convert_str_cols_to_string_dtype(
+        a_df: pandas.DataFrame, string_storage: str) -> pandas.DataFrame:
+    """Convert the object columns of a DataFrame that hold only strings to pandas' string dtype.
+
+    Parameters
+    ----------
+    a_df : pandas.DataFrame
+        DataFrame to convert. Not modified.
+    string_storage : str
+        One of STRING_STORAGE_OPTIONS: "pyarrow" for pyarrow-backed strings
+        or "python" for pandas' own string array.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The DataFrame with each object column whose non-missing values are
+        all strings converted to the string dtype (so its missing values
+        become pandas.NA); other columns are unchanged. If no columns need
+        converting, the input itself is returned.
+
+    Raises
+    ------
+    ValueError
+        If string_storage is not recognized.
+    ImportError
+        If string_storage is "pyarrow" and pyarrow is not installed.
+    """
+    if string_storage not in STRING_STORAGE_OPTIONS:
+        raise ValueError(f"Unrecognized string storage '{string_storage}'; "
+                         f"must be one of {STRING_STORAGE_OPTIONS}")
+    string_dtype = pandas.StringDtype(string_storage)
+
+    str_cols = [
+        x for x in a_df.columns
+        if a_df[x].dtype == object and
+        pandas.api.types.infer_dtype(a_df[x], skipna=True) == "string"]
+    if not str_cols:
+        return a_df
+
+    return a_df.astype({x: string_dtype for x in str_cols})
+
+
 def validate_required_columns_exist(
         input_df: pandas.DataFrame, required_cols_list: List[str],
         error_msg: str) -> None:
@@ -290,15 +643,405 @@ def update_metadata_df_field(
 
     # If source fields were passed in, the field_val_or_func must be a function
     if source_fields:
-        metadata_df.loc[row_mask, field_name] = \
-            metadata_df.apply(
-                lambda row: field_val_or_func(row, source_fields),
-                axis=1)
+        field_vals = metadata_df.apply(
+            lambda row: field_val_or_func(row, source_fields), axis=1)
+        _upcast_string_field_for_vals(metadata_df, field_name, field_vals)
     else:
         # Otherwise, it is a constant value
-        metadata_df.loc[row_mask, field_name] = field_val_or_func
+        field_vals = field_val_or_func
+        _upcast_string_field_for_vals(
+            metadata_df, field_name, [field_val_or_func])
     # endif using a function/a constant value
 
+    if field_name in metadata_df.columns:
+        # set the values in a copy of the field and swap that in, rather than
+        # writing into the field's array, which may be shared with another
+        # DataFrame (e.g., one metadata_df is a shallow copy of)
+        field_col = metadata_df[field_name].copy()
+        field_col.loc[row_mask] = field_vals
+        metadata_df[field_name] = field_col
+    else:
+        metadata_df.loc[row_mask, field_name] = field_vals
+
+
+def _upcast_string_field_for_vals(
+        metadata_df: pandas.DataFrame, field_name: str,
+        field_vals: Iterable[Any]) -> None:
+    """Convert a string-dtype field to object if it is about to get non-string values.
+
+    A field held as pandas' string dtype (see convert_str_cols_to_string_dtype)
+    can't take, e.g., a numeric default, so it is turned back into an object
+    field first, as it would have been without the string dtype.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        DataFrame holding the field. Modified in place.
+    field_name : str
+        Name of the field; nothing is done if it is not in the metadata or
+        is not of the string dtype.
+    field_vals : Iterable[Any]
+        The values about to be set in the field.
+    """
+    if field_name not in metadata_df.columns or \
+            not isinstance(metadata_df[field_name].dtype, pandas.StringDtype):
+        return
+    if pandas.api.types.infer_dtype(field_vals, skipna=True) in \
+            ["string", "empty"]:
+        return
+    metadata_df[field_name] = _string_col_to_object_col(
+        metadata_df[field_name])
+
+
+def _string_col_to_object_col(a_col: pandas.Series) -> pandas.Series:
+    """Convert a string-dtype column to an object column holding NaNs for missing values.
+
+    Parameters
+    ----------
+    a_col : pandas.Series
+        Column of pandas' string dtype.
+
+    Returns
+    -------
+    pandas.Series
+        The column as an object column, with NaN (rather than pandas.NA)
+        for missing values, as it would have been without the string dtype.
+    """
+    return a_col.astype(object).where(a_col.notna(), np.nan)
+
+
+def update_metadata_df_fields(
+        metadata_df: pandas.DataFrame,
+        field_vals_dict: Dict[str, Any],
+        overwrite_non_nans: bool = True,
+        copy: bool = True) -> pandas.DataFrame:
+    """Update or add many constant-valued fields in a metadata DataFrame at once.
+
+    Equivalent to calling update_metadata_df_field for each field in turn,
+    except that all fields not already in the metadata are built as one
+    block and attached with a single concat rather than inserted one at a
+    time.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        DataFrame to update. Not modified unless copy is False.
+    field_vals_dict : Dict[str, Any]
+        Dictionary of field name to the constant value to set for that field;
+        fields not already in the metadata are added in this order.
+    overwrite_non_nans : bool
+        If True, overwrites all values in existing fields. If False, only
+        updates NaN values in existing fields.
+    copy : bool
+        If True, the input DataFrame is left unmodified. If False, fields
+        already in the metadata are updated in place and the input itself is
+        returned if there are no new fields to add.
+
+    Returns
+    -------
+    pandas.DataFrame
+        An updated copy of the metadata DataFrame.
+    """
+    existing_fields = [x for x in field_vals_dict if x in metadata_df.columns]
+    new_fields = [x for x in field_vals_dict if x not in metadata_df.columns]
+
+    output_df = metadata_df.copy() if existing_fields and copy \
+        else metadata_df
+    for curr_field_name in existing_fields:
+        update_metadata_df_field(
+            output_df, curr_field_name, field_vals_dict[curr_field_name],
+            overwrite_non_nans=overwrite_non_nans)
+    # next existing field
+
+    if new_fields:
+        new_fields_df = pandas.DataFrame({
+            x: _make_constant_array(len(output_df.index), field_vals_dict[x])
+            for x in new_fields}, index=output_df.index, copy=False)
+        output_df = pandas.concat([output_df, new_fields_df], axis=1)
+    elif not existing_fields and copy:
+        output_df = metadata_df.copy()
+    # endif there are new fields
+
+    return output_df
+
+
+def fill_nas_with_constant(
+        metadata_df: pandas.DataFrame,
+        fill_val: Any,
+        skip_cols: Optional[List[str]] = None) -> pandas.DataFrame:
+    """Fill the NaNs of a metadata DataFrame with a constant value.
+
+    Gives the same result as metadata_df.fillna(fill_val), but object
+    columns are filled with references to the one value rather than (as
+    pandas does for strings) a new string object per filled cell, so
+    filling many mostly-empty columns doesn't multiply their memory.
+
+    Parameters
+    ----------
+    metadata_df : pandas.DataFrame
+        DataFrame to fill. Not modified.
+    fill_val : Any
+        The value to fill NaNs with.
+    skip_cols : Optional[List[str]], default=None
+        Names of columns to leave unfilled.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The filled DataFrame; columns without NaNs share memory with the
+        input.
+    """
+    if skip_cols is None:
+        skip_cols = []
+
+    filled_cols = {}
+    for curr_col in metadata_df.columns:
+        if curr_col in skip_cols:
+            continue
+        curr_series = metadata_df[curr_col]
+        nan_mask = curr_series.isna().to_numpy()
+        if not nan_mask.any():
+            continue
+        # a string-dtype column can't hold a non-string fill value
+        if isinstance(curr_series.dtype, pandas.StringDtype) and \
+                not isinstance(fill_val, str):
+            curr_series = _string_col_to_object_col(curr_series)
+
+        if curr_series.dtype == object:
+            curr_values = curr_series.to_numpy(copy=True)
+            curr_values[nan_mask] = fill_val
+            filled_cols[curr_col] = pandas.Series(
+                curr_values, index=metadata_df.index, name=curr_col,
+                dtype=object)
+        else:
+            filled_cols[curr_col] = curr_series.fillna(fill_val)
+    # next column
+
+    if not filled_cols:
+        return metadata_df
+    output_df = metadata_df.copy(deep=False)
+    for curr_col, curr_series in filled_cols.items():
+        output_df[curr_col] = curr_series
+    return output_df
+
+
+class StageTimer:
+    """Times the stages of a pipeline, reporting an event for each to a callback.
+
+    Each event is a dictionary of the stage's name (STAGE_NAME_KEY), any
+    extra details given for the stage, the number of rows going into and
+    coming out of it (STAGE_ROWS_IN_KEY, STAGE_ROWS_OUT_KEY), its duration
+    in seconds (STAGE_SECONDS_KEY) and the peak number of bytes allocated
+    during it (STAGE_BYTES_KEY).  Allocations are only measured while
+    tracemalloc is tracing (e.g., when python is run with
+    PYTHONTRACEMALLOC=1), since tracing slows everything down; otherwise
+    the bytes allocated are None.  Stages should not be nested, since
+    timing a stage resets tracemalloc's peak.
+
+    Parameters
+    ----------
+    callback : Optional[Callable[[Dict[str, Any]], None]]
+        Function called with the event for each stage as the stage ends.
+        If None, nothing is timed or reported.
+    """
+
+    def __init__(
+            self, callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.callback = callback
+
+    @contextmanager
+    def time_stage(self, stage_name: str, rows_in: int,
+                   **details: Any) -> Iterator[Dict[str, Any]]:
+        """Time a stage of the pipeline.
+
+        Parameters
+        ----------
+        stage_name : str
+            Name of the stage.
+        rows_in : int
+            Number of rows going into the stage.
+        **details : Any
+            Extra details of the stage to include in its event.
+
+        Yields
+        ------
+        Dict[str, Any]
+            The stage's event. If the number of rows coming out of the stage
+            differs from the number going in, set STAGE_ROWS_OUT_KEY in it.
+            The event is only reported if the stage ends without error.
+        """
+        event = {STAGE_NAME_KEY: stage_name, **details,
+                 STAGE_ROWS_IN_KEY: rows_in, STAGE_ROWS_OUT_KEY: rows_in}
+        if self.callback is None:
+            yield event
+            return
+
+        is_tracing = tracemalloc.is_tracing()
+        if is_tracing:
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        yield event
+
+        event[STAGE_SECONDS_KEY] = time.perf_counter() - start_time
+        event[STAGE_BYTES_KEY] = None
+        if is_tracing:
+            event[STAGE_BYTES_KEY] = \
+                max(tracemalloc.get_traced_memory()[1] - start_bytes, 0)
+        self.report(event)
+
+    def report(self, event: Dict[str, Any]) -> None:
+        """Report an already-timed event (e.g., from a worker process).
+
+        Parameters
+        ----------
+        event : Dict[str, Any]
+            The event to report.
+        """
+        if self.callback is not None:
+            self.callback(event)
+
+
+def _make_constant_array(num_rows: int, field_val: Any) -> np.ndarray:
+    """Make the values of a new constant field.
+
+    Parameters
+    ----------
+    num_rows : int
+        Number of rows in the field.
+    field_val : Any
+        The constant value of the field.
+
+    Returns
+    -------
+    np.ndarray
+        Array of num_rows copies of the value, with the dtype given by
+        _get_new_field_dtype. Object arrays hold references to the one
+        value rather than (as np.full makes for strings) a new string
+        object per row.
+    """
+    new_array = np.empty(num_rows, dtype=_get_new_field_dtype(field_val))
+    new_array.fill(field_val)
+    return new_array
+
+
+def _get_new_field_dtype(field_val: Any) -> type:
+    """Get the dtype update_metadata_df_field gives a new constant field.
+
+    Parameters
+    ----------
+    field_val : Any
+        The constant value of the new field.
+
+    Returns
+    -------
+    type
+        float for non-boolean numbers, object for everything else; a new
+        field starts out as all-NaN, so setting it to an int widens the int
+        to a float and setting it to a bool (or a string) makes it object.
+    """
+    if isinstance(field_val, numbers.Real) and \
+            not isinstance(field_val, (bool, np.bool_)):
+        return float
+    return object
+
+
+def _canonicalize_obj(an_obj: Any) -> Any:
+    """Convert an object into a hashable form that keeps dict ordering.
+
+    Parameters
+    ----------
+    an_obj : Any
+        Object to convert.
+
+    Returns
+    -------
+    Any
+        Nested tuples representing the object; dictionary items are kept
+        in insertion order.
+    """
+    if isinstance(an_obj, dict):
+        return ("dict", tuple(
+            (repr(k), _canonicalize_obj(v)) for k, v in an_obj.items()))
+    elif isinstance(an_obj, (list, tuple)):
+        return (type(an_obj).__name__,
+                tuple(_canonicalize_obj(x) for x in an_obj))
+    elif isinstance(an_obj, (set, frozenset)):
+        return ("set", tuple(sorted(repr(x) for x in an_obj)))
+    return an_obj
+
+
+def _hash_yaml_contents(yaml_contents: bytes) -> str:
+    """Get the cache key for the contents of a YAML file.
+
+    Parameters
+    ----------
+    yaml_contents : bytes
+        Raw contents of the YAML file.
+
+    Returns
+    -------
+    str
+        Hex digest of the contents, the qiimp version, and the cache format.
+    """
+    # import here rather than at module level, since the qiimp package
+    # imports this module while it is being initialized
+    from qiimp import __version__
+
+    hasher = hashlib.sha256(yaml_contents)
+    hasher.update(f"|{__version__}|{_CACHE_FORMAT_VERSION}".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def _write_cache_file(obj_to_cache: object, cache_fp: str) -> None:
+    """Pickle an object to a cache file, logging (not raising) any errors.
+
+    Parameters
+    ----------
+    obj_to_cache : object
+        Object to pickle.
+    cache_fp : str
+        Path of the cache file to write.
+    """
+    # write to a temporary file and then move it into place so that
+    # concurrent runs never see a partially-written cache file
+    temp_fp = f"{cache_fp}.{os.getpid()}.tmp"
+    # noinspection PyBroadException
+    try:
+        os.makedirs(os.path.dirname(cache_fp), exist_ok=True)
+        with open(temp_fp, "wb") as f:
+            pickle.dump(obj_to_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_fp, cache_fp)
+    except Exception as e:  # noqa: E722
+        logger.warning(f"Unable to write cache file {cache_fp}: {e}")
+        if os.path.exists(temp_fp):
+            os.remove(temp_fp)
+
+
+def _prune_cache_dir(
+        cache_dir: str, max_cache_files: Optional[int] = None) -> None:
+    """Delete the least recently used cache files beyond the maximum number.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding the cache files.
+    max_cache_files : Optional[int], default=None
+        Number of cache files to keep. If None, uses MAX_CACHE_FILES.
+    """
+    if max_cache_files is None:
+        max_cache_files = MAX_CACHE_FILES
+
+    # noinspection PyBroadException
+    try:
+        cache_fps = [os.path.join(cache_dir, x) for x in os.listdir(cache_dir)
+                     if x.endswith(".pkl")]
+        cache_fps.sort(key=os.path.getmtime, reverse=True)
+        for curr_fp in cache_fps[max_cache_files:]:
+            os.remove(curr_fp)
+    except Exception as e:  # noqa: E722
+        logger.warning(f"Unable to prune cache directory {cache_dir}: {e}")
+
 
 def _get_grandparent_dir(starting_fp: Optional[str] = None) -> str:
     """Get the grandparent directory of a given file path.
@@ -2,11 +2,14 @@ from unittest import TestCase
 from qiimp.src.util import \
     HOST_TYPE_SPECIFIC_METADATA_KEY, METADATA_FIELDS_KEY, \
     SAMPLE_TYPE_SPECIFIC_METADATA_KEY, DEFAULT_KEY, \
-    ALIAS_KEY, BASE_TYPE_KEY
+    ALIAS_KEY, BASE_TYPE_KEY, LEAVE_REQUIREDS_BLANK_KEY, \
+    OVERWRITE_NON_NANS_KEY, deepcopy_dict
 from qiimp.src.metadata_configurator import \
+    ResolvedSchemaIndex, LazyFlatHostTypesDict, \
     _make_combined_stds_and_study_host_type_dicts, \
     flatten_nested_stds_dict,  \
     _combine_base_and_added_metadata_fields, \
+    _overlay_metadata_fields_dicts, \
     _combine_base_and_added_sample_type_specific_metadata, \
     _id_sample_type_definition
 
@@ -971,6 +974,167 @@ class TestMetadataConfigurator(TestCase):
         }
     }
 
+    FULL_FLAT_CONFIG_DICT = {
+        DEFAULT_KEY: "not provided",
+        LEAVE_REQUIREDS_BLANK_KEY: False,
+        OVERWRITE_NON_NANS_KEY: False,
+        HOST_TYPE_SPECIFIC_METADATA_KEY: {
+            "human": {
+                DEFAULT_KEY: "not collected",
+                METADATA_FIELDS_KEY: {
+                    "country": {
+                        DEFAULT_KEY: "USA",
+                        "required": True,
+                        "type": "string"
+                    },
+                    "geo_loc_name": {
+                        "required": True,
+                        "type": "string"
+                    },
+                    "irb_institute": {
+                        "required": False,
+                        "type": "string"
+                    }
+                },
+                SAMPLE_TYPE_SPECIFIC_METADATA_KEY: {
+                    "fe": {
+                        ALIAS_KEY: "stool"
+                    },
+                    "feces": {
+                        BASE_TYPE_KEY: "stool",
+                        METADATA_FIELDS_KEY: {
+                            "body_site": {
+                                DEFAULT_KEY: "gut",
+                                "type": "string"
+                            }
+                        }
+                    },
+                    "bad_alias": {
+                        ALIAS_KEY: "fe"
+                    },
+                    "stool": {
+                        METADATA_FIELDS_KEY: {
+                            "description": {
+                                "required": True,
+                                "type": "string"
+                            }
+                        }
+                    }
+                }
+            },
+            "control": {
+                METADATA_FIELDS_KEY: {}
+            }
+        }
+    }
+
+    # Tests for ResolvedSchemaIndex
+    def test_ResolvedSchemaIndex_has_types(self):
+        """Test identifying known and unknown host and sample types."""
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+
+        self.assertTrue(index.has_host_type("human"))
+        self.assertFalse(index.has_host_type("mouse"))
+        self.assertTrue(index.has_sample_type("human", "fe"))
+        self.assertFalse(index.has_sample_type("human", "saliva"))
+        # a host type without any sample types has no valid sample types
+        self.assertFalse(index.has_sample_type("control", "fe"))
+
+    def test_ResolvedSchemaIndex_get_host_type_settings_dict(self):
+        """Test that host type settings overlay the global settings."""
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+
+        self.assertDictEqual(
+            {DEFAULT_KEY: "not collected", LEAVE_REQUIREDS_BLANK_KEY: False,
+             OVERWRITE_NON_NANS_KEY: False},
+            index.get_host_type_settings_dict("human"))
+        self.assertDictEqual(
+            {DEFAULT_KEY: "not provided", LEAVE_REQUIREDS_BLANK_KEY: False,
+             OVERWRITE_NON_NANS_KEY: False},
+            index.get_host_type_settings_dict("control"))
+        self.assertEqual("not provided", index.settings_dict[DEFAULT_KEY])
+
+    def test_ResolvedSchemaIndex_get_sample_type_schema_alias(self):
+        """Test resolving an aliased sample type and memoizing the result."""
+        orig_config_dict = deepcopy_dict(self.FULL_FLAT_CONFIG_DICT)
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+
+        obs = index.get_sample_type_schema("human", "fe")
+
+        sample_type_def = {"allowed": ["stool"], DEFAULT_KEY: "stool",
+                           "type": "string"}
+        self.assertDictEqual(
+            {"country": {DEFAULT_KEY: "USA", "required": True,
+                         "type": "string"},
+             "geo_loc_name": {"required": True, "type": "string"},
+             "irb_institute": {"required": False, "type": "string"},
+             "description": {"required": True, "type": "string"},
+             "sample_type": sample_type_def,
+             "qiita_sample_type": sample_type_def},
+            obs.metadata_fields_dict)
+        self.assertDictEqual(
+            {"country": "USA", "sample_type": "stool",
+             "qiita_sample_type": "stool"},
+            obs.default_vals_dict)
+        self.assertEqual(["geo_loc_name", "description"],
+                         obs.required_placeholder_fields)
+        self.assertIs(obs, index.get_sample_type_schema("human", "fe"))
+        # the config the index was built from is not changed
+        self.assertDictEqual(orig_config_dict, self.FULL_FLAT_CONFIG_DICT)
+
+    def test_ResolvedSchemaIndex_get_sample_type_schema_base_type(self):
+        """Test resolving a sample type with a base type without changing the config."""
+        orig_config_dict = deepcopy_dict(self.FULL_FLAT_CONFIG_DICT)
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+
+        obs = index.get_sample_type_schema("human", "feces")
+
+        self.assertEqual("gut", obs.default_vals_dict["body_site"])
+        self.assertEqual("feces", obs.default_vals_dict["sample_type"])
+        self.assertIn("description", obs.required_placeholder_fields)
+        self.assertDictEqual(orig_config_dict, self.FULL_FLAT_CONFIG_DICT)
+
+    def test_ResolvedSchemaIndex_get_sample_type_schema_err_chained_alias(self):
+        """Test that chained aliases raise an error."""
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+
+        with self.assertRaisesRegex(ValueError, "May not chain aliases"):
+            index.get_sample_type_schema("human", "bad_alias")
+
+    def test_ResolvedSchemaIndex_get_reserved_fields(self):
+        """Test getting the fields extension adds for known and unknown host and sample types."""
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+
+        obs = index.get_reserved_fields("human", "fe")
+
+        self.assertEqual(
+            frozenset(["country", "geo_loc_name", "description",
+                       "sample_type", "qiita_sample_type"]),
+            obs)
+        self.assertIs(
+            index.get_sample_type_schema("human", "fe").reserved_fields, obs)
+        self.assertEqual(
+            frozenset(), index.get_reserved_fields("mouse", "fe"))
+        self.assertEqual(
+            frozenset(), index.get_reserved_fields("human", "saliva"))
+
+    def test_ResolvedSchemaIndex_get_schema_fingerprint(self):
+        """Test that schema fingerprints change only with the relevant config."""
+        index = ResolvedSchemaIndex(self.FULL_FLAT_CONFIG_DICT)
+        changed_config_dict = deepcopy_dict(self.FULL_FLAT_CONFIG_DICT)
+        changed_config_dict[HOST_TYPE_SPECIFIC_METADATA_KEY]["human"][
+            SAMPLE_TYPE_SPECIFIC_METADATA_KEY]["feces"][METADATA_FIELDS_KEY][
+            "body_site"][DEFAULT_KEY] = "colon"
+        changed_index = ResolvedSchemaIndex(changed_config_dict)
+
+        self.assertEqual(index.get_schema_fingerprint("human", "fe"),
+                         changed_index.get_schema_fingerprint("human", "fe"))
+        self.assertNotEqual(
+            index.get_schema_fingerprint("human", "feces"),
+            changed_index.get_schema_fingerprint("human", "feces"))
+        self.assertNotEqual(index.get_schema_fingerprint("human", "fe"),
+                            index.get_schema_fingerprint("human", "saliva"))
+
     def test__make_combined_stds_and_study_host_type_dicts(self):
         """Test making a combined standards and study host type dictionary."""
         out_nested_dict = _make_combined_stds_and_study_host_type_dicts(
@@ -1040,6 +1204,83 @@ class TestMetadataConfigurator(TestCase):
         result = _combine_base_and_added_metadata_fields(base_dict, add_dict)
         self.assertDictEqual(expected, result)
 
+    def test_flatten_nested_stds_dict_shares_unchanged(self):
+        """Test that flattening shares, rather than copies, definitions that are not overridden."""
+        input_nested_dict = deepcopy_dict(self.NESTED_STDS_W_STUDY_DICT)
+        out_flattened_dict = flatten_nested_stds_dict(input_nested_dict, None)
+
+        # the flattening does not change its input
+        self.assertDictEqual(self.NESTED_STDS_W_STUDY_DICT, input_nested_dict)
+        # country is never overridden, so human's definition *is* the
+        # parent host's definition
+        parent_fields_dict = \
+            out_flattened_dict["host_associated"][METADATA_FIELDS_KEY]
+        self.assertIs(
+            parent_fields_dict["country"],
+            out_flattened_dict["human"][METADATA_FIELDS_KEY]["country"])
+        # description is overridden, so human's definition is a new dict
+        self.assertIsNot(
+            parent_fields_dict["description"],
+            out_flattened_dict["human"][METADATA_FIELDS_KEY]["description"])
+
+    # Tests for LazyFlatHostTypesDict
+    def test_LazyFlatHostTypesDict(self):
+        """Test that the lazily-flattened host types match the eagerly-flattened ones."""
+        obs = LazyFlatHostTypesDict(self.NESTED_STDS_W_STUDY_DICT)
+
+        exp = self.FLATTENED_STDS_W_STUDY_DICT[HOST_TYPE_SPECIFIC_METADATA_KEY]
+        self.maxDiff = None
+        self.assertEqual(
+            list(flatten_nested_stds_dict(
+                self.NESTED_STDS_W_STUDY_DICT, None).keys()),
+            list(obs.keys()))
+        self.assertEqual(len(exp), len(obs))
+        self.assertDictEqual(exp, dict(obs))
+
+    def test_LazyFlatHostTypesDict_flattens_on_demand(self):
+        """Test that only requested host types and their ancestors are flattened, once."""
+        obs = LazyFlatHostTypesDict(self.NESTED_STDS_W_STUDY_DICT)
+        self.assertIn("human", obs)
+        self.assertNotIn("mouse", obs)
+        self.assertDictEqual({}, obs._flat_dicts_by_path)
+
+        human_dict = obs["human"]
+        self.assertEqual(
+            [("host_associated",), ("host_associated", "human")],
+            list(obs._flat_dicts_by_path.keys()))
+        self.assertIs(human_dict, obs["human"])
+        self.assertDictEqual(
+            self.FLATTENED_STDS_W_STUDY_DICT[
+                HOST_TYPE_SPECIFIC_METADATA_KEY]["human"],
+            human_dict)
+
+    def test__overlay_metadata_fields_dicts(self):
+        """Test overlaying metadata fields without changing either input."""
+        base_dict = {
+            "field1": {"allowed": ["value1"], DEFAULT_KEY: "value1",
+                       "type": "string"},
+            "fieldX": {"allowed": ["valueX"], "type": "string"}
+        }
+        add_dict = {
+            "field1": {"anyof": [{"type": "string"}, {"type": "number"}]},
+            "field2": {"type": "string"}
+        }
+        orig_base_dict = deepcopy_dict(base_dict)
+        orig_add_dict = deepcopy_dict(add_dict)
+
+        expected = {
+            "field1": {DEFAULT_KEY: "value1",
+                       "anyof": [{"type": "string"}, {"type": "number"}]},
+            "fieldX": {"allowed": ["valueX"], "type": "string"},
+            "field2": {"type": "string"}
+        }
+
+        result = _overlay_metadata_fields_dicts(base_dict, add_dict)
+        self.assertDictEqual(expected, result)
+        self.assertDictEqual(orig_base_dict, base_dict)
+        self.assertDictEqual(orig_add_dict, add_dict)
+        self.assertIs(base_dict["fieldX"], result["fieldX"])
+
     def test__combine_base_and_added_sample_type_specific_metadata(self):
         """Test combining base and additional sample type specific metadata."""
         base_dict = {
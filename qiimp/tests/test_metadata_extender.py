@@ -0,0 +1,1198 @@
+import glob
+import importlib.util
+import numpy as np
+import os
+import pandas
+import tempfile
+import tracemalloc
+import yaml
+from pandas.testing import assert_frame_equal
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from qiimp.src.util import HOST_TYPE_SPECIFIC_METADATA_KEY, deepcopy_dict, \
+    METADATA_FIELDS_KEY, SAMPLE_TYPE_SPECIFIC_METADATA_KEY, DEFAULT_KEY, \
+    STUDY_SPECIFIC_METADATA_KEY, LEAVE_REQUIREDS_BLANK_KEY, \
+    OVERWRITE_NON_NANS_KEY, HOSTTYPE_SHORTHAND_KEY, \
+    SAMPLETYPE_SHORTHAND_KEY, SAMPLE_NAME_KEY, QC_NOTE_KEY, \
+    METADATA_TRANSFORMERS_KEY, PRE_TRANSFORMERS_KEY, POST_TRANSFORMERS_KEY, \
+    SOURCES_KEY, FUNCTION_KEY, STAGE_NAME_KEY, STAGE_SECONDS_KEY, \
+    STAGE_ROWS_IN_KEY, STAGE_ROWS_OUT_KEY, CACHE_DIR_ENV_VAR
+import qiimp.src.metadata_extender as metadata_extender
+from qiimp.src.metadata_extender import extend_metadata_df, \
+    clear_config_cache, _resolve_schema_index, \
+    _get_host_and_sample_type_groups, get_qc_failures, \
+    write_extended_metadata, get_reserved_cols, extend_metadata_dfs, \
+    write_extended_metadata_batch, extend_metadata_df_incrementally, \
+    validate_extended_metadata
+
+
+class TestMetadataExtender(TestCase):
+    SOFTWARE_CONFIG_DICT = {
+        DEFAULT_KEY: "not provided",
+        LEAVE_REQUIREDS_BLANK_KEY: False,
+        OVERWRITE_NON_NANS_KEY: False
+    }
+
+    STUDY_CONFIG_DICT = {
+        DEFAULT_KEY: "not provided",
+        STUDY_SPECIFIC_METADATA_KEY: {
+            HOST_TYPE_SPECIFIC_METADATA_KEY: {
+                "human": {
+                    METADATA_FIELDS_KEY: {
+                        "country": {
+                            DEFAULT_KEY: "USA",
+                            "type": "string"
+                        }
+                    },
+                    SAMPLE_TYPE_SPECIFIC_METADATA_KEY: {
+                        "feces": {
+                            METADATA_FIELDS_KEY: {
+                                "description": {
+                                    DEFAULT_KEY: "human poop",
+                                    "type": "string"
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    def setUp(self):
+        clear_config_cache()
+        # keep the tests' cache files out of the user's real cache directory
+        self._cache_dir = tempfile.TemporaryDirectory()
+        self._cache_env_patcher = patch.dict(
+            os.environ, {CACHE_DIR_ENV_VAR: self._cache_dir.name})
+        self._cache_env_patcher.start()
+
+    def tearDown(self):
+        clear_config_cache()
+        self._cache_env_patcher.stop()
+        self._cache_dir.cleanup()
+
+    @staticmethod
+    def _make_raw_df():
+        return pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "saliva", "feces"]
+        })
+
+    # Tests for _resolve_schema_index
+    def test__resolve_schema_index_reuses_cached(self):
+        """Test that equal configs resolve to the same cached schema index."""
+        first = _resolve_schema_index(
+            self.STUDY_CONFIG_DICT, self.SOFTWARE_CONFIG_DICT)
+
+        # an equal (but distinct) study config
+        with patch.object(metadata_extender,
+                          "_build_full_flat_config_dict") as mock_build:
+            second = _resolve_schema_index(
+                deepcopy_dict(self.STUDY_CONFIG_DICT),
+                dict(self.SOFTWARE_CONFIG_DICT))
+        mock_build.assert_not_called()
+        self.assertIs(first, second)
+
+    def test__resolve_schema_index_changed_config(self):
+        """Test that a changed study config is resolved anew."""
+        first = _resolve_schema_index(
+            self.STUDY_CONFIG_DICT, self.SOFTWARE_CONFIG_DICT)
+        second = _resolve_schema_index(
+            self.STUDY_CONFIG_DICT | {DEFAULT_KEY: "missing"},
+            self.SOFTWARE_CONFIG_DICT)
+
+        self.assertIsNot(first, second)
+        self.assertEqual(
+            "not provided", first.full_flat_config_dict[DEFAULT_KEY])
+        self.assertEqual(
+            "missing", second.full_flat_config_dict[DEFAULT_KEY])
+
+    def test__resolve_schema_index_reordered_config(self):
+        """Test that configs differing only in key order are resolved separately."""
+        first = _resolve_schema_index(
+            self.STUDY_CONFIG_DICT, self.SOFTWARE_CONFIG_DICT)
+
+        reordered_study_dict = {
+            STUDY_SPECIFIC_METADATA_KEY:
+                self.STUDY_CONFIG_DICT[STUDY_SPECIFIC_METADATA_KEY],
+            DEFAULT_KEY: "not provided"}
+        second = _resolve_schema_index(
+            reordered_study_dict, self.SOFTWARE_CONFIG_DICT)
+        self.assertIsNot(first, second)
+
+    def test__resolve_schema_index_bounded(self):
+        """Test that the cache never holds more than the maximum number of configs."""
+        with patch.object(metadata_extender, "MAX_CACHED_CONFIGS", 2):
+            for curr_default in ["a", "b", "c"]:
+                _resolve_schema_index(
+                    {DEFAULT_KEY: curr_default}, self.SOFTWARE_CONFIG_DICT)
+            self.assertEqual(
+                2, len(metadata_extender._SCHEMA_INDEX_CACHE))
+
+    def test__resolve_schema_index_no_study_config(self):
+        """Test that resolving without a study config leaves the software config unchanged."""
+        software_config_dict = dict(self.SOFTWARE_CONFIG_DICT)
+        obs = _resolve_schema_index(None, software_config_dict)
+
+        self.assertDictEqual(self.SOFTWARE_CONFIG_DICT, software_config_dict)
+        self.assertTrue(obs.has_host_type("human"))
+
+    # Tests for extend_metadata_df
+    def test_extend_metadata_df_repeated(self):
+        """Test that repeated extensions with a cached config give identical results."""
+        first_df, first_msgs_df = extend_metadata_df(
+            self._make_raw_df(), self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        second_df, second_msgs_df = extend_metadata_df(
+            self._make_raw_df(), self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        assert_frame_equal(first_df, second_df)
+        assert_frame_equal(first_msgs_df, second_msgs_df)
+        self.assertEqual(
+            ["human poop", "not provided", "not provided"],
+            first_df["description"].tolist())
+
+    # Tests for _get_host_and_sample_type_groups
+    def test__get_host_and_sample_type_groups(self):
+        """Test that groups are ordered by first appearance of host type, then sample type."""
+        schema_index = _resolve_schema_index(
+            self.STUDY_CONFIG_DICT, self.SOFTWARE_CONFIG_DICT)
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5", "s6"],
+            HOSTTYPE_SHORTHAND_KEY: [
+                "human", "bogus", "mouse", "human", "bogus", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: [
+                "saliva", "feces", "feces", "feces", "saliva", "saliva"]
+        })
+
+        obs = _get_host_and_sample_type_groups(input_df, schema_index)
+
+        exp = [("human", "saliva", [0, 5]),
+               ("human", "feces", [3]),
+               ("bogus", None, [1, 4]),
+               ("mouse", "feces", [2])]
+        self.assertEqual(
+            exp, [(h, s, list(p)) for h, s, p in obs])
+
+    def test__get_host_and_sample_type_groups_pair_order(self):
+        """Test that sample types are ordered by first appearance within their host type."""
+        schema_index = _resolve_schema_index(
+            self.STUDY_CONFIG_DICT, self.SOFTWARE_CONFIG_DICT)
+        # saliva first appears under mouse, before human feces
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            HOSTTYPE_SHORTHAND_KEY: ["mouse", "human", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["saliva", "feces", "saliva"]
+        })
+
+        obs = _get_host_and_sample_type_groups(input_df, schema_index)
+
+        exp = [("mouse", "saliva", [0]),
+               ("human", "feces", [1]),
+               ("human", "saliva", [2])]
+        self.assertEqual(
+            exp, [(h, s, list(p)) for h, s, p in obs])
+
+    def test_extend_metadata_df_group_order(self):
+        """Test that extended rows are grouped by host type, then sample type."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "bogus", "human", "bogus"],
+            SAMPLETYPE_SHORTHAND_KEY: ["saliva", "feces", "feces", "saliva"]
+        })
+
+        obs_df, _ = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        self.assertEqual(
+            ["s1", "s3", "s2", "s4"], obs_df[SAMPLE_NAME_KEY].tolist())
+        self.assertEqual(
+            ["", "", "invalid host_type", "invalid host_type"],
+            obs_df[QC_NOTE_KEY].tolist())
+
+    def test_extend_metadata_df_categoricals(self):
+        """Test that extending with categoricals gives the same values as without."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "bogus", "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: ["saliva", "feces", "feces", "blood"]
+        })
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            use_categoricals=False)
+        obs_df, obs_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            use_categoricals=True)
+
+        internal_cols = [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY,
+                         QC_NOTE_KEY]
+        for curr_col in internal_cols:
+            self.assertIsInstance(
+                obs_df[curr_col].dtype, pandas.CategoricalDtype)
+        assert_frame_equal(
+            exp_df, obs_df.astype({x: object for x in internal_cols}))
+        assert_frame_equal(exp_msgs_df, obs_msgs_df)
+        self.assertEqual(
+            ["s2", "s4"], get_qc_failures(obs_df)[SAMPLE_NAME_KEY].tolist())
+
+    def test_extend_metadata_df_categoricals_by_size(self):
+        """Test that categoricals are used by default only for large inputs, and not returned."""
+        small_events = []
+        large_events = []
+        with patch.object(metadata_extender, "CATEGORICAL_MIN_ROWS", 3):
+            small_df, _ = extend_metadata_df(
+                self._make_raw_df().iloc[:2], self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                timings_callback=small_events.append)
+            large_df, _ = extend_metadata_df(
+                self._make_raw_df(), self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                timings_callback=large_events.append)
+
+        small_stages = [x[STAGE_NAME_KEY] for x in small_events]
+        large_stages = [x[STAGE_NAME_KEY] for x in large_events]
+        self.assertNotIn(
+            metadata_extender.ENCODE_CATEGORICALS_STAGE, small_stages)
+        self.assertIn(
+            metadata_extender.ENCODE_CATEGORICALS_STAGE, large_stages)
+
+        # the returned dtypes don't depend on the size of the input
+        for curr_col in [HOSTTYPE_SHORTHAND_KEY, SAMPLETYPE_SHORTHAND_KEY,
+                         QC_NOTE_KEY]:
+            self.assertEqual(object, small_df[curr_col].dtype)
+            self.assertEqual(object, large_df[curr_col].dtype)
+        assert_frame_equal(small_df, large_df.iloc[:2])
+
+        # so new notes can be set as usual
+        large_df.loc[0, QC_NOTE_KEY] = "a brand new note"
+        self.assertEqual("a brand new note", large_df.loc[0, QC_NOTE_KEY])
+
+    def test_extend_metadata_df_parallel(self):
+        """Test that extending groups in worker processes gives the same results as serially."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5"],
+            HOSTTYPE_SHORTHAND_KEY: [
+                "human", "mouse", "bogus", "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: [
+                "feces", "feces", "feces", "saliva", "blood"]
+        })
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        obs_df, obs_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT, n_jobs=2)
+
+        assert_frame_equal(exp_df, obs_df)
+        assert_frame_equal(exp_msgs_df, obs_msgs_df)
+
+    def test_extend_metadata_df_peak_memory(self):
+        """Test that the memory extension allocates at its peak stays under twice the input's size."""
+        num_rows = 5000
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: [f"s{x}" for x in range(num_rows)],
+            HOSTTYPE_SHORTHAND_KEY: ["human"] * num_rows,
+            SAMPLETYPE_SHORTHAND_KEY: ["feces"] * num_rows,
+            "notes": [f"{x}" + "x" * 500 for x in range(num_rows)]
+        })
+        input_size = input_df.memory_usage(deep=True).sum()
+        # resolve the config first so its (cached) memory isn't counted
+        extend_metadata_df(
+            input_df.iloc[:1], self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        for curr_copy in [True, False]:
+            tracemalloc.start()
+            try:
+                start_size = tracemalloc.get_traced_memory()[0]
+                extend_metadata_df(
+                    input_df, self.STUDY_CONFIG_DICT,
+                    software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                    copy=curr_copy, validation_engine="vectorized")
+                peak_size = tracemalloc.get_traced_memory()[1] - start_size
+            finally:
+                tracemalloc.stop()
+
+            self.assertLess(peak_size, 2 * input_size)
+        # next copy setting
+
+    def test_extend_metadata_df_no_copy(self):
+        """Test that extending without a copy gives the same results and leaves the input untouched."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", None, "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: ["saliva", "feces", None, "feces"]
+        })
+        orig_input_df = input_df.copy()
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        obs_df, obs_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT, copy=False)
+
+        assert_frame_equal(exp_df, obs_df)
+        assert_frame_equal(exp_msgs_df, obs_msgs_df)
+        assert_frame_equal(orig_input_df, input_df)
+
+    @skipIf(int(pandas.__version__.split(".")[0]) >= 3,
+            "copy-on-write is always on from pandas 3")
+    def test_extend_metadata_df_no_copy_transformer(self):
+        """Test that extending without a copy leaves the input and pandas' copy-on-write option untouched."""
+        study_config_dict = deepcopy_dict(self.STUDY_CONFIG_DICT)
+        study_config_dict[METADATA_TRANSFORMERS_KEY] = {
+            PRE_TRANSFORMERS_KEY: {
+                "notes": {SOURCES_KEY: [SAMPLE_NAME_KEY],
+                          FUNCTION_KEY: "note_cow_mode"}}}
+        cow_modes = []
+
+        def _note_cow_mode(row, source_fields):
+            cow_modes.append(pandas.get_option("mode.copy_on_write"))
+            return f"{row[source_fields[0]]} note"
+
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "feces"],
+            "notes": ["kept", np.nan, np.nan]
+        })
+        orig_input_df = input_df.copy()
+        orig_cow_mode = pandas.get_option("mode.copy_on_write")
+
+        obs_df, _ = extend_metadata_df(
+            input_df, study_config_dict,
+            study_specific_transformers_dict={
+                "note_cow_mode": _note_cow_mode},
+            software_config_dict=self.SOFTWARE_CONFIG_DICT, copy=False)
+
+        self.assertEqual(
+            ["kept", "s2 note", "s3 note"], obs_df["notes"].tolist())
+        assert_frame_equal(orig_input_df, input_df)
+        self.assertEqual([orig_cow_mode] * 3, cow_modes)
+
+    def test_extend_metadata_df_string_storage(self):
+        """Test that extending with string dtype columns gives the same values as with object columns."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "bogus", "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "saliva", "feces"],
+            "description": [np.nan, "d2", np.nan, "d4"]
+        })
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        obs_df, obs_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            string_storage="python")
+
+        # every column but taxon_id (which mixes numbers and strings) holds
+        # only strings
+        string_dtype = pandas.StringDtype("python")
+        self.assertEqual(
+            ["taxon_id"],
+            [x for x in obs_df.columns if obs_df[x].dtype != string_dtype])
+        assert_frame_equal(exp_df, obs_df.astype(object))
+        assert_frame_equal(exp_msgs_df, obs_msgs_df)
+        self.assertEqual(
+            ["s2"], get_qc_failures(obs_df)[SAMPLE_NAME_KEY].tolist())
+
+    def test_extend_metadata_df_string_storage_numeric_default(self):
+        """Test that a raw string column can be given a numeric default."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "feces"],
+            # the standards give taxon_id a numeric default for human feces
+            "taxon_id": ["408170", np.nan, "408170"]
+        })
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        storage_options = ["python"]
+        if importlib.util.find_spec("pyarrow") is not None:
+            storage_options.append("pyarrow")
+        for curr_storage in storage_options:
+            obs_df, obs_msgs_df = extend_metadata_df(
+                input_df, self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                string_storage=curr_storage)
+
+            # the column now mixes numbers and strings, so is an object column
+            self.assertEqual(object, obs_df["taxon_id"].dtype)
+            string_cols = [x for x in obs_df.columns
+                           if obs_df[x].dtype != object]
+            assert_frame_equal(
+                exp_df, obs_df.astype({x: object for x in string_cols}))
+            assert_frame_equal(exp_msgs_df, obs_msgs_df)
+        # next string storage
+
+    @skipIf(importlib.util.find_spec("pyarrow") is None,
+            "pyarrow not installed")
+    def test_extend_metadata_df_string_storage_pyarrow(self):
+        """Test extending with pyarrow-backed string dtype columns."""
+        exp_df, exp_msgs_df = extend_metadata_df(
+            self._make_raw_df(), self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        obs_df, obs_msgs_df = extend_metadata_df(
+            self._make_raw_df(), self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            string_storage="pyarrow")
+
+        string_dtype = pandas.StringDtype("pyarrow")
+        string_cols = [x for x in obs_df.columns
+                       if obs_df[x].dtype == string_dtype]
+        self.assertIn(SAMPLE_NAME_KEY, string_cols)
+        assert_frame_equal(
+            exp_df, obs_df.astype({x: object for x in string_cols}))
+        assert_frame_equal(exp_msgs_df, obs_msgs_df)
+
+    @skipIf(importlib.util.find_spec("polars") is None,
+            "polars not installed")
+    def test_extend_metadata_df_polars_backend(self):
+        """Test that the polars backend gives exactly the pandas backend's output."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5", "s6"],
+            HOSTTYPE_SHORTHAND_KEY:
+                ["human", "bogus", "human", np.nan, "mouse", "human"],
+            SAMPLETYPE_SHORTHAND_KEY:
+                ["feces", "feces", "saliva", "feces", "feces", "nope"],
+            "sex": ["F", "M", np.nan, "female", "f", "M"],
+            "age": [1, 5, 40, 20, 3, 1],
+            "weight": [np.nan, 2.5, 3.0, np.nan, 1.0, np.nan],
+            "is_ok": [True, False, True, True, False, True],
+            "mixed": [1, "a", np.nan, "b", 2.5, np.nan],
+            "description": [np.nan, "d2", np.nan, "d4", np.nan, "d6"]
+        })
+
+        for curr_overwrite in [False, True]:
+            study_config_dict = deepcopy_dict(self.STUDY_CONFIG_DICT)
+            study_config_dict[OVERWRITE_NON_NANS_KEY] = curr_overwrite
+            study_config_dict[METADATA_TRANSFORMERS_KEY] = {
+                PRE_TRANSFORMERS_KEY: {
+                    "sex": {SOURCES_KEY: ["sex"],
+                            FUNCTION_KEY: "transform_input_sex_to_std_sex"},
+                    "weight": {SOURCES_KEY: ["age"],
+                               FUNCTION_KEY: "pass_through"}},
+                POST_TRANSFORMERS_KEY: {
+                    "life_stage": {
+                        SOURCES_KEY: ["age"],
+                        FUNCTION_KEY: "transform_age_to_life_stage"}}}
+            human_fields_dict = study_config_dict[STUDY_SPECIFIC_METADATA_KEY][
+                HOST_TYPE_SPECIFIC_METADATA_KEY]["human"][METADATA_FIELDS_KEY]
+            human_fields_dict["mixed"] = {DEFAULT_KEY: 7, "type": "string"}
+            human_fields_dict["count"] = {DEFAULT_KEY: 3, "type": "integer"}
+
+            exp_df, exp_msgs_df = extend_metadata_df(
+                input_df, study_config_dict,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT)
+            obs_df, obs_msgs_df = extend_metadata_df(
+                input_df, study_config_dict,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                backend="polars")
+
+            assert_frame_equal(exp_df, obs_df)
+            assert_frame_equal(exp_msgs_df, obs_msgs_df)
+        # next overwrite setting
+
+        # the polars backend times the same stages
+        exp_events = []
+        obs_events = []
+        extend_metadata_df(
+            input_df, study_config_dict,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            timings_callback=exp_events.append)
+        extend_metadata_df(
+            input_df, study_config_dict,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            backend="polars", timings_callback=obs_events.append)
+        self.assertEqual(
+            [(x[STAGE_NAME_KEY], x[STAGE_ROWS_IN_KEY]) for x in exp_events],
+            [(x[STAGE_NAME_KEY], x[STAGE_ROWS_IN_KEY]) for x in obs_events])
+
+    def test_extend_metadata_df_timings(self):
+        """Test that each stage of the extension is reported to the timings callback."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "bogus", "human", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "saliva", "feces"]
+        })
+
+        events = []
+        extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT,
+            timings_callback=events.append)
+
+        exp = [("initialize", None, None, 4),
+               ("pre_transform", None, None, 4),
+               ("generate_group", "human", "feces", 2),
+               ("validate_group", "human", "feces", 2),
+               ("generate_group", "human", "saliva", 1),
+               ("validate_group", "human", "saliva", 1),
+               ("generate_group", "bogus", None, 1),
+               ("combine_groups", None, None, 4),
+               ("post_transform", None, None, 4),
+               ("reorder", None, None, 4)]
+        self.assertEqual(
+            exp, [(x[STAGE_NAME_KEY], x.get("host_type"), x.get("sample_type"),
+                   x[STAGE_ROWS_IN_KEY]) for x in events])
+        for curr_event in events:
+            self.assertEqual(
+                curr_event[STAGE_ROWS_IN_KEY], curr_event[STAGE_ROWS_OUT_KEY])
+            self.assertGreaterEqual(curr_event[STAGE_SECONDS_KEY], 0)
+
+        # groups extended in worker processes are reported the same way
+        parallel_events = []
+        extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT, n_jobs=2,
+            timings_callback=parallel_events.append)
+        self.assertEqual(
+            [x[STAGE_NAME_KEY] for x in events],
+            [x[STAGE_NAME_KEY] for x in parallel_events])
+
+    def test_extend_metadata_df_validation_engine(self):
+        """Test that the vectorized validation engine gives the cerberus engine's messages."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5"],
+            HOSTTYPE_SHORTHAND_KEY:
+                ["human", "human", "human", "bogus", "human"],
+            SAMPLETYPE_SHORTHAND_KEY:
+                ["feces", "saliva", "feces", "feces", "feces"],
+            "sex": ["female", "bogus", np.nan, "male", ""],
+            "collection_date": ["2020-01-01", "3020-01-01", "not a date",
+                                np.nan, "2021"]
+        })
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        self.assertFalse(exp_msgs_df.empty)
+        for curr_n_jobs in [1, 2]:
+            obs_df, obs_msgs_df = extend_metadata_df(
+                input_df, self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                n_jobs=curr_n_jobs, validation_engine="vectorized")
+
+            assert_frame_equal(exp_df, obs_df)
+            assert_frame_equal(exp_msgs_df, obs_msgs_df)
+        # next n_jobs
+
+        with self.assertRaisesRegex(
+                ValueError, "Unrecognized validation engine 'fast'"):
+            extend_metadata_df(
+                input_df, self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                validation_engine="fast")
+
+    def test_extend_metadata_df_max_errors(self):
+        """Test that each group's validation stops once its error budget is used up."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5"],
+            HOSTTYPE_SHORTHAND_KEY:
+                ["human", "human", "human", "bogus", "human"],
+            SAMPLETYPE_SHORTHAND_KEY:
+                ["feces", "saliva", "feces", "feces", "feces"],
+            "sex": ["female", "bogus", np.nan, "male", ""],
+            "collection_date": ["2020-01-01", "3020-01-01", "not a date",
+                                np.nan, "2021"]
+        })
+        all_df, all_msgs_df = extend_metadata_df(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        for curr_n_jobs in [1, 2]:
+            obs_df, obs_msgs_df = extend_metadata_df(
+                input_df, self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                n_jobs=curr_n_jobs, max_errors=1)
+
+            # the extended metadata is unaffected
+            assert_frame_equal(all_df, obs_df)
+            # each group (human feces and human saliva) keeps its first error
+            # and records where its validation stopped
+            assert_frame_equal(
+                all_msgs_df[[SAMPLE_NAME_KEY, "field_name"]],
+                obs_msgs_df[[SAMPLE_NAME_KEY, "field_name"]])
+            self.assertEqual(
+                [all_msgs_df["error_message"][0],
+                 ["more than 1 validation errors; validation stopped here"],
+                 all_msgs_df["error_message"][2],
+                 ["more than 1 validation errors; validation stopped here"]],
+                obs_msgs_df["error_message"].tolist())
+        # next n_jobs
+
+    def test_extend_metadata_df_backend_errors(self):
+        """Test errors for an unknown backend and for unsupported polars options."""
+        with self.assertRaisesRegex(
+                ValueError, "Unrecognized extension backend 'spark'"):
+            extend_metadata_df(
+                self._make_raw_df(), self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                backend="spark")
+
+        with self.assertRaisesRegex(ValueError, "n_jobs"):
+            extend_metadata_df(
+                self._make_raw_df(), self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                backend="polars", n_jobs=2)
+
+        with self.assertRaisesRegex(ValueError, "categoricals"):
+            extend_metadata_df(
+                self._make_raw_df(), self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT,
+                backend="polars", use_categoricals=True)
+
+    # Tests for extend_metadata_dfs
+    def test_extend_metadata_dfs(self):
+        """Test extending many DataFrames with one resolved config."""
+        input_dfs = {"first": self._make_raw_df(),
+                     "second": self._make_raw_df().iloc[[1]].assign(
+                         **{HOSTTYPE_SHORTHAND_KEY: "bogus"})}
+        exp = {curr_name: extend_metadata_df(
+                   curr_df, self.STUDY_CONFIG_DICT,
+                   software_config_dict=self.SOFTWARE_CONFIG_DICT)
+               for curr_name, curr_df in input_dfs.items()}
+        clear_config_cache()
+
+        with patch.object(metadata_extender, "_build_full_flat_config_dict",
+                          wraps=metadata_extender._build_full_flat_config_dict
+                          ) as mock_build:
+            obs, obs_summary_df = extend_metadata_dfs(
+                input_dfs, self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        mock_build.assert_called_once()
+
+        self.assertEqual(["first", "second"], list(obs))
+        for curr_name, (exp_df, exp_msgs_df) in exp.items():
+            assert_frame_equal(exp_df, obs[curr_name][0])
+            assert_frame_equal(exp_msgs_df, obs[curr_name][1])
+
+        exp_summary_df = pandas.DataFrame({
+            "input": ["first", "second"],
+            "num_samples": [3, 1],
+            "num_qc_fails": [0, 1],
+            "num_validation_msgs": [0, 0]
+        })
+        assert_frame_equal(exp_summary_df, obs_summary_df)
+
+    def test_extend_metadata_dfs_err_missing_cols(self):
+        """Test that a missing required column in any input raises an error naming it."""
+        input_dfs = {"good": self._make_raw_df(),
+                     "bad": self._make_raw_df().drop(
+                         columns=[SAMPLETYPE_SHORTHAND_KEY])}
+
+        with self.assertRaisesRegex(ValueError, "metadata in bad missing"):
+            extend_metadata_dfs(input_dfs, self.STUDY_CONFIG_DICT)
+
+    # Tests for extend_metadata_df_incrementally
+    def test_extend_metadata_df_incrementally(self):
+        """Test that only changed rows are re-extended and the result matches a full extension."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "mouse", "human", "bogus"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "saliva", "feces"],
+            "description": ["d1", "d2", "d3", "d4"]
+        })
+        first = extend_metadata_df_incrementally(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        # change one row, remove one row, and add one row
+        changed_df = input_df.drop(index=[0]).copy()
+        changed_df.loc[2, "description"] = "new d3"
+        changed_df = pandas.concat([changed_df, pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s5"], HOSTTYPE_SHORTHAND_KEY: ["human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces"]})], ignore_index=True)
+
+        with patch.object(metadata_extender, "_populate_metadata_df",
+                          wraps=metadata_extender._populate_metadata_df
+                          ) as mock_populate:
+            obs = extend_metadata_df_incrementally(
+                changed_df, self.STUDY_CONFIG_DICT, first,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        mock_populate.assert_called_once()
+        self.assertEqual(
+            ["s3", "s5"],
+            mock_populate.call_args.args[0][SAMPLE_NAME_KEY].tolist())
+
+        exp_df, exp_msgs_df = extend_metadata_df(
+            changed_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        assert_frame_equal(exp_df, obs.metadata_df)
+        assert_frame_equal(exp_msgs_df, obs.validation_msgs_df)
+        self.assertEqual(["s2", "s3", "s4", "s5"],
+                         obs.row_fingerprints.index.tolist())
+
+    def test_extend_metadata_df_incrementally_removed_group(self):
+        """Test that removing every row of a host+sample type group also removes its columns."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human", "sterile_water_blank"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "control blank"]
+        })
+        first = extend_metadata_df_incrementally(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        for curr_positions in [[2], [0, 2], [1, 0]]:
+            curr_df = input_df.iloc[curr_positions]
+            with patch.object(metadata_extender, "_populate_metadata_df",
+                              wraps=metadata_extender._populate_metadata_df
+                              ) as mock_populate:
+                obs = extend_metadata_df_incrementally(
+                    curr_df, self.STUDY_CONFIG_DICT, first,
+                    software_config_dict=self.SOFTWARE_CONFIG_DICT)
+            mock_populate.assert_not_called()
+
+            exp_df, exp_msgs_df = extend_metadata_df(
+                curr_df, self.STUDY_CONFIG_DICT,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT)
+            assert_frame_equal(exp_df, obs.metadata_df)
+            assert_frame_equal(exp_msgs_df, obs.validation_msgs_df)
+        # next set of remaining rows
+
+    def test_extend_metadata_df_incrementally_removed_dtype_row(self):
+        """Test that removing the row that made a column object gives the column the dtype of a full extension."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human", "bogus"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "feces"],
+            # an object raw column holding only numbers once s3 is gone
+            "my_count": [1, 2, "many"]
+        })
+        first = extend_metadata_df_incrementally(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        # the unknown host type's default makes taxon_id an object column
+        self.assertEqual(object, first.metadata_df["taxon_id"].dtype)
+
+        curr_df = input_df.iloc[:2]
+        obs = extend_metadata_df_incrementally(
+            curr_df, self.STUDY_CONFIG_DICT, first,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        exp_df, _ = extend_metadata_df(
+            curr_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        self.assertEqual(np.float64, exp_df["taxon_id"].dtype)
+        self.assertEqual(object, exp_df["my_count"].dtype)
+        assert_frame_equal(exp_df, obs.metadata_df)
+
+    def test_extend_metadata_df_incrementally_config_change(self):
+        """Test that rows are re-extended when the config for their host+sample type changes."""
+        input_df = self._make_raw_df()
+        first = extend_metadata_df_incrementally(
+            input_df, self.STUDY_CONFIG_DICT,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        changed_config_dict = deepcopy_dict(self.STUDY_CONFIG_DICT)
+        changed_config_dict[STUDY_SPECIFIC_METADATA_KEY][
+            HOST_TYPE_SPECIFIC_METADATA_KEY]["human"][METADATA_FIELDS_KEY][
+            "country"][DEFAULT_KEY] = "Canada"
+        with patch.object(metadata_extender, "_populate_metadata_df",
+                          wraps=metadata_extender._populate_metadata_df
+                          ) as mock_populate:
+            obs = extend_metadata_df_incrementally(
+                input_df, changed_config_dict, first,
+                software_config_dict=self.SOFTWARE_CONFIG_DICT)
+
+        self.assertEqual(
+            ["s1", "s2"],
+            mock_populate.call_args.args[0][SAMPLE_NAME_KEY].tolist())
+        exp_df, _ = extend_metadata_df(
+            input_df, changed_config_dict,
+            software_config_dict=self.SOFTWARE_CONFIG_DICT)
+        assert_frame_equal(exp_df, obs.metadata_df)
+
+    def test_extend_metadata_df_incrementally_err_duplicate_names(self):
+        """Test that duplicate sample names raise an error."""
+        input_df = self._make_raw_df()
+        input_df[SAMPLE_NAME_KEY] = "s1"
+
+        with self.assertRaisesRegex(ValueError, "duplicate sample names"):
+            extend_metadata_df_incrementally(
+                input_df, self.STUDY_CONFIG_DICT)
+
+    # Tests for get_reserved_cols
+    def test_get_reserved_cols(self):
+        """Test that reserved columns are found from the config without extending the metadata."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human", "bogus", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces", "feces", "bogus"],
+            "my_col": ["a", "b", "c", "d"]
+        })
+        study_config_dict = self.STUDY_CONFIG_DICT | {
+            "metadata_transformers": {
+                "pre_transformers": {
+                    "sex": {"sources": ["gender"],
+                            "function": "transform_input_sex_to_std_sex"}}}}
+
+        exp_df, _ = extend_metadata_df(
+            input_df.iloc[:1].drop(columns="my_col"), self.STUDY_CONFIG_DICT)
+        with patch.object(metadata_extender,
+                          "_populate_metadata_df") as mock_populate:
+            obs = get_reserved_cols(input_df, study_config_dict)
+        mock_populate.assert_not_called()
+
+        # the only reserved cols are those extension adds for the
+        # valid human feces samples, plus the transformer target
+        exp = sorted(set(exp_df.columns) | {"sex"})
+        self.assertEqual(exp, obs)
+        self.assertNotIn("my_col", obs)
+
+    # Tests for write_extended_metadata
+    def test_write_extended_metadata_chunked(self):
+        """Test that streaming the input in chunks writes the same results as loading it whole."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5"],
+            HOSTTYPE_SHORTHAND_KEY: [
+                "human", "mouse", "bogus", "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: [
+                "feces", "feces", "feces", "saliva", "blood"],
+            # with chunks of 2 rows, these mix blanks, integers and text
+            # differently in each chunk than in the whole file
+            "host_age": ["5", "", "7", "ten", "9"],
+            "my_count": ["1", "", "3", "4", "5"]
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fp = os.path.join(temp_dir, "raw.csv")
+            input_df.to_csv(raw_fp, index=False)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+
+            whole_dir = os.path.join(temp_dir, "whole")
+            chunked_dir = os.path.join(temp_dir, "chunked")
+            os.mkdir(whole_dir)
+            os.mkdir(chunked_dir)
+            write_extended_metadata(raw_fp, config_fp, whole_dir, "test")
+            obs = write_extended_metadata(
+                raw_fp, config_fp, chunked_dir, "test", chunk_size=2)
+            self.assertIsNone(obs)
+
+            for curr_suffix, curr_sep in [("test.txt", "\t"),
+                                          ("test_fails.csv", ","),
+                                          ("test_validation_errors.csv", ",")]:
+                exp_fps = glob.glob(os.path.join(whole_dir, f"*_{curr_suffix}"))
+                obs_fps = glob.glob(
+                    os.path.join(chunked_dir, f"*_{curr_suffix}"))
+                self.assertEqual(1, len(obs_fps))
+                self.assertEqual(os.path.getsize(exp_fps[0]) == 0,
+                                 os.path.getsize(obs_fps[0]) == 0)
+                if os.path.getsize(exp_fps[0]) == 0:
+                    continue
+
+                # rows are grouped by host and sample type within each chunk,
+                # so the row order may differ from that of the whole input
+                exp_df = pandas.read_csv(exp_fps[0], sep=curr_sep, dtype=str)
+                obs_df = pandas.read_csv(obs_fps[0], sep=curr_sep, dtype=str)
+                self.assertEqual(
+                    exp_df.columns.tolist(), obs_df.columns.tolist())
+                assert_frame_equal(
+                    exp_df.sort_values(exp_df.columns.tolist(),
+                                       ignore_index=True),
+                    obs_df.sort_values(obs_df.columns.tolist(),
+                                       ignore_index=True))
+            # next output file
+
+    def test_write_extended_metadata_timings(self):
+        """Test that writing reports the rows written to the metadata file."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fp = os.path.join(temp_dir, "raw.csv")
+            self._make_raw_df().assign(
+                **{HOSTTYPE_SHORTHAND_KEY: ["human", "bogus", "mouse"]}
+            ).to_csv(raw_fp, index=False)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+
+            for curr_chunk_size in [None, 2]:
+                events = []
+                write_extended_metadata(
+                    raw_fp, config_fp, temp_dir, "test",
+                    chunk_size=curr_chunk_size,
+                    timings_callback=events.append)
+
+                write_events = \
+                    [x for x in events if x[STAGE_NAME_KEY] == "write"]
+                self.assertEqual(
+                    3, sum(x[STAGE_ROWS_IN_KEY] for x in write_events))
+                # the invalid host type sample is written to the fails file
+                self.assertEqual(
+                    2, sum(x[STAGE_ROWS_OUT_KEY] for x in write_events))
+            # next chunk size
+
+    def test_validate_extended_metadata(self):
+        """Test validating an extended metadata file a chunk at a time."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4", "s5"],
+            HOSTTYPE_SHORTHAND_KEY: [
+                "human", "mouse", "bogus", "human", "mouse"],
+            SAMPLETYPE_SHORTHAND_KEY: [
+                "feces", "feces", "feces", "saliva", "blood"]
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fp = os.path.join(temp_dir, "raw.csv")
+            input_df.to_csv(raw_fp, index=False)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+            write_extended_metadata(
+                raw_fp, config_fp, temp_dir, "test", sep=",",
+                remove_internals=False)
+            extended_fp = glob.glob(os.path.join(temp_dir, "*_test.csv"))[0]
+
+            # the extended metadata as written validates cleanly
+            clean_dir = os.path.join(temp_dir, "clean")
+            os.mkdir(clean_dir)
+            obs = validate_extended_metadata(
+                extended_fp, config_fp, clean_dir, "test")
+            self.assertEqual(0, obs)
+            obs_fps = glob.glob(
+                os.path.join(clean_dir, "*_test_validation_errors.csv"))
+            self.assertEqual(1, len(obs_fps))
+            self.assertEqual(0, os.path.getsize(obs_fps[0]))
+
+            extended_df = pandas.read_csv(
+                extended_fp, dtype=str, keep_default_na=False)
+            extended_df = extended_df.set_index(SAMPLE_NAME_KEY)
+            extended_df.loc["s1", "taxon_id"] = "abc"
+            extended_df.loc["s4", "sex"] = ""
+            extended_df.loc["s2", "host_taxid"] = "10090.5"
+            extended_df.reset_index().to_csv(extended_fp, index=False)
+
+            exp_df = pandas.DataFrame({
+                SAMPLE_NAME_KEY: ["s1", "s4", "s2"],
+                "field_name": ["taxon_id", "sex", "host_taxid"],
+                "error_message": ["['must be of integer type']",
+                                  "['empty values not allowed']",
+                                  "['unallowed value 10090.5']"]})
+            for curr_chunk_size in [1, 100]:
+                curr_dir = os.path.join(temp_dir, str(curr_chunk_size))
+                os.mkdir(curr_dir)
+                obs = validate_extended_metadata(
+                    extended_fp, config_fp, curr_dir, "test",
+                    chunk_size=curr_chunk_size)
+                self.assertEqual(3, obs)
+                obs_fp = glob.glob(os.path.join(
+                    curr_dir, "*_test_validation_errors.csv"))[0]
+                assert_frame_equal(exp_df, pandas.read_csv(obs_fp))
+            # next chunk size
+
+    def test_validate_extended_metadata_err_internals_removed(self):
+        """Test that validating metadata without its internal columns raises an error."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            extended_fp = os.path.join(temp_dir, "extended.txt")
+            pandas.DataFrame({SAMPLE_NAME_KEY: ["s1"]}).to_csv(
+                extended_fp, sep="\t", index=False)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+
+            with self.assertRaisesRegex(ValueError, "internal columns"):
+                validate_extended_metadata(
+                    extended_fp, config_fp, temp_dir, "test")
+
+    def test_validate_extended_metadata_type_overrides(self):
+        """Test validating metadata written without its internal columns by giving its types."""
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2"],
+            HOSTTYPE_SHORTHAND_KEY: ["human", "human"],
+            SAMPLETYPE_SHORTHAND_KEY: ["feces", "feces"]
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fp = os.path.join(temp_dir, "raw.csv")
+            input_df.to_csv(raw_fp, index=False)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+            write_extended_metadata(
+                raw_fp, config_fp, temp_dir, "test", sep=",")
+            extended_fp = glob.glob(os.path.join(temp_dir, "*_test.csv"))[0]
+            extended_df = pandas.read_csv(
+                extended_fp, dtype=str, keep_default_na=False)
+            self.assertNotIn(HOSTTYPE_SHORTHAND_KEY, extended_df.columns)
+            extended_df.loc[1, "taxon_id"] = "abc"
+            extended_df.to_csv(extended_fp, index=False)
+
+            with self.assertRaisesRegex(ValueError, "internal columns"):
+                validate_extended_metadata(
+                    extended_fp, config_fp, temp_dir, "test")
+
+            exp_df = pandas.DataFrame({
+                SAMPLE_NAME_KEY: ["s2"],
+                "field_name": ["taxon_id"],
+                "error_message": ["['must be of integer type']"]})
+            obs = validate_extended_metadata(
+                extended_fp, config_fp, temp_dir, "test",
+                host_type="human", sample_type="feces")
+            self.assertEqual(1, obs)
+            obs_fp = glob.glob(os.path.join(
+                temp_dir, "*_test_validation_errors.csv"))[0]
+            assert_frame_equal(exp_df, pandas.read_csv(obs_fp))
+
+    def test_validate_extended_metadata_err_type_overrides(self):
+        """Test that validating with host or sample types not in the config raises an error."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            extended_fp = os.path.join(temp_dir, "extended.txt")
+            pandas.DataFrame({SAMPLE_NAME_KEY: ["s1"]}).to_csv(
+                extended_fp, sep="\t", index=False)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+
+            with self.assertRaisesRegex(ValueError, "Host type 'bogus'"):
+                validate_extended_metadata(
+                    extended_fp, config_fp, temp_dir, "test",
+                    host_type="bogus", sample_type="feces")
+            with self.assertRaisesRegex(ValueError, "Sample type 'bogus'"):
+                validate_extended_metadata(
+                    extended_fp, config_fp, temp_dir, "test",
+                    host_type="human", sample_type="bogus")
+
+    def test_write_extended_metadata_chunked_excel(self):
+        """Test that streaming an excel input raises a ValueError."""
+        with self.assertRaisesRegex(ValueError, "Chunked input"):
+            write_extended_metadata(
+                "raw.xlsx", "study.yml", ".", "test", chunk_size=2)
+
+    def test_write_extended_metadata_err_chunk_size(self):
+        """Test that a chunk size less than 1 raises a ValueError."""
+        for curr_chunk_size in [0, -1]:
+            with self.assertRaisesRegex(ValueError, "at least 1"):
+                write_extended_metadata(
+                    "raw.csv", "study.yml", ".", "test",
+                    chunk_size=curr_chunk_size)
+        # next chunk size
+
+    def test_write_extended_metadata_batch(self):
+        """Test writing extended metadata for a batch of files."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fps = []
+            for curr_name in ["first", "second"]:
+                curr_fp = os.path.join(temp_dir, f"{curr_name}.csv")
+                self._make_raw_df().to_csv(curr_fp, index=False)
+                raw_fps.append(curr_fp)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+            out_dir = os.path.join(temp_dir, "out")
+            os.mkdir(out_dir)
+
+            obs = write_extended_metadata_batch(raw_fps, config_fp, out_dir)
+
+            self.assertEqual(raw_fps, obs["input"].tolist())
+            self.assertEqual([3, 3], obs["num_samples"].tolist())
+            self.assertEqual([0, 0], obs["num_qc_fails"].tolist())
+            for curr_suffix in ["first.txt", "second.txt", "first_fails.csv",
+                                "batch_summary.csv"]:
+                self.assertEqual(1, len(glob.glob(
+                    os.path.join(out_dir, f"*_{curr_suffix}"))))
+
+    def test_write_extended_metadata_batch_loads_one_at_a_time(self):
+        """Test that a batch checks only file headers up front and then loads each file once."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fps = []
+            for curr_name in ["first", "second"]:
+                curr_fp = os.path.join(temp_dir, f"{curr_name}.csv")
+                self._make_raw_df().to_csv(curr_fp, index=False)
+                raw_fps.append(curr_fp)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+            out_dir = os.path.join(temp_dir, "out")
+            os.mkdir(out_dir)
+
+            load_calls = []
+            real_load = metadata_extender._load_raw_metadata_df
+
+            def _record_load(raw_metadata_fp, string_storage=None,
+                             nrows=None):
+                curr_df = real_load(raw_metadata_fp, string_storage, nrows)
+                load_calls.append((raw_metadata_fp, len(curr_df)))
+                return curr_df
+
+            with patch.object(metadata_extender, "_load_raw_metadata_df",
+                              side_effect=_record_load):
+                write_extended_metadata_batch(raw_fps, config_fp, out_dir)
+
+            exp = [(raw_fps[0], 0), (raw_fps[1], 0),
+                   (raw_fps[0], 3), (raw_fps[1], 3)]
+            self.assertEqual(exp, load_calls)
+
+    def test_write_extended_metadata_batch_transformers(self):
+        """Test that study-specific transformers are used for every file in a batch."""
+        study_config_dict = deepcopy_dict(self.STUDY_CONFIG_DICT)
+        study_config_dict[METADATA_TRANSFORMERS_KEY] = {
+            POST_TRANSFORMERS_KEY: {
+                "shout": {SOURCES_KEY: [SAMPLE_NAME_KEY],
+                          FUNCTION_KEY: "shout_sample_name"}}}
+        transformers_dict = {
+            "shout_sample_name": lambda row, source_fields:
+                row[source_fields[0]].upper()}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fps = []
+            for curr_name in ["first", "second"]:
+                curr_fp = os.path.join(temp_dir, f"{curr_name}.csv")
+                self._make_raw_df().to_csv(curr_fp, index=False)
+                raw_fps.append(curr_fp)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(study_config_dict, f)
+
+            write_extended_metadata_batch(
+                raw_fps, config_fp, temp_dir,
+                study_specific_transformers_dict=transformers_dict)
+
+            for curr_name in ["first", "second"]:
+                out_fp = glob.glob(
+                    os.path.join(temp_dir, f"*_{curr_name}.txt"))[0]
+                out_df = pandas.read_csv(out_fp, sep="\t", dtype=str)
+                self.assertEqual(
+                    ["S1", "S2", "S3"], out_df["shout"].tolist())
+
+    def test_write_extended_metadata_batch_err_missing_cols(self):
+        """Test that a file missing required columns stops the batch before any outputs are written."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_fps = []
+            for curr_name in ["first", "second", "third"]:
+                curr_fp = os.path.join(temp_dir, f"{curr_name}.csv")
+                curr_df = self._make_raw_df()
+                if curr_name == "third":
+                    curr_df = curr_df.drop(columns=[SAMPLETYPE_SHORTHAND_KEY])
+                curr_df.to_csv(curr_fp, index=False)
+                raw_fps.append(curr_fp)
+            config_fp = os.path.join(temp_dir, "study.yml")
+            with open(config_fp, "w") as f:
+                yaml.safe_dump(self.STUDY_CONFIG_DICT, f)
+            out_dir = os.path.join(temp_dir, "out")
+            os.mkdir(out_dir)
+
+            with self.assertRaisesRegex(
+                    ValueError, "third.csv missing required columns"):
+                write_extended_metadata_batch(raw_fps, config_fp, out_dir)
+            self.assertEqual([], os.listdir(out_dir))
+
+    def test_write_extended_metadata_batch_err_duplicate_names(self):
+        """Test that metadata files with the same name raise an error."""
+        with self.assertRaisesRegex(ValueError, "must be unique"):
+            write_extended_metadata_batch(
+                ["a/raw.csv", "b/raw.txt"], "study.yml", ".")
@@ -0,0 +1,446 @@
+from datetime import datetime
+import numpy as np
+import pandas
+from pandas.testing import assert_frame_equal, assert_series_equal
+from unittest import TestCase
+from unittest.mock import patch
+import warnings
+from qiimp.src.util import SAMPLE_NAME_KEY
+import qiimp.src.metadata_validator as metadata_validator
+from qiimp.src.metadata_validator import validate_metadata_df, \
+    _generate_validation_msg_by_column, _make_cerberus_schema, \
+    _get_compiled_schema, clear_schema_cache, _make_validator, \
+    _generate_validation_msg, _generate_validation_msg_by_row, \
+    QiimpValidator, ValueChecker, _cast_col_to_types, _cast_field_to_type, \
+    _get_object_col, convert_numeric_text, CERBERUS_ENGINE, \
+    VECTORIZED_ENGINE
+
+
+class TestMetadataValidator(TestCase):
+    FIELDS_DICT = {
+        SAMPLE_NAME_KEY: {"type": "string", "empty": False, "required": True},
+        "age": {"anyof": [{"type": "number", "min": 0, "max": 120},
+                          {"type": "string", "allowed": ["not provided"]}],
+                "required": True, "units": "years"},
+        "sex": {"type": "string", "allowed": ["female", "male"],
+                "empty": False, "is_phi": True},
+        "code": {"type": "string", "regex": "[A-Z]{2}\\d"},
+        "collection_date": {
+            "anyof": [{"type": "string", "check_with": "date_not_in_future"},
+                      {"type": "string", "allowed": ["not provided"]}]},
+        "host_taxid": {"type": "integer", "default": -1, "min": 1},
+        "project_name": {"type": "string", "required": True}}
+
+    def setUp(self):
+        clear_schema_cache()
+
+    def tearDown(self):
+        clear_schema_cache()
+
+    @staticmethod
+    def _make_metadata_df():
+        return pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            "age": [30, "200", "not provided", "unknown"],
+            "sex": ["female", "", "other", np.nan],
+            "code": ["AB1", "ab1", "AB12", np.nan],
+            "collection_date":
+                ["2020-01-01", "3020-01-01", "not provided", "soon"],
+            "notes": ["a", "b", "c", "d"]})
+
+    def test_validate_metadata_df(self):
+        """Test that both validation engines give cerberus's messages, in row order."""
+        required_msg = {"field_name": "project_name",
+                        "error_message": ["required field"]}
+        default_msg = {"field_name": "host_taxid",
+                       "error_message": ["min value is 1"]}
+        regex_msg = {"field_name": "code",
+                     "error_message":
+                         ["value does not match regex '[A-Z]{2}\\d'"]}
+        exp = [
+            {SAMPLE_NAME_KEY: "s1", **default_msg},
+            {SAMPLE_NAME_KEY: "s1", **required_msg},
+            {SAMPLE_NAME_KEY: "s2", "field_name": "age",
+             "error_message": [
+                 "no definitions validate",
+                 {"anyof definition 0": ["max value is 120"],
+                  "anyof definition 1": ["must be of string type"]}]},
+            {SAMPLE_NAME_KEY: "s2", **regex_msg},
+            {SAMPLE_NAME_KEY: "s2", "field_name": "collection_date",
+             "error_message": [
+                 "no definitions validate",
+                 {"anyof definition 0": ["Date cannot be in the future"],
+                  "anyof definition 1": ["unallowed value 3020-01-01"]}]},
+            {SAMPLE_NAME_KEY: "s2", **default_msg},
+            {SAMPLE_NAME_KEY: "s2", **required_msg},
+            {SAMPLE_NAME_KEY: "s2", "field_name": "sex",
+             "error_message": ["empty values not allowed"]},
+            {SAMPLE_NAME_KEY: "s3", **regex_msg},
+            {SAMPLE_NAME_KEY: "s3", **default_msg},
+            {SAMPLE_NAME_KEY: "s3", **required_msg},
+            {SAMPLE_NAME_KEY: "s3", "field_name": "sex",
+             "error_message": ["unallowed value other"]},
+            {SAMPLE_NAME_KEY: "s4", "field_name": "age",
+             "error_message": [
+                 "no definitions validate",
+                 {"anyof definition 0": ["must be of number type"],
+                  "anyof definition 1": ["unallowed value unknown"]}]},
+            {SAMPLE_NAME_KEY: "s4", **regex_msg},
+            {SAMPLE_NAME_KEY: "s4", "field_name": "collection_date",
+             "error_message": [
+                 "no definitions validate",
+                 {"anyof definition 0": ["Must be a valid date"],
+                  "anyof definition 1": ["unallowed value soon"]}]},
+            {SAMPLE_NAME_KEY: "s4", **default_msg},
+            {SAMPLE_NAME_KEY: "s4", **required_msg},
+            {SAMPLE_NAME_KEY: "s4", "field_name": "sex",
+             "error_message": ["unallowed value nan"]}]
+
+        input_df = self._make_metadata_df()
+        for curr_engine in [CERBERUS_ENGINE, VECTORIZED_ENGINE]:
+            obs = validate_metadata_df(
+                input_df, self.FIELDS_DICT, engine=curr_engine)
+            self.assertEqual(exp, obs)
+        # next engine
+
+        # the input metadata is not modified
+        assert_frame_equal(self._make_metadata_df(), input_df)
+
+    def test_validate_metadata_df_vectorized_fallback(self):
+        """Test that the vectorized engine falls back to cerberus for rules it cannot check."""
+        fields_dict = {
+            SAMPLE_NAME_KEY: {"type": "string"},
+            "sex": {"type": "string", "minlength": 4}}
+        input_df = self._make_metadata_df()
+
+        self.assertIsNone(_generate_validation_msg_by_column(
+            input_df, _make_cerberus_schema(fields_dict)))
+        # NaN is cast to the string "nan"
+        exp = [{SAMPLE_NAME_KEY: "s2", "field_name": "sex",
+                "error_message": ["min length is 4"]},
+               {SAMPLE_NAME_KEY: "s4", "field_name": "sex",
+                "error_message": ["min length is 4"]}]
+        obs = validate_metadata_df(
+            input_df, fields_dict, engine=VECTORIZED_ENGINE)
+        self.assertEqual(exp, obs)
+
+    def test_validate_metadata_df_vectorized_nan_bounds(self):
+        """Test that the vectorized engine checks bounds of NaNs without warnings."""
+        fields_dict = {
+            SAMPLE_NAME_KEY: {"type": "string"},
+            "weight": {"type": "number", "min": 0, "max": 100}}
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3"],
+            "weight": [5.0, np.nan, 150.0]})
+
+        exp = validate_metadata_df(
+            input_df, fields_dict, engine=CERBERUS_ENGINE)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            obs = validate_metadata_df(
+                input_df, fields_dict, engine=VECTORIZED_ENGINE)
+        self.assertEqual(exp, obs)
+        self.assertEqual(["s3"], [x[SAMPLE_NAME_KEY] for x in obs])
+
+    def test_validate_metadata_df_err_engine(self):
+        """Test that an unrecognized validation engine raises an error."""
+        with self.assertRaisesRegex(
+                ValueError, "Unrecognized validation engine 'fast'"):
+            validate_metadata_df(
+                self._make_metadata_df(), self.FIELDS_DICT, engine="fast")
+
+    def test_get_compiled_schema(self):
+        """Test that each distinct fields dict is compiled only once."""
+        compiled_schema = _get_compiled_schema(self.FIELDS_DICT)
+        self.assertEqual(
+            _make_cerberus_schema(self.FIELDS_DICT), compiled_schema.config)
+        self.assertTrue(compiled_schema.validator.allow_unknown)
+
+        # an equal (but distinct) fields dict reuses the compiled schema
+        equal_dict = {k: dict(v) for k, v in self.FIELDS_DICT.items()}
+        self.assertIs(compiled_schema, _get_compiled_schema(equal_dict))
+        self.assertEqual(1, len(metadata_validator._COMPILED_SCHEMA_CACHE))
+
+        other_dict = {SAMPLE_NAME_KEY: {"type": "string"}}
+        self.assertIsNot(compiled_schema, _get_compiled_schema(other_dict))
+        self.assertEqual(2, len(metadata_validator._COMPILED_SCHEMA_CACHE))
+
+        clear_schema_cache()
+        self.assertIsNot(
+            compiled_schema, _get_compiled_schema(self.FIELDS_DICT))
+
+    def test_generate_validation_msg_deduplicated(self):
+        """Test that each distinct set of values is validated once, with the same messages."""
+        fields_dict = {
+            SAMPLE_NAME_KEY: {"type": "string", "regex": "^[a-z0-9]+$"},
+            "sex": {"type": "string", "allowed": ["female", "male"]},
+            "age": {"anyof": [{"type": "integer", "min": 0},
+                              {"type": "float", "max": 0}]}}
+        typed_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s 2", "s3", "s4", "s_5", "s6"],
+            "sex": ["female", "other", "female", "other", "female", "male"],
+            # 1 and 1.0 validate differently, so must not be treated as equal
+            "age": pandas.Series([1, -1, 1.0, -1, 0.0, -0.0], dtype=object),
+            "notes": ["a", "b", "c", "d", "e", "f"]})
+        compiled_schema = _get_compiled_schema(fields_dict)
+
+        exp = _generate_validation_msg_by_row(
+            typed_df, _make_validator(compiled_schema.config))
+        self.assertEqual(
+            [("s 2", SAMPLE_NAME_KEY), ("s 2", "sex"), ("s3", "age"),
+             ("s4", "sex"), ("s_5", SAMPLE_NAME_KEY)],
+            [(x[SAMPLE_NAME_KEY], x["field_name"]) for x in exp])
+
+        with patch.object(QiimpValidator, "validate", autospec=True,
+                          side_effect=QiimpValidator.validate) as mock_validate:
+            obs = _generate_validation_msg(typed_df, compiled_schema)
+        self.assertEqual(exp, obs)
+        # 5 distinct (sex, age) pairs plus 6 sample names
+        self.assertEqual(11, mock_validate.call_count)
+
+    def test_value_checker(self):
+        """Test that a ValueChecker runs each check once per distinct value, at one time."""
+        value_checker = ValueChecker()
+        self.assertIsNone(value_checker.check("date_not_in_future", "2020"))
+        self.assertEqual("Must be a valid date",
+                         value_checker.check("date_not_in_future", 2020))
+
+        with patch.object(metadata_validator.parser, "parse",
+                          wraps=metadata_validator.parser.parse) as mock_parse:
+            for curr_value in ["2020-01-01", "3020-01-01", "2020-01-01",
+                               0.0, -0.0, 0.0]:
+                value_checker.check("date_not_in_future", curr_value)
+            # next value
+        self.assertEqual(
+            ["2020-01-01", "3020-01-01", 0.0, -0.0],
+            [x.args[0] for x in mock_parse.call_args_list])
+
+        # unhashable values are still checked, just not memoized
+        self.assertEqual("Must be a valid date",
+                         value_checker.check("date_not_in_future", [1]))
+
+    def test_validate_metadata_df_memoizes_checks(self):
+        """Test that both engines parse each distinct date once per run."""
+        fields_dict = {
+            SAMPLE_NAME_KEY: {"type": "string"},
+            "collection_date": {"type": "string",
+                                "check_with": "date_not_in_future"},
+            "collection_timestamp": {
+                "anyof": [{"type": "string",
+                           "check_with": "date_not_in_future"},
+                          {"type": "string", "allowed": ["not provided"]}]}}
+        input_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: [f"s{x}" for x in range(6)],
+            "collection_date": ["2020-01-01", "3020-01-01", "soon"] * 2,
+            "collection_timestamp": ["2020-01-01", "3020-01-01", "x",
+                                     "2020-01-01", "not provided", "x"]})
+
+        exp = None
+        for curr_engine in [CERBERUS_ENGINE, VECTORIZED_ENGINE]:
+            clear_schema_cache()
+            with patch.object(
+                    metadata_validator.parser, "parse",
+                    wraps=metadata_validator.parser.parse) as mock_parse:
+                obs = validate_metadata_df(
+                    input_df, fields_dict, engine=curr_engine)
+            self.assertCountEqual(
+                ["2020-01-01", "3020-01-01", "soon", "x", "not provided"],
+                [x.args[0] for x in mock_parse.call_args_list])
+            if exp is None:
+                exp = obs
+            self.assertEqual(exp, obs)
+        # next engine
+        self.assertEqual(
+            ["s1", "s1", "s2", "s2", "s4", "s5", "s5"],
+            [x[SAMPLE_NAME_KEY] for x in exp])
+
+        # the memo does not outlive the run
+        for curr_validator in [
+                _get_compiled_schema(fields_dict).validator,
+                _get_compiled_schema(fields_dict).other_fields_validator]:
+            self.assertIsNone(curr_validator.value_checker)
+
+    def test_validate_metadata_df_n_jobs(self):
+        """Test that validating in worker processes gives the same messages, in row order."""
+        input_df = pandas.concat(
+            [self._make_metadata_df()] * 3, ignore_index=True)
+        input_df[SAMPLE_NAME_KEY] = [f"s{x}" for x in range(len(input_df))]
+
+        for curr_engine in [CERBERUS_ENGINE, VECTORIZED_ENGINE]:
+            exp = validate_metadata_df(
+                input_df, self.FIELDS_DICT, engine=curr_engine)
+            for curr_n_jobs in [2, 0, 100]:
+                obs = validate_metadata_df(
+                    input_df, self.FIELDS_DICT, engine=curr_engine,
+                    n_jobs=curr_n_jobs)
+                self.assertEqual(exp, obs)
+            # next n_jobs
+        # next engine
+
+    def test_value_checker_now(self):
+        """Test that a ValueChecker checks dates against the time it is given."""
+        value_checker = ValueChecker(datetime(2000, 1, 1))
+        self.assertEqual("Date cannot be in the future",
+                         value_checker.check("date_not_in_future", "2020"))
+        self.assertIsNone(
+            value_checker.check("date_not_in_future", "1999-12-31"))
+
+    def test_validate_metadata_df_max_errors_per_field(self):
+        """Test that a field stops being validated once its error budget is used up."""
+        truncated_msg = ["more than 1 validation errors in this field; "
+                         "validation of this field stopped here"]
+        exp = [(SAMPLE_NAME_KEY, "field_name"),
+               ("s1", "host_taxid"), ("s1", "project_name"),
+               ("s2", "age"), ("s2", "code"), ("s2", "collection_date"),
+               ("s2", "host_taxid"), ("s2", "project_name"), ("s2", "sex"),
+               ("s3", "code"), ("s3", "sex"),
+               ("s4", "age"), ("s4", "collection_date")]
+        exp_truncated = [("s2", "host_taxid"), ("s2", "project_name"),
+                         ("s3", "code"), ("s3", "sex"),
+                         ("s4", "age"), ("s4", "collection_date")]
+
+        for curr_chunk_size in [1000, 1]:
+            for curr_engine in [CERBERUS_ENGINE, VECTORIZED_ENGINE]:
+                with patch.object(metadata_validator,
+                                  "ERROR_BUDGET_CHUNK_SIZE", curr_chunk_size):
+                    obs = validate_metadata_df(
+                        self._make_metadata_df(), self.FIELDS_DICT,
+                        engine=curr_engine, max_errors_per_field=1)
+                self.assertEqual(
+                    exp[1:], [(x[SAMPLE_NAME_KEY], x["field_name"])
+                              for x in obs])
+                self.assertEqual(
+                    exp_truncated,
+                    [(x[SAMPLE_NAME_KEY], x["field_name"]) for x in obs
+                     if x["error_message"] == truncated_msg])
+            # next engine
+        # next chunk size
+
+    def test_validate_metadata_df_max_errors_per_field_stops(self):
+        """Test that a truncated field is not checked in later chunks."""
+        with patch.object(metadata_validator, "ERROR_BUDGET_CHUNK_SIZE", 1), \
+                patch.object(
+                    metadata_validator.parser, "parse",
+                    wraps=metadata_validator.parser.parse) as mock_parse:
+            validate_metadata_df(
+                self._make_metadata_df(), self.FIELDS_DICT,
+                max_errors_per_field=0)
+        self.assertEqual(["2020-01-01", "3020-01-01"],
+                         [x.args[0] for x in mock_parse.call_args_list])
+
+    def test_validate_metadata_df_max_errors(self):
+        """Test that validation stops once the run's error budget is used up."""
+        for curr_engine in [CERBERUS_ENGINE, VECTORIZED_ENGINE]:
+            obs = validate_metadata_df(
+                self._make_metadata_df(), self.FIELDS_DICT,
+                engine=curr_engine, max_errors=5)
+            self.assertEqual(
+                [("s1", "host_taxid"), ("s1", "project_name"), ("s2", "age"),
+                 ("s2", "code"), ("s2", "collection_date"),
+                 ("s2", "host_taxid")],
+                [(x[SAMPLE_NAME_KEY], x["field_name"]) for x in obs])
+            self.assertEqual(
+                ["more than 5 validation errors; validation stopped here"],
+                obs[-1]["error_message"])
+        # next engine
+
+        # a budget that is never used up changes nothing
+        self.assertEqual(
+            validate_metadata_df(self._make_metadata_df(), self.FIELDS_DICT),
+            validate_metadata_df(self._make_metadata_df(), self.FIELDS_DICT,
+                                 max_errors=100, max_errors_per_field=100))
+
+    def test_validate_metadata_df_err_max_errors(self):
+        """Test that bad error budgets raise errors."""
+        with self.assertRaisesRegex(
+                ValueError, "max_errors_per_field must not be negative"):
+            validate_metadata_df(self._make_metadata_df(), self.FIELDS_DICT,
+                                 max_errors_per_field=-1)
+        with self.assertRaisesRegex(
+                ValueError, "Error budgets are not supported with n_jobs"):
+            validate_metadata_df(self._make_metadata_df(), self.FIELDS_DICT,
+                                 n_jobs=2, max_errors=10)
+
+    def test_cast_col_to_types(self):
+        """Test that casting a column gives the values and dtype of casting each value."""
+        mixed_col = pandas.Series(
+            ["12", " 7 ", "1_000", "2.5", "nan", "1e400", "", "abc", "abc",
+             12, True, 2.5, -0.0, np.nan, float("inf"), 2 ** 70, None],
+            dtype=object)
+        test_cols = [
+            mixed_col,
+            pandas.Series([1.5, -2.7, 3.0, 3.0]),
+            pandas.Series([1, 2, 2]),
+            pandas.Series([True, False]),
+            pandas.Series(["1", pandas.NA, "x"], dtype="string"),
+            pandas.Series(["1", "2", np.nan], dtype="category")]
+        for curr_col in test_cols:
+            for curr_types in [[str], [float, str], [int, str], [bool],
+                               [int, float, str], [float, bool]]:
+                exp = _get_object_col(curr_col).apply(
+                    lambda x: _cast_field_to_type(x, curr_types))
+                obs = _cast_col_to_types(curr_col, curr_types)
+                assert_series_equal(exp, obs)
+                # compare types too, since 1 == 1.0 == True
+                self.assertEqual([type(x) for x in exp.tolist()],
+                                 [type(x) for x in obs.tolist()])
+            # next list of types
+        # next column
+
+    def test_cast_col_to_types_err(self):
+        """Test that the first value no allowed type takes raises an error."""
+        with self.assertRaisesRegex(
+                ValueError, "Unable to cast 'abc' to any of the allowed "
+                            "types"):
+            _cast_col_to_types(
+                pandas.Series(["1", "abc", "nan", "abc"], dtype=object),
+                [int, float])
+        with self.assertRaisesRegex(ValueError, "Unable to cast 'nan'"):
+            _cast_col_to_types(pandas.Series([1.0, np.nan]), [int])
+
+    def test_cast_col_to_types_keep_uncastable(self):
+        """Test that values no allowed type takes can be kept rather than raising."""
+        for curr_col, curr_exp in [
+                (pandas.Series(["1", "abc", "nan", "abc"], dtype=object),
+                 [1, "abc", "nan", "abc"]),
+                (pandas.Series(["1", "abc"], dtype="category"), [1, "abc"])]:
+            obs = _cast_col_to_types(curr_col, [int], keep_uncastable=True)
+            self.assertEqual(curr_exp, obs.tolist())
+        # next column
+
+    def test_validate_metadata_df_keep_uncastable(self):
+        """Test that uncastable values can fail validation with a type error."""
+        metadata_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2"],
+            "host_taxid": ["9606", "abc"]})
+        fields_dict = {"host_taxid": self.FIELDS_DICT["host_taxid"]}
+
+        with self.assertRaisesRegex(ValueError, "Unable to cast 'abc'"):
+            validate_metadata_df(metadata_df, fields_dict)
+        for curr_engine in [CERBERUS_ENGINE, VECTORIZED_ENGINE]:
+            obs = validate_metadata_df(
+                metadata_df, fields_dict, engine=curr_engine,
+                keep_uncastable=True)
+            self.assertEqual(
+                [{SAMPLE_NAME_KEY: "s2", "field_name": "host_taxid",
+                  "error_message": ["must be of integer type"]}], obs)
+        # next engine
+
+    def test_convert_numeric_text(self):
+        """Test that only the numeric text of non-string fields becomes numbers."""
+        metadata_df = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            "age": ["1.50", "not provided", "", "inf"],
+            "code": ["1.50", "AB1", "", "2"],
+            "host_taxid": ["9606.0", "9606", "abc", "nan"]})
+
+        obs = convert_numeric_text(metadata_df, self.FIELDS_DICT)
+
+        exp = pandas.DataFrame({
+            SAMPLE_NAME_KEY: ["s1", "s2", "s3", "s4"],
+            "age": [1.5, "not provided", "", "inf"],
+            "code": ["1.50", "AB1", "", "2"],
+            "host_taxid": [9606.0, 9606.0, "abc", "nan"]})
+        assert_frame_equal(exp, obs)
+        # the input is not modified
+        self.assertEqual("1.50", metadata_df.loc[0, "age"])
@@ -3,11 +3,19 @@ import pandas
 from pandas.testing import assert_frame_equal
 import os
 import os.path as path
+import tempfile
+import tracemalloc
 from unittest import TestCase
+from unittest.mock import patch
 from qiimp.src.util import _get_grandparent_dir, extract_config_dict, \
     extract_yaml_dict, extract_stds_config, deepcopy_dict, \
     validate_required_columns_exist, update_metadata_df_field, get_extension, \
-    load_df_with_best_fit_encoding
+    update_metadata_df_fields, fill_nas_with_constant, \
+    load_df_with_best_fit_encoding, extract_cached_yaml_dict, get_cache_dir, \
+    load_df_chunks_with_best_fit_encoding, convert_str_cols_to_string_dtype, \
+    fingerprint_obj, fingerprint_file, get_stds_fp, CACHE_DIR_ENV_VAR, \
+    StageTimer, STAGE_NAME_KEY, STAGE_SECONDS_KEY, STAGE_ROWS_IN_KEY, \
+    STAGE_ROWS_OUT_KEY, STAGE_BYTES_KEY
 
 
 class TestUtil(TestCase):
@@ -33,6 +41,17 @@ class TestUtil(TestCase):
             }
         }
 
+    def setUp(self):
+        # keep the tests' cache files out of the user's real cache directory
+        self._cache_dir = tempfile.TemporaryDirectory()
+        self._cache_env_patcher = patch.dict(
+            os.environ, {CACHE_DIR_ENV_VAR: self._cache_dir.name})
+        self._cache_env_patcher.start()
+
+    def tearDown(self):
+        self._cache_env_patcher.stop()
+        self._cache_dir.cleanup()
+
     # Tests for extract_config_dict
     def test_extract_config_dict_w_config_fp(self):
         """Test extracting config dictionary from a valid config file path."""
@@ -98,6 +117,153 @@ class TestUtil(TestCase):
         config = extract_stds_config(path.join(self.TEST_DIR, "data/test_config.yml"))
         self.assertDictEqual(config, self.TEST_CONFIG_DICT)
 
+    def test_extract_stds_config_w_cache(self):
+        """Test that cached and uncached standards configurations are identical."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.dict(os.environ, {CACHE_DIR_ENV_VAR: cache_dir}):
+                obs_first = extract_stds_config(None)
+                obs_second = extract_stds_config(None)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+        exp = extract_stds_config(None, use_cache=False)
+        self.assertDictEqual(exp, obs_first)
+        self.assertDictEqual(exp, obs_second)
+        self.assertIsNot(obs_first, obs_second)
+
+    # Tests for extract_cached_yaml_dict
+    def test_extract_cached_yaml_dict(self):
+        """Test that a second extraction of the same file is read from the cache."""
+        config_fp = path.join(self.TEST_DIR, "data/test_config.yml")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            obs = extract_cached_yaml_dict(config_fp, cache_dir)
+            self.assertDictEqual(self.TEST_CONFIG_DICT, obs)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            with patch("qiimp.src.util.yaml.safe_load") as mock_load:
+                obs = extract_cached_yaml_dict(config_fp, cache_dir)
+            mock_load.assert_not_called()
+            self.assertDictEqual(self.TEST_CONFIG_DICT, obs)
+
+    def test_extract_cached_yaml_dict_changed_file(self):
+        """Test that changing the contents of a file invalidates its cache entry."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            yaml_fp = path.join(temp_dir, "changing.yml")
+            with open(yaml_fp, "w") as f:
+                f.write("a: 1\n")
+            self.assertDictEqual(
+                {"a": 1}, extract_cached_yaml_dict(yaml_fp, temp_dir))
+
+            with open(yaml_fp, "w") as f:
+                f.write("a: 2\n")
+            self.assertDictEqual(
+                {"a": 2}, extract_cached_yaml_dict(yaml_fp, temp_dir))
+
+    def test_extract_cached_yaml_dict_prunes_cache(self):
+        """Test that only the most recently used cache entries are kept."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = path.join(temp_dir, "cache")
+            yaml_fps = []
+            for i in range(3):
+                yaml_fps.append(path.join(temp_dir, f"config_{i}.yml"))
+                with open(yaml_fps[-1], "w") as f:
+                    f.write(f"a: {i}\n")
+
+            with patch("qiimp.src.util.MAX_CACHE_FILES", 2):
+                extract_cached_yaml_dict(yaml_fps[0], cache_dir)
+                first_fp = path.join(cache_dir, os.listdir(cache_dir)[0])
+                extract_cached_yaml_dict(yaml_fps[1], cache_dir)
+                # age the first entry, then re-read it so the second entry
+                # becomes the least recently used one
+                os.utime(first_fp, (0, 0))
+                extract_cached_yaml_dict(yaml_fps[0], cache_dir)
+                extract_cached_yaml_dict(yaml_fps[2], cache_dir)
+                self.assertEqual(2, len(os.listdir(cache_dir)))
+
+                with patch("qiimp.src.util.yaml.safe_load") as mock_load:
+                    self.assertDictEqual(
+                        {"a": 0},
+                        extract_cached_yaml_dict(yaml_fps[0], cache_dir))
+                mock_load.assert_not_called()
+
+    def test_extract_cached_yaml_dict_corrupt_cache(self):
+        """Test that an unreadable cache entry is ignored and replaced."""
+        config_fp = path.join(self.TEST_DIR, "data/test_config.yml")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            extract_cached_yaml_dict(config_fp, cache_dir)
+            cache_fp = path.join(cache_dir, os.listdir(cache_dir)[0])
+            with open(cache_fp, "wb") as f:
+                f.write(b"not a pickle")
+
+            obs = extract_cached_yaml_dict(config_fp, cache_dir)
+            self.assertDictEqual(self.TEST_CONFIG_DICT, obs)
+            self.assertDictEqual(
+                self.TEST_CONFIG_DICT,
+                extract_cached_yaml_dict(config_fp, cache_dir))
+
+    def test_extract_cached_yaml_dict_unwritable_cache(self):
+        """Test that an unwritable cache directory does not prevent extraction."""
+        config_fp = path.join(self.TEST_DIR, "data/test_config.yml")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # a path *under a file* can never be created as a directory
+            blocking_fp = path.join(temp_dir, "blocker")
+            with open(blocking_fp, "w") as f:
+                f.write("")
+
+            obs = extract_cached_yaml_dict(
+                config_fp, path.join(blocking_fp, "cache"))
+        self.assertDictEqual(self.TEST_CONFIG_DICT, obs)
+
+    # Tests for get_cache_dir
+    def test_get_cache_dir(self):
+        """Test that the cache directory is taken from the input, then the environment."""
+        self.assertEqual("/my/cache", get_cache_dir("/my/cache"))
+        with patch.dict(os.environ, {CACHE_DIR_ENV_VAR: "/env/cache"}):
+            self.assertEqual("/env/cache", get_cache_dir())
+
+        with patch.dict(os.environ, {CACHE_DIR_ENV_VAR: ""}):
+            self.assertTrue(get_cache_dir().endswith("qiimp"))
+
+    # Tests for get_stds_fp
+    def test_get_stds_fp(self):
+        """Test that the standards path defaults to the packaged standards file."""
+        self.assertTrue(get_stds_fp().endswith("standards.yml"))
+        self.assertEqual("my_stds.yml", get_stds_fp("my_stds.yml"))
+
+    # Tests for fingerprint_file
+    def test_fingerprint_file(self):
+        """Test that files with the same contents have the same fingerprint."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fps = [path.join(temp_dir, x) for x in ["a.yml", "b.yml", "c.yml"]]
+            for curr_fp, curr_contents in zip(fps, ["a: 1", "a: 1", "a: 2"]):
+                with open(curr_fp, "w") as f:
+                    f.write(curr_contents)
+
+            self.assertEqual(fingerprint_file(fps[0]), fingerprint_file(fps[1]))
+            self.assertNotEqual(
+                fingerprint_file(fps[0]), fingerprint_file(fps[2]))
+
+    # Tests for fingerprint_obj
+    def test_fingerprint_obj_equal(self):
+        """Test that equal but distinct dicts have the same fingerprint."""
+        first = {"a": 1, "b": {"c": [1, 2], "d": None}}
+        second = {"a": 1, "b": {"c": [1, 2], "d": None}}
+        self.assertEqual(fingerprint_obj(first), fingerprint_obj(second))
+
+    def test_fingerprint_obj_keeps_dict_order(self):
+        """Test that dicts differing only in key order have different fingerprints."""
+        first = {"a": 1, "b": {"c": [1, 2], "d": None}}
+        second = {"a": 1, "b": {"d": None, "c": [1, 2]}}
+        self.assertNotEqual(fingerprint_obj(first), fingerprint_obj(second))
+
+    def test_fingerprint_obj_differs(self):
+        """Test that dicts with different contents have different fingerprints."""
+        first = {"a": 1, "b": {"c": [1, 2]}}
+        self.assertNotEqual(
+            fingerprint_obj(first), fingerprint_obj({"a": 1, "b": {"c": [2, 1]}}))
+        self.assertNotEqual(
+            fingerprint_obj(first), fingerprint_obj({"a": "1", "b": {"c": [1, 2]}}))
+        self.assertNotEqual(fingerprint_obj(None), fingerprint_obj({}))
+
     # Tests for deepcopy_dict
     def test_deepcopy_dict(self):
         """Test deep copying of nested dictionary structure.
@@ -146,6 +312,39 @@ class TestUtil(TestCase):
             if path.exists(test_file):
                 os.remove(test_file)
 
+    def test_load_df_with_best_fit_encoding_nrows(self):
+        """Test loading only the header of a file."""
+        test_data = "col1,col2\nval1,val2"
+        test_file = path.join(self.TEST_DIR, "data/test_nrows.csv")
+        with open(test_file, "w", encoding="utf-8") as f:
+            f.write(test_data)
+
+        try:
+            df = load_df_with_best_fit_encoding(test_file, ",", nrows=0)
+            self.assertEqual(len(df), 0)
+            self.assertEqual(df.columns.tolist(), ["col1", "col2"])
+        finally:
+            if path.exists(test_file):
+                os.remove(test_file)
+
+    def test_load_df_with_best_fit_encoding_string_storage(self):
+        """Test loading DataFrame with string columns as the pandas string dtype."""
+        test_data = "col1,col2\nval1,1\n,2"
+        test_file = path.join(self.TEST_DIR, "data/test_string_storage.csv")
+        with open(test_file, "w", encoding="utf-8") as f:
+            f.write(test_data)
+
+        try:
+            df = load_df_with_best_fit_encoding(
+                test_file, ",", string_storage="python")
+            self.assertEqual(pandas.StringDtype("python"), df["col1"].dtype)
+            self.assertEqual("val1", df.loc[0, "col1"])
+            self.assertIs(pandas.NA, df.loc[1, "col1"])
+            self.assertEqual(np.int64, df["col2"].dtype)
+        finally:
+            if path.exists(test_file):
+                os.remove(test_file)
+
     def test_load_df_with_best_fit_encoding_invalid_file(self):
         """Test that attempting to load DataFrame from non-existent file raises ValueError."""
         with self.assertRaises(ValueError):
@@ -162,6 +361,68 @@ class TestUtil(TestCase):
             if path.exists(test_file):
                 os.remove(test_file)
 
+    # Tests for convert_str_cols_to_string_dtype
+    def test_convert_str_cols_to_string_dtype(self):
+        """Test that only object columns holding just strings are converted."""
+        input_df = pandas.DataFrame({
+            "str_col": ["a", np.nan, "c"],
+            "mixed_col": ["a", 1.5, "c"],
+            "float_col": [1.5, np.nan, 2.5],
+            "empty_col": [np.nan, np.nan, np.nan]
+        })
+
+        obs = convert_str_cols_to_string_dtype(input_df, "python")
+        self.assertEqual(pandas.StringDtype("python"), obs["str_col"].dtype)
+        self.assertEqual(["a", pandas.NA, "c"], obs["str_col"].tolist())
+        self.assertEqual(
+            [object, np.float64, np.float64],
+            obs[["mixed_col", "float_col", "empty_col"]].dtypes.tolist())
+        # the input is not modified
+        self.assertEqual(object, input_df["str_col"].dtype)
+
+    def test_convert_str_cols_to_string_dtype_err(self):
+        """Test that an unrecognized string storage raises ValueError."""
+        with self.assertRaisesRegex(
+                ValueError, "Unrecognized string storage 'bogus'"):
+            convert_str_cols_to_string_dtype(
+                pandas.DataFrame({"a": ["b"]}), "bogus")
+
+    # Tests for load_df_chunks_with_best_fit_encoding
+    def test_load_df_chunks_with_best_fit_encoding(self):
+        """Test loading a non-UTF-8 file in chunks of rows."""
+        test_data = "col1,col2\nval1,caf\u00e9\nval2,b\nval3,c"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test_file = path.join(temp_dir, "test_latin1.csv")
+            with open(test_file, "w", encoding="latin1") as f:
+                f.write(test_data)
+
+            with load_df_chunks_with_best_fit_encoding(
+                    test_file, ",", 2) as reader:
+                chunks = list(reader)
+
+        self.assertEqual([2, 1], [len(x) for x in chunks])
+        self.assertEqual(["col1", "col2"], chunks[1].columns.tolist())
+        self.assertEqual("caf\u00e9", chunks[0].iloc[0]["col2"])
+        self.assertEqual("val3", chunks[1].iloc[0]["col1"])
+
+    def test_load_df_chunks_with_best_fit_encoding_whole_file_dtypes(self):
+        """Test that every chunk gets the dtypes inferred for the whole file."""
+        test_data = "ints,floats,mixed\n1,1,5\n2,,\n3,3,7\n4,4,ten\n"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test_file = path.join(temp_dir, "test.csv")
+            with open(test_file, "w") as f:
+                f.write(test_data)
+
+            exp_df = pandas.read_csv(test_file)
+            with load_df_chunks_with_best_fit_encoding(
+                    test_file, ",", 2) as reader:
+                chunks = list(reader)
+
+        for curr_chunk in chunks:
+            self.assertEqual(
+                exp_df.dtypes.tolist(), curr_chunk.dtypes.tolist())
+        assert_frame_equal(exp_df, pandas.concat(chunks))
+
     # Tests for validate_required_columns_exist
     def test_validate_required_columns_exist_empty_df(self):
         """Test that validation of required columns in an empty DataFrame raises ValueError."""
@@ -436,6 +697,156 @@ class TestUtil(TestCase):
             ["sample_name", "sample_type"], overwrite_non_nans=True)
         assert_frame_equal(exp_df, working_df)
 
+    def test_update_metadata_df_field_string_dtype(self):
+        """Test that a string dtype field becomes an object field when given a non-string value."""
+        input_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2"],
+            "taxon_id": ["408170", np.nan]
+        }).astype("string[python]")
+
+        update_metadata_df_field(
+            input_df, "sample_name", "s0", overwrite_non_nans=False)
+        update_metadata_df_field(
+            input_df, "taxon_id", 9606, overwrite_non_nans=False)
+
+        self.assertEqual(
+            pandas.StringDtype("python"), input_df["sample_name"].dtype)
+        self.assertEqual(object, input_df["taxon_id"].dtype)
+        self.assertEqual(["408170", 9606], input_df["taxon_id"].tolist())
+
+    # Tests for update_metadata_df_fields
+    def test_update_metadata_df_fields(self):
+        """Test that many fields can be added or updated at once."""
+        input_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2"],
+            "sample_type": ["st1", np.nan]
+        })
+
+        exp_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2"],
+            "sample_type": ["st1", "bacon"],
+            "new_field": ["eggs", "eggs"],
+            "another_field": ["toast", "toast"]
+        })
+
+        obs = update_metadata_df_fields(
+            input_df,
+            {"new_field": "eggs", "sample_type": "bacon",
+             "another_field": "toast"},
+            overwrite_non_nans=False)
+        assert_frame_equal(exp_df, obs)
+        # the input is not modified
+        self.assertEqual(["sample_name", "sample_type"],
+                         input_df.columns.tolist())
+        self.assertTrue(pandas.isna(input_df.loc[1, "sample_type"]))
+
+    def test_update_metadata_df_fields_no_copy(self):
+        """Test that existing fields are updated in place when not copying."""
+        input_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2"],
+            "sample_type": ["st1", np.nan]
+        })
+
+        exp_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2"],
+            "sample_type": ["st1", "bacon"]
+        })
+
+        obs = update_metadata_df_fields(
+            input_df, {"sample_type": "bacon"}, overwrite_non_nans=False,
+            copy=False)
+        self.assertIs(input_df, obs)
+        assert_frame_equal(exp_df, input_df)
+
+    def test_update_metadata_df_fields_matches_single_updates(self):
+        """Test that bulk updates give the same values and dtypes as single updates."""
+        field_vals_dict = {
+            "str_field": "bacon", "int_field": 5, "float_field": 2.5,
+            "bool_field": True, "none_field": None, "sample_type": "eggs"}
+        input_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2"],
+            "sample_type": ["st1", np.nan]
+        }, index=[3, 7])
+
+        exp_df = input_df.copy()
+        for curr_field_name, curr_val in field_vals_dict.items():
+            update_metadata_df_field(
+                exp_df, curr_field_name, curr_val, overwrite_non_nans=True)
+
+        obs = update_metadata_df_fields(
+            input_df, field_vals_dict, overwrite_non_nans=True)
+        assert_frame_equal(exp_df, obs)
+
+    # Tests for fill_nas_with_constant
+    def test_fill_nas_with_constant(self):
+        """Test that NaNs are filled as by fillna, with one shared fill value object."""
+        input_df = pandas.DataFrame({
+            "sample_name": ["s1", "s2", "s3"],
+            "sample_type": pandas.Series(["st1", np.nan, None], dtype=object),
+            "weight": [1.5, np.nan, 2.0],
+            "skipped": pandas.Series([np.nan, "a", "b"], dtype=object)
+        })
+        fill_val = "not provided"
+
+        obs = fill_nas_with_constant(
+            input_df, fill_val, skip_cols=["skipped"])
+
+        exp_df = input_df.fillna(
+            {"sample_type": fill_val, "weight": fill_val})
+        assert_frame_equal(exp_df, obs)
+        self.assertIs(obs.loc[1, "sample_type"], obs.loc[2, "sample_type"])
+        # the input is not modified
+        self.assertTrue(pandas.isna(input_df.loc[1, "sample_type"]))
+
+    # Tests for StageTimer
+    def test_stage_timer(self):
+        """Test that each timed stage reports its event to the callback."""
+        events = []
+        timer = StageTimer(events.append)
+        with timer.time_stage("first", 3, host_type="human") as event:
+            event[STAGE_ROWS_OUT_KEY] = 2
+        with timer.time_stage("second", 2):
+            pass
+
+        self.assertEqual(["first", "second"],
+                         [x[STAGE_NAME_KEY] for x in events])
+        self.assertEqual("human", events[0]["host_type"])
+        self.assertEqual([3, 2], [x[STAGE_ROWS_IN_KEY] for x in events])
+        self.assertEqual([2, 2], [x[STAGE_ROWS_OUT_KEY] for x in events])
+        for curr_event in events:
+            self.assertGreaterEqual(curr_event[STAGE_SECONDS_KEY], 0)
+            # memory isn't traced unless tracemalloc is tracing
+            self.assertIsNone(curr_event[STAGE_BYTES_KEY])
+
+    def test_stage_timer_trace_memory(self):
+        """Test that bytes allocated are reported while tracemalloc is tracing."""
+        events = []
+        tracemalloc.start()
+        try:
+            with StageTimer(events.append).time_stage("alloc", 1):
+                big_list = [0] * 200000
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(200000, len(big_list))
+        self.assertGreaterEqual(events[0][STAGE_BYTES_KEY], 800000)
+
+    def test_stage_timer_no_callback(self):
+        """Test that a timer without a callback reports nothing and doesn't time."""
+        timer = StageTimer()
+        with timer.time_stage("first", 3) as event:
+            pass
+        timer.report(event)
+        self.assertNotIn(STAGE_SECONDS_KEY, event)
+
+    def test_stage_timer_error(self):
+        """Test that a stage that errors is not reported."""
+        events = []
+        with self.assertRaises(ValueError):
+            with StageTimer(events.append).time_stage("first", 3):
+                raise ValueError("bad stage")
+        self.assertEqual([], events)
+
     # Tests for _get_grandparent_dir
     def test__get_grandparent_dir_no_fp(self):
         """Test getting grandparent directory without file path."""